@@ -15,8 +15,13 @@ from core.exceptions import StateError
 from game.thdeck import THDeckOriginal, THDeckSixes
 from game.table import Table
 from game.player import Player, Spectator
+from game.deck import CardHolder, Deck, DiscardPile
 from game.deck.card import Card
 from core.decorators import classproperty
+from store import LazyController
+from store.user.elo import record_ranked_game
+from store.user.statistics import StatisticsAccumulator
+from store.user.pairs import PairRatings
 
 
 # noinspection PyAttributeOutsideInit
@@ -28,10 +33,21 @@ class Game(DataModelController):
         :type SpecMode: Enum -- Spectator mode option values.
         :type DEFAULT_OPTIONS: DotDict -- Game option defaults.
         :type MODEL_RULES: dict -- Rule set for underlying `DataModel`.
+        :type MODEL_INDEXES: dict -- Indexed model fields.
+        :type journal: MoveJournal | None -- Write-ahead journal that
+            accepted table moves are appended to, once installed.
+        :type leases: LeaseManager | None -- Leases new games are taken
+            under and game units are registered with, once installed.
+        :type UNIT_TYPES: tuple -- Doc types of the controllers cached as a
+            unit with a game (see `cache_members`).
+        :type LAZY_RESTORE: bool -- Restored from the game document alone
+            by `DataStore.get_controller` (see `restore`).
 
     Class Methods:
         load -- Load new Game object from existing DataModel.
         get -- Load new Game object from existing game_id.
+        get_lazy -- Load Game object touching only the game document.
+        new_match -- Create a game with all four players seated.
 
     New Parameters:
         creating_user -- The user that created the game room.
@@ -46,6 +62,12 @@ class Game(DataModelController):
         :type table: Table -- The game table.
         :type state: Game.State/str -- The current game state.
         :type spectators: list -- List of active `Spectator` ids.
+        :type stat_deltas: dict -- Round statistics buffered until the game
+            ends (see `StatisticsAccumulator`).
+        :type hands: list -- Records of the finished hands: the table's
+            `hand_record` plus the bid, trump and points.
+        :type cache_priority: int | None -- Cache eviction priority; running
+            games are pinned and finished games are evicted first.
 
     Public Methods:
         new_game -- Start a new game to `options.win_amount` points.
@@ -55,6 +77,7 @@ class Game(DataModelController):
         add_spectator -- Add new spectator to game.
         remove_spectator -- Remove spectator from the game.
         remove_spectator_by_user_id -- Remove spectator by user_Id.
+        cache_members -- Sub-controllers cached and evicted with the game.
 
     """
 
@@ -66,9 +89,23 @@ class Game(DataModelController):
         'spec_mode': 'STANDARD',
         'spec_allow_chat': True,
         'spec_max': 4,
-        'win_amount': 200
+        'win_amount': 200,
+        'ranked': False
     }
 
+    MODEL_INDEXES = {
+        'state': {}
+    }
+
+    journal = None
+
+    leases = None
+
+    LAZY_RESTORE = True
+
+    UNIT_TYPES = (Player, Spectator, Table, Deck, THDeckOriginal, THDeckSixes,
+                  CardHolder, DiscardPile)
+
     # noinspection PyCallByClass,PyTypeChecker,PyMethodParameters
     @classproperty
     def MODEL_RULES(cls):
@@ -81,7 +118,9 @@ class Game(DataModelController):
             'points': ('points', Collection.Dict(int), None),
             'spectators': ('spectators', Collection.List(DataModel),
                            lambda x: x.model if x else DataModel.Null),
-            'options': ('options', Collection.Dict, None)
+            'options': ('options', Collection.Dict, None),
+            'stat_deltas': ('stat_deltas', Collection.Dict(dict), None),
+            'hands': ('hands', Collection.List(dict), None)
         })
         return rules
 
@@ -95,7 +134,9 @@ class Game(DataModelController):
             'state': Game.State.CREATED,
             'points': {'A': 0, 'B': 0},
             'options': DotDict(Game.DEFAULT_OPTIONS),
-            'table': None
+            'table': None,
+            'stat_deltas': {},
+            'hands': []
         })
         return defaults
 
@@ -132,27 +173,117 @@ class Game(DataModelController):
         if not options:
             options = {}
         ctrl = super(Game, cls).new(data_store, **kwargs)
+        if cls.leases:
+            cls.leases.acquire(ctrl.uid)
         ctrl.options.update(options)
         ctrl.add_player(creating_user, 0)
         return ctrl
 
+    @classmethod
+    def new_match(cls, data_store, team_a, team_b, options=None):
+        """Create a game with all four players seated at once.
+
+        Players are created and the game model written in one go, instead
+        of one `add_player` update per seat.
+
+        :param data_store: The DataStore controller.
+        :param team_a: list -- The two `User`s of team A.
+        :param team_b: list -- The two `User`s of team B.
+        :param options: dict | None -- Game options to override.
+        :return: Game -- The game, in state `READY`.
+        """
+        players = [None] * 4
+        for team, users, slots in (('A', team_a, (0, 2)),
+                                   ('B', team_b, (1, 3))):
+            for user, slot in zip(users, slots):
+                players[slot] = Player.new(user, team, data_store)
+        ctrl = super(Game, cls).new(data_store, players=players,
+                                    state=Game.State.READY)
+        if cls.leases:
+            cls.leases.acquire(ctrl.uid)
+        ctrl._register_unit()
+        ctrl.options.update(options or {})
+        return ctrl
+
     # noinspection PyMethodOverriding
     @classmethod
-    def restore(cls, data_store, data_model):
+    def restore(cls, data_store, data_model, prefetch=None):
+        """Restore Game controller from its model.
+
+        Players, spectators and the table are restored lazily, on first
+        attribute access, unless named in `prefetch`. The table of a running
+        or paused game is watched for round ends and moves to journal from
+        when it is restored.
+
+        :param data_store: The DataStore controller.
+        :param data_model: DataModel -- The stored game model.
+        :param prefetch: list | None -- Members to restore eagerly; any of
+            'players', 'spectators' and 'table'.
+        :return: Game
+        """
+        if prefetch is None:
+            prefetch = ()
+
+        def member(doc_type, key, x):
+            if x is DataModel.Null or x is None:
+                return None
+            proxy = LazyController(doc_type, data_store, x)
+            return proxy.resolve() if key in prefetch else proxy
+
         kwargs = {
-            'players':
-                [Player.restore(data_store, x) if x is not DataModel.Null
-                 else None for x in data_model.players],
-            'spectators':
-                [Spectator.restore(data_store, x)
-                 for x in data_model.spectators],
+            'players': [member(Player, 'players', x)
+                        for x in data_model.players],
+            'spectators': [member(Spectator, 'spectators', x)
+                           for x in data_model.spectators],
             'state': data_model.state,
-            'table': (Table.restore(data_store, data_model.table)
-                      if data_model.table is not DataModel.Null else None),
+            'table': member(Table, 'table', data_model.table),
             'points': data_model.points,
-            'options': DotDict(data_model.options)
+            'options': DotDict(data_model.options),
+            'stat_deltas': data_model.get('stat_deltas') or {},
+            'hands': data_model.get('hands') or []
         }
-        return super(Game, cls).restore(data_store, data_model, **kwargs)
+        ctrl = super(Game, cls).restore(data_store, data_model, **kwargs)
+        ctrl._register_unit()
+        table = kwargs['table']
+        if table and ctrl.state in (Game.State.RUNNING, Game.State.PAUSED):
+            if isinstance(table, LazyController):
+                table.on_resolve(lambda t: ctrl._watch_table())
+            else:
+                ctrl._watch_table()
+        return ctrl
+
+    @classmethod
+    def get_lazy(cls, data_store, uid, prefetch=None):
+        """Load Game controller reading only the game document.
+
+        Suited to lobby listings and other callers that only need `state`,
+        `points` or `options`; sub-controllers are loaded on first use.
+
+        :param data_store: The DataStore controller.
+        :param uid: str -- The game ID.
+        :param prefetch: list | None -- Members to restore eagerly (see
+            `Game.restore`).
+        :return: Game
+        """
+        return data_store.get_controller(cls, uid, prefetch=prefetch or [])
+
+    @property
+    def cache_priority(self):
+        if self.state == Game.State.RUNNING:
+            return None
+        if self.state == Game.State.END:
+            return 0
+        return 1
+
+    def cache_members(self):
+        """Sub-controllers cached and evicted as a unit with the game.
+
+        :return: list -- Players, spectators and the table.
+        """
+        members = [p for p in self.players if p] + list(self.spectators)
+        if self.table:
+            members.append(self.table)
+        return members
 
     def active_players(self, team=None):
         if team:
@@ -174,6 +305,19 @@ class Game(DataModelController):
         self.points = {'A': 0, 'B': 0}
         self.table = Table.new([p.uid for p in self.players],
                                deck, self._data_store)
+        self._register_unit()
+        self._watch_table()
+        self.table.setup()
+        self.state = Game.State.RUNNING
+
+    def _register_unit(self):
+        """Record the game's cache unit members with the data store, and
+        map them to its lease if leased."""
+        self._data_store.register_unit(self)
+        if Game.leases:
+            Game.leases.register(self)
+
+    def _watch_table(self):
         self.table.on_change('*', (
             lambda model, key, instruction:
                 self._call_listener(
@@ -182,32 +326,42 @@ class Game(DataModelController):
             lambda model, key, instruction:
                 self._table_round_end(model)
                 if model.state is Table.State.END else 0))
-        self.table.setup()
-        self.state = Game.State.RUNNING
+        self.table.on_change('moves', (
+            lambda model, key, instruction: self._journal_move()))
+
+    def _journal_move(self):
+        if Game.journal:
+            seq = len(self.table.moves) - 1
+            Game.journal.append(self.uid, seq, self.table.move_log.move(seq))
 
     def _table_round_end(self, model):
-        scores = {
-            'A': _points_calc(model.discards['A'].cards),
-            'B': _points_calc(model.discards['B'].cards)
-        }
+        scores = self.table.scores
+        assert scores == {
+            'A': _points_calc(self.table.discards['A'].cards),
+            'B': _points_calc(self.table.discards['B'].cards)
+        }, "Running discard points out of sync."
+        self._record_hand(model, scores)
+        stats = StatisticsAccumulator(self.stat_deltas)
         if scores[model.bet_team] >= model.bet_amount:
             # bet round win
             for p in self.players:
                 if p.team is model.bet_team:
-                    p.statistics.won_bet_round(model.bet_amount)
+                    stats.won_bet_round(p.user.statistics.uid,
+                                        model.bet_amount)
                 else:
-                    p.statistics.lost_counter_round()
+                    stats.lost_counter_round(p.user.statistics.uid)
             self._update_points(**scores)
         else:
             # counter round win
             s = scores[model.bet_team]
             for p in self.players:
                 if p.team is model.bet_team:
-                    p.statistics.lost_bet_round()
+                    stats.lost_bet_round(p.user.statistics.uid)
                 else:
-                    p.statistics.won_counter_round(100 - s)
+                    stats.won_counter_round(p.user.statistics.uid, 100 - s)
             scores[model.bet_team] = -1 * model.bet_amount
             self._update_points(**scores)
+        self._update_model('stat_deltas')
         if self.points['A'] >= self.options.win_amount:
             self._end_game('A')
         elif self.points['B'] >= self.options.win_amount:
@@ -215,6 +369,21 @@ class Game(DataModelController):
         else:
             self.table.restart()
 
+    def _update_points(self, **scores):
+        self.points = dict((team, points + scores.get(team, 0))
+                           for team, points in self.points.iteritems())
+
+    def _record_hand(self, model, scores):
+        record = dict(self.table.hand_record or {})
+        record.update({
+            'bet_team': model.bet_team,
+            'bet_amount': model.bet_amount,
+            'trump': self.table.trump_suit,
+            'points': [scores['A'], scores['B']]
+        })
+        self.hands.append(record)
+        self._update_model_collection('hands', {'action': 'append'})
+
     def _end_game(self, winning_team):
         losing_team = 'B' if winning_team is 'A' else 'A'
         teams = {
@@ -225,13 +394,28 @@ class Game(DataModelController):
             'A': _avg_elo(*teams['A']),
             'B': _avg_elo(*teams['B'])
         }
-        for i in xrange(2):
-            teams[winning_team][i].statistics.update_casual_game_stats(
-                self.uid, teams[winning_team][(i + 1) % 2].uid,
-                elos[losing_team], True)
-            teams[losing_team][i].statistics.update_casual_game_stats(
-                self.uid, teams[losing_team][(i + 1) % 2].uid,
-                elos[winning_team], False)
+        stats = StatisticsAccumulator(self.stat_deltas)
+        if self.options.get('ranked'):
+            record_ranked_game(
+                self._data_store, self.uid,
+                [p.user.statistics for p in teams['A']],
+                [p.user.statistics for p in teams['B']], winning_team == 'A')
+            for p in teams['A'] + teams['B']:
+                stats.flush(p.user.statistics)
+        else:
+            for i in xrange(2):
+                stats.flush(teams[winning_team][i].user.statistics, (
+                    self.uid, teams[winning_team][(i + 1) % 2].user.uid,
+                    elos[losing_team], True))
+                stats.flush(teams[losing_team][i].user.statistics, (
+                    self.uid, teams[losing_team][(i + 1) % 2].user.uid,
+                    elos[winning_team], False))
+        self._update_model('stat_deltas')
+        for team, other, win in ((winning_team, losing_team, True),
+                                 (losing_team, winning_team, False)):
+            PairRatings.record(self._data_store, teams[team][0].user.uid,
+                               teams[team][1].user.uid, elos[other], win,
+                               self.uid)
         self.state = Game.State.END
 
     def remove_player(self, p):
@@ -240,6 +424,8 @@ class Game(DataModelController):
         :param p: Player -- The `Player` to remove.
         """
         if self.state in (Game.State.RUNNING, Game.State.PAUSED):
+            StatisticsAccumulator(self.stat_deltas).flush(p.user.statistics)
+            self._update_model('stat_deltas')
             p.abandoned = True
             self._update_model('players')
             self.table.pause()
@@ -282,6 +468,7 @@ class Game(DataModelController):
         team = 'A' if slot in (0, 2) else 'B'
         if self.state is Game.State.CREATED:
             self.players[slot] = Player.new(user, team, self._data_store)
+            self._register_unit()
             self._update_model('players')
             if self.active_players() == 4:
                 self.state = Game.State.READY
@@ -306,6 +493,7 @@ class Game(DataModelController):
             raise ValueError("This game has reached the max allowed "
                              "spectators.")
         self.spectators.append(Spectator(user))
+        self._register_unit()
         self._update_model_collection('spectators', {'action': 'append'})
 
     def remove_spectator(self, spec):
@@ -349,9 +537,12 @@ def _avg_elo(*args):
     elo = 0.0
     games = 0
     for p in args:
-        _games = p.statistics.games_won + p.statistics.games_lost
-        elo += p.statistics.elo * _games
+        stats = p.user.statistics
+        _games = stats.games_won + stats.games_lost
+        elo += stats.elo * _games
         games += _games
+    if not games:
+        return sum(p.user.statistics.elo for p in args) / float(len(args))
     return elo / games
 
 
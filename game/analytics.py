@@ -0,0 +1,301 @@
+"""Vectorized queries over archived games.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class ArchiveQuery -- Filters and group-by aggregations over the
+        hands of a set of archive files.
+    :class QueryResult -- Query result columns, exportable as NumPy arrays
+        or CSV.
+
+Requires NumPy.
+
+"""
+
+import csv
+import os
+from collections import OrderedDict
+import numpy as np
+from game.archive import ArchiveFile, COLUMNS
+from game.deck.card import Card
+
+
+class QueryResult(object):
+    """Query result columns, in order.
+
+    Init Parameters:
+        columns -- OrderedDict of column name to 1-d array.
+
+    Properties:
+        :type columns: OrderedDict -- Column name to 1-d array.
+
+    Public Methods:
+        to_numpy -- The result as a NumPy record array.
+        to_csv -- Write the result as CSV.
+        rows -- The result as a list of tuples.
+
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        for values in self.columns.itervalues():
+            return len(values)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def to_numpy(self):
+        return np.rec.fromarrays([np.asarray(v) for v in
+                                  self.columns.itervalues()],
+                                 names=list(self.columns))
+
+    def rows(self):
+        return zip(*[v.tolist() for v in self.columns.itervalues()])
+
+    def to_csv(self, f):
+        """Write the result as CSV, with a header row.
+
+        :param f: str | file -- A path or an open file.
+        """
+        if isinstance(f, basestring):
+            with open(f, 'wb') as out:
+                return self.to_csv(out)
+        writer = csv.writer(f)
+        writer.writerow(list(self.columns))
+        writer.writerows(self.rows())
+
+
+class ArchiveQuery(object):
+    """Filters and group-by aggregations over the hands of archive files.
+
+    Every hand of every file is one row. Stored 'hands' columns are read
+    per file as memory maps: uncompressed blocks straight from the archive
+    file, compressed ones from a decompressed `.npy` copy made once in
+    `cache_dir`. Files are then concatenated per column, only for the
+    columns a query uses. Multi-dimensional columns ('kitty', 'deal',
+    'tricks', ...) keep their row shape.
+
+    Derived columns:
+        game -- Row of the hand's game over all files.
+        sixes -- Whether the game used the deck with sixes.
+        winner -- The game's winning team (0 for A, 1 for B).
+        bet_points -- Hand points of the bet team.
+        counter_points -- Hand points of the other team.
+        trump_length -- Trump cards the bettor held after taking the kitty.
+        kitty_aces -- Aces in the kitty.
+
+    Init Parameters:
+        paths -- An archive directory, or a list of archive files.
+        cache_dir -- Directory for decompressed columns; defaults to a
+            `<file>.cols` directory next to each archive file.
+
+    Properties:
+        :type size: int -- Number of hands.
+
+    Public Methods:
+        column -- A stored or derived column.
+        select -- Columns of the rows matching a filter.
+        group_by -- Aggregations per distinct key combination.
+
+    """
+
+    AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+    DENSE_GROUPS = 1 << 22
+
+    def __init__(self, paths, cache_dir=None):
+        if isinstance(paths, basestring):
+            paths = sorted(os.path.join(paths, f) for f in os.listdir(paths)
+                           if f.endswith('.p200a'))
+        self._files = [ArchiveFile(p) for p in paths]
+        self._cache_dir = cache_dir
+        self._columns = {}
+
+    @property
+    def size(self):
+        return sum(f.rows('hands') for f in self._files)
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def column(self, name):
+        """A stored or derived column over all files.
+
+        :param name: str -- A 'hands' column or a derived column.
+        :return: array
+        """
+        if name not in self._columns:
+            derive = getattr(self, '_derive_' + name, None)
+            if derive:
+                self._columns[name] = derive()
+            elif name in _HAND_COLUMNS:
+                self._columns[name] = self._concat('hands', name)
+            else:
+                raise ValueError("Unknown column: " + name)
+        return self._columns[name]
+
+    def select(self, names, where=None):
+        """Columns of the rows matching a filter.
+
+        :param names: list -- Column names.
+        :param where: callable | None -- Called with this query, returns a
+            boolean mask of the rows to keep, e.g.
+            `lambda q: q['bet_amount'] == 100`.
+        :return: QueryResult
+        """
+        mask = self._mask(where)
+        return QueryResult(OrderedDict(
+            (n, self.column(n)[mask] if mask is not None
+             else np.asarray(self.column(n))) for n in names))
+
+    def group_by(self, keys, aggregates, where=None):
+        """Aggregations per distinct combination of key columns.
+
+        :param keys: list -- Names of 1-d integer key columns.
+        :param aggregates: dict -- Result name to (function, column), with
+            function one of `AGGREGATES`; the column is ignored for 'count'.
+            E.g. `{'make_rate': ('mean', 'made'), 'hands': ('count', None)}`.
+        :param where: callable | None -- Row filter, as for `select`.
+        :return: QueryResult -- Key columns then aggregates (in name order),
+            one row per group, ordered by key.
+        """
+        mask = self._mask(where)
+
+        def values(name):
+            v = self.column(name)
+            return np.asarray(v[mask] if mask is not None else v)
+
+        key_values = [values(k).astype(np.int64) for k in keys]
+        code = np.zeros(len(key_values[0]) if key_values else 0,
+                        dtype=np.int64)
+        bases = []
+        span = 1
+        for v in key_values:
+            low = int(v.min()) if len(v) else 0
+            radix = (int(v.max()) - low + 1) if len(v) else 1
+            code = code * radix + (v - low)
+            bases.append((low, radix))
+            span *= radix
+        if span <= self.DENSE_GROUPS:
+            # Few possible keys: count them directly instead of sorting.
+            groups = np.flatnonzero(np.bincount(code, minlength=span))
+            remap = np.zeros(span, dtype=np.int64)
+            remap[groups] = np.arange(len(groups))
+            inverse = remap[code]
+        else:
+            groups, inverse = np.unique(code, return_inverse=True)
+        result = OrderedDict()
+        rest = groups
+        for name, (low, radix) in reversed(zip(keys, bases)):
+            result[name] = rest % radix + low
+            rest = rest // radix
+        result = OrderedDict((k, result[k]) for k in keys)
+        counts = np.bincount(inverse, minlength=len(groups))
+        order = starts = None
+        for name, (func, column) in sorted(aggregates.iteritems()):
+            if func not in self.AGGREGATES:
+                raise ValueError("Unknown aggregate: " + func)
+            if func == 'count':
+                result[name] = counts
+                continue
+            v = values(column).astype(np.float64)
+            if func in ('sum', 'mean'):
+                total = np.bincount(inverse, weights=v, minlength=len(groups))
+                result[name] = total if func == 'sum' else total / counts
+                continue
+            if order is None:
+                order = np.argsort(inverse)
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            ufunc = np.minimum if func == 'min' else np.maximum
+            result[name] = (ufunc.reduceat(v[order], starts) if len(v)
+                            else np.empty(0))
+        return QueryResult(result)
+
+    def _mask(self, where):
+        if where is None:
+            return None
+        return np.asarray(where(self), dtype=bool)
+
+    def _concat(self, table, name, offsets=None):
+        parts = [self._load(f, table, name) for f in self._files]
+        if offsets is not None:
+            parts = [np.asarray(p, dtype=np.int64) + o
+                     for p, o in zip(parts, offsets)]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def _load(self, archive, table, name):
+        meta = archive.index['tables'][table]['columns'][name]
+        shape = (archive.rows(table),) + tuple(meta['shape'])
+        dtype = np.dtype(meta['dtype'])
+        if not shape[0]:
+            return np.empty(shape, dtype=dtype)
+        if meta['codec'] == 'raw':
+            return np.memmap(archive.path, dtype=dtype, mode='r',
+                             offset=meta['offset'], shape=shape)
+        cache_dir = self._cache_dir or archive.path + '.cols'
+        cache = os.path.join(cache_dir, '%s.%s.%s.npy' % (
+            os.path.basename(archive.path), table, name))
+        if not os.path.exists(cache):
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            data = np.frombuffer(archive.column_bytes(table, name),
+                                 dtype=dtype).reshape(shape)
+            tmp = cache + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.rename(tmp, cache)
+        return np.load(cache, mmap_mode='r')
+
+    def _derive_game(self):
+        offsets = np.cumsum([0] + [len(f.games) for f in self._files[:-1]])
+        return self._concat('hands', 'game', offsets)
+
+    def _game_column(self, name):
+        return self._concat('games', name)[self.column('game')]
+
+    def _derive_sixes(self):
+        return self._game_column('sixes')
+
+    def _derive_winner(self):
+        return self._game_column('winner')
+
+    def _derive_bet_points(self):
+        return self._team_points(self.column('bet_team'))
+
+    def _derive_counter_points(self):
+        bet_team = np.asarray(self.column('bet_team'))
+        return self._team_points(np.where(bet_team < 0, -1, 1 - bet_team))
+
+    def _team_points(self, team):
+        team = np.asarray(team)
+        return np.where(team == 0, self.column('points_a'),
+                        np.where(team == 1, self.column('points_b'), 0))
+
+    def _derive_trump_length(self):
+        bettor = np.asarray(self.column('bettor'))
+        deal = self.column('deal')
+        held = np.concatenate((
+            deal[np.arange(len(bettor)), np.maximum(bettor, 0)],
+            self.column('kitty')), axis=1)
+        trump = np.asarray(self.column('trump'))[:, None]
+        length = ((held >= 0) & ((held >> 4) == trump)).sum(axis=1)
+        return np.where(bettor < 0, -1, length)
+
+    def _derive_kitty_aces(self):
+        kitty = np.asarray(self.column('kitty'))
+        return ((kitty >= 0) & ((kitty & 15) == int(Card.Value.ACE))).sum(axis=1)
+
+
+_HAND_COLUMNS = set(n for n, _, _ in COLUMNS['hands'])
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -0,0 +1,449 @@
+"""Columnar archive of finished games.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class ArchiveFile -- Reads one archive file.
+    :class GameArchiver -- Moves finished games from the store to archive
+        files.
+    :func write_archive -- Write game records to a new archive file.
+
+Archive file layout::
+
+    MAGIC | column blocks ... | index (JSON) | index offset (<Q) |
+    index length (<I) | MAGIC
+
+Each file holds three tables of fixed-width little-endian integer columns:
+'games' (one row per game), 'hands' (one row per hand) and 'bids' (one row
+per bid, ranged by the hands' `bid_start`/`bid_count`). Each column is one
+block, zlib-compressed unless written with `compress=False`. The index
+gives every block's offset, length, codec, dtype (NumPy type string) and
+row shape, plus the game IDs and players. Unused card, trick and seat slots
+hold -1. Files are written once, under a temporary name, and never changed.
+
+"""
+
+import array
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from game import Game
+from game.thdeck import THDeckSixes
+
+MAGIC = 'P200ARC1'
+VERSION = 1
+# Sized for the larger deck: 40 cards less the kitty gives 9 per seat, and
+# as many tricks. Readers take the widths from the file index.
+KITTY_SIZE = 4
+MAX_HAND = (sum(len(v) for v in THDeckSixes.DEFAULT_DECK.itervalues()) -
+            KITTY_SIZE) // 4
+MAX_TRICKS = MAX_HAND
+
+_FOOTER = struct.Struct('<QI')
+_TYPECODES = {'<i1': 'b', '<i2': 'h', '<i4': 'i'}
+
+# table -> (column, dtype, row shape)
+COLUMNS = {
+    'games': (
+        ('points_a', '<i2', ()),
+        ('points_b', '<i2', ()),
+        ('winner', '<i1', ()),
+        ('sixes', '<i1', ()),
+        ('hand_start', '<i4', ()),
+        ('hand_count', '<i2', ())
+    ),
+    'hands': (
+        ('game', '<i4', ()),
+        ('hand', '<i2', ()),
+        ('start', '<i1', ()),
+        ('bettor', '<i1', ()),
+        ('bet_team', '<i1', ()),
+        ('bet_amount', '<i2', ()),
+        ('trump', '<i1', ()),
+        ('points_a', '<i2', ()),
+        ('points_b', '<i2', ()),
+        ('made', '<i1', ()),
+        ('kitty', '<i1', (KITTY_SIZE,)),
+        ('deal', '<i1', (4, MAX_HAND)),
+        ('tricks', '<i1', (MAX_TRICKS, 4)),
+        ('trick_lead', '<i1', (MAX_TRICKS,)),
+        ('trick_winner', '<i1', (MAX_TRICKS,)),
+        ('bid_start', '<i4', ()),
+        ('bid_count', '<i2', ())
+    ),
+    'bids': (
+        ('seat', '<i1', ()),
+        ('amount', '<i2', ())
+    )
+}
+
+_TEAMS = {'A': 0, 'B': 1}
+
+
+def game_record(game):
+    """Compact, self-contained record of a finished game.
+
+    :param game: Game -- The finished game controller.
+    :return: dict -- 'id', 'players' (user IDs by seat), 'points', 'sixes'
+        and 'hands'.
+    """
+    return {
+        'id': game.uid,
+        'players': [p.user.uid if p else None for p in game.players],
+        'points': dict(game.points),
+        'sixes': bool(game.options.sixes),
+        'hands': list(game.hands)
+    }
+
+
+def write_archive(path, records, compress=True):
+    """Write game records to a new archive file.
+
+    The file is written and synced under a temporary name, then renamed, so
+    a reader never sees a partial file.
+
+    :param path: str -- The archive file path.
+    :param records: list -- Records from `game_record`.
+    :param compress: bool -- Whether to zlib-compress the column blocks.
+    :return: dict -- The file index.
+    """
+    columns = _new_columns()
+    for g, record in enumerate(records):
+        _add_game(columns, g, record)
+    index = {
+        'version': VERSION,
+        'created': time.time(),
+        'games': [r['id'] for r in records],
+        'players': [r['players'] for r in records],
+        'tables': {}
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for table, cols in COLUMNS.iteritems():
+            meta = index['tables'][table] = {'columns': {}}
+            for name, dtype, shape in cols:
+                data = columns[table][name]
+                if sys.byteorder != 'little':
+                    data.byteswap()
+                block = data.tostring()
+                codec = 'raw'
+                if compress:
+                    block = zlib.compress(block, 6)
+                    codec = 'zlib'
+                meta['columns'][name] = {
+                    'dtype': dtype,
+                    'shape': list(shape),
+                    'offset': f.tell(),
+                    'length': len(block),
+                    'codec': codec
+                }
+                f.write(block)
+            meta['rows'] = len(columns[table][cols[0][0]]) // _width(
+                cols[0][2])
+        offset = f.tell()
+        encoded = json.dumps(index, separators=(',', ':'))
+        f.write(encoded)
+        f.write(_FOOTER.pack(offset, len(encoded)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+    return index
+
+
+class ArchiveFile(object):
+    """Reads one archive file.
+
+    Init Parameters:
+        path -- The archive file path.
+
+    Properties:
+        :type path: str -- The archive file path.
+        :type index: dict -- The file index.
+        :type games: list -- Game IDs in the file, by game row.
+
+    Public Methods:
+        rows -- Number of rows in a table.
+        column_bytes -- A column's decoded little-endian bytes.
+        column -- A column as a flat `array.array`.
+        records -- Iterate the games as `game_record` dicts.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a game archive: " + path)
+            f.seek(-(_FOOTER.size + len(MAGIC)), os.SEEK_END)
+            offset, length = _FOOTER.unpack(f.read(_FOOTER.size))
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Truncated game archive: " + path)
+            f.seek(offset)
+            self.index = json.loads(f.read(length))
+
+    @property
+    def games(self):
+        return self.index['games']
+
+    def rows(self, table):
+        return self.index['tables'][table]['rows']
+
+    def column_bytes(self, table, name):
+        meta = self.index['tables'][table]['columns'][name]
+        with open(self.path, 'rb') as f:
+            f.seek(meta['offset'])
+            block = f.read(meta['length'])
+        if meta['codec'] == 'zlib':
+            block = zlib.decompress(block)
+        return block
+
+    def column(self, table, name):
+        meta = self.index['tables'][table]['columns'][name]
+        data = array.array(_TYPECODES[meta['dtype']])
+        data.fromstring(self.column_bytes(table, name))
+        if sys.byteorder != 'little':
+            data.byteswap()
+        return data
+
+    def records(self):
+        """Iterate the games as `game_record` dicts.
+
+        :return: generator
+        """
+        games = dict((n, self.column('games', n))
+                     for n, _, _ in COLUMNS['games'])
+        hands = dict((n, self.column('hands', n))
+                     for n, _, _ in COLUMNS['hands'])
+        bids = dict((n, self.column('bids', n))
+                    for n, _, _ in COLUMNS['bids'])
+        columns = self.index['tables']['hands']['columns']
+        hand_size = columns['deal']['shape'][1]
+        trick_count = columns['trick_lead']['shape'][0]
+        for g, uid in enumerate(self.games):
+            start = games['hand_start'][g]
+            yield {
+                'id': uid,
+                'players': self.index['players'][g],
+                'points': {'A': games['points_a'][g],
+                           'B': games['points_b'][g]},
+                'sixes': bool(games['sixes'][g]),
+                'hands': [_read_hand(hands, bids, h, hand_size, trick_count)
+                          for h in xrange(start,
+                                          start + games['hand_count'][g])]
+            }
+
+
+class GameArchiver(object):
+    """Moves finished games from the store into archive files.
+
+    Each `archive_batch` restores up to `batch_size` finished games, writes
+    them to one new archive file, and only then deletes the games with all
+    their sub-documents. Games already found in an archive file (e.g. after
+    a crash between the two steps) are deleted without being written again.
+
+    Class Properties:
+        :type EXTENSION: str -- Archive file name extension.
+
+    Init Parameters:
+        data_store -- The DataStore controller.
+        directory -- The archive directory.
+        batch_size -- Games per archive file.
+        compress -- Whether to compress the column blocks.
+
+    Properties:
+        :type failed: dict -- Game ID to the error that kept it from being
+            archived.
+
+    Public Methods:
+        files -- The archive files, oldest first.
+        archived_ids -- IDs of all archived games.
+        archive_batch -- Archive one batch of finished games.
+        run -- Archive finished games until none are left.
+
+    """
+
+    EXTENSION = '.p200a'
+
+    def __init__(self, data_store, directory, batch_size=500, compress=True):
+        self._data_store = data_store
+        self._directory = directory
+        self._batch_size = max(1, batch_size)
+        self._compress = compress
+        self._archived = None
+        self.failed = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def files(self):
+        return sorted(os.path.join(self._directory, f)
+                      for f in os.listdir(self._directory)
+                      if f.endswith(self.EXTENSION))
+
+    def archived_ids(self):
+        if self._archived is None:
+            self._archived = set()
+            for path in self.files():
+                self._archived.update(ArchiveFile(path).games)
+        return self._archived
+
+    def archive_batch(self):
+        """Archive one batch of finished games.
+
+        A game that cannot be restored or recorded is left in the store and
+        noted in `failed`, and later batches pass over it, so it cannot hold
+        up the games behind it.
+
+        :return: int -- The number of games removed from the store.
+        """
+        query = {'state': Game.State.END}
+        if self.failed:
+            query['_id'] = {'$nin': list(self.failed)}
+        uids = self._data_store.find_ids(Game, query, self._batch_size)
+        if not uids:
+            return 0
+        archived = self.archived_ids()
+        games = []
+        records = []
+        for uid in uids:
+            try:
+                game = self._data_store.get_controller(Game, uid)
+                if uid not in archived:
+                    record = game_record(game)
+                    _add_game(_new_columns(), 0, record)
+                    records.append(record)
+            except Exception as e:
+                self.failed[uid] = e
+            else:
+                games.append(game)
+        if records:
+            name = 'games-%017d%s' % (int(time.time() * 1e6), self.EXTENSION)
+            write_archive(os.path.join(self._directory, name), records,
+                          self._compress)
+            archived.update(r['id'] for r in records)
+        for g in games:
+            g.delete(self._data_store)
+        return len(games)
+
+    def run(self, limit=None):
+        """Archive finished games until none are left.
+
+        :param limit: int | None -- Stop after about this many games.
+        :return: int -- The number of games archived.
+        """
+        total = 0
+        while not limit or total < limit:
+            failed = len(self.failed)
+            n = self.archive_batch()
+            if not n and len(self.failed) == failed:
+                break
+            total += n
+        return total
+
+
+def _width(shape):
+    width = 1
+    for n in shape:
+        width *= n
+    return width
+
+
+def _new_columns():
+    return dict((t, dict((name, array.array(_TYPECODES[dtype]))
+                         for name, dtype, _ in cols))
+                for t, cols in COLUMNS.iteritems())
+
+
+def _padded(values, size):
+    if len(values) > size:
+        raise ValueError("Archive column overflow: %d > %d" %
+                         (len(values), size))
+    return list(values) + [-1] * (size - len(values))
+
+
+def _add_game(columns, g, record):
+    games = columns['games']
+    hands = columns['hands']
+    bids = columns['bids']
+    points = record['points']
+    games['points_a'].append(points['A'])
+    games['points_b'].append(points['B'])
+    games['winner'].append(0 if points['A'] >= points['B'] else 1)
+    games['sixes'].append(1 if record.get('sixes') else 0)
+    games['hand_start'].append(len(hands['game']))
+    games['hand_count'].append(len(record['hands']))
+    for h, hand in enumerate(record['hands']):
+        bet_team = _TEAMS.get(hand.get('bet_team'), -1)
+        hand_points = hand['points']
+        hands['game'].append(g)
+        hands['hand'].append(h)
+        hands['start'].append(_seat(hand.get('start')))
+        hands['bettor'].append(_seat(hand.get('bettor')))
+        hands['bet_team'].append(bet_team)
+        hands['bet_amount'].append(hand['bet_amount'])
+        hands['trump'].append(hand.get('trump') or 0)
+        hands['points_a'].append(hand_points[0])
+        hands['points_b'].append(hand_points[1])
+        hands['made'].append(
+            1 if bet_team >= 0 and
+            hand_points[bet_team] >= hand['bet_amount'] else 0)
+        hands['kitty'].extend(_padded(hand.get('kitty') or [], KITTY_SIZE))
+        deal = hand.get('deal') or [[]] * 4
+        for seat in xrange(4):
+            hands['deal'].extend(_padded(deal[seat], MAX_HAND))
+        tricks = hand.get('tricks') or []
+        _padded(tricks, MAX_TRICKS)
+        for trick in tricks:
+            hands['tricks'].extend(trick[2:6])
+        hands['tricks'].extend([-1] * 4 * (MAX_TRICKS - len(tricks)))
+        hands['trick_lead'].extend(_padded([t[0] for t in tricks],
+                                           MAX_TRICKS))
+        hands['trick_winner'].extend(_padded([t[1] for t in tricks],
+                                             MAX_TRICKS))
+        hands['bid_start'].append(len(bids['seat']))
+        hands['bid_count'].append(len(hand.get('bids') or []))
+        for seat, amount in hand.get('bids') or []:
+            bids['seat'].append(seat)
+            bids['amount'].append(amount)
+
+
+def _seat(seat):
+    return -1 if seat is None else seat
+
+
+def _read_hand(hands, bids, h, hand_size, trick_count):
+    def row(name, width):
+        return list(hands[name][h * width:(h + 1) * width])
+
+    tricks = row('tricks', trick_count * 4)
+    leads = row('trick_lead', trick_count)
+    winners = row('trick_winner', trick_count)
+    deal = row('deal', 4 * hand_size)
+    start = hands['bid_start'][h]
+    bet_team = hands['bet_team'][h]
+    return {
+        'round': hands['hand'][h] + 1,
+        'start': hands['start'][h],
+        'bettor': None if hands['bettor'][h] < 0 else hands['bettor'][h],
+        'bet_team': 'AB'[bet_team] if bet_team >= 0 else '',
+        'bet_amount': hands['bet_amount'][h],
+        'trump': hands['trump'][h],
+        'points': [hands['points_a'][h], hands['points_b'][h]],
+        'kitty': [c for c in row('kitty', KITTY_SIZE) if c >= 0],
+        'deal': [[c for c in deal[s * hand_size:(s + 1) * hand_size]
+                  if c >= 0] for s in xrange(4)],
+        'bids': [[bids['seat'][b], bids['amount'][b]]
+                 for b in xrange(start, start + hands['bid_count'][h])],
+        'tricks': [[leads[t], winners[t]] + tricks[t * 4:t * 4 + 4]
+                   for t in xrange(trick_count) if leads[t] >= 0]
+    }
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -5,12 +5,14 @@
 Exports:
     :class Deck
     :module cardholder
+    :module discardpile
     :module card
 
 """
 
 from core.decorators import classproperty
 from game.deck.cardholder import CardHolder
+from game.deck.discardpile import DiscardPile
 from game.deck.card import Card
 
 
@@ -75,7 +77,9 @@ class Deck(CardHolder):
         index = self.card_count - 1
         self._update_model_collection('cards', {'action': 'remove',
                                                 'index': index})
-        return self.cards.pop()
+        card = self.cards.pop()
+        self._index_remove(card)
+        return card
 
     def deal(self, count=1):
         """Deal one or more cards from deck.
@@ -19,14 +19,22 @@ class Card(ImmutableDotDict):
     Class Properties:
         :type Suit: EnumInt -- Enumerated card Suit types.
         :type Value: EnumInt -- Enumerated card values.
+        :type COMPACT_ENCODING: bool -- Whether card collections persist
+            cards as their integer `code` rather than as dicts.
 
     Init Parameters:
         card_or_suit -- The card dict or the suit of the card.
         value -- If suit provided, the face value of the card.
 
+    Class Methods:
+        from_code -- Create card from its integer code.
+        encode -- Persisted form of a card.
+        decode -- Create card from either persisted form.
+
     Properties:
         :type suit: Card.Value/int -- The suit of the card.
         :type value: Card.Suit/int -- The card face value.
+        :type code: int -- Small integer uniquely identifying the card.
     """
 
     Suit = EnumInt('DIAMONDS', 'CLUBS', 'HEARTS', 'SPADES')
@@ -34,6 +42,8 @@ class Card(ImmutableDotDict):
     Value = EnumInt('JOKER', 'TWO', 'THREE', 'FOUR', 'FIVE', 'SIX', 'SEVEN',
                     'EIGHT', 'NINE', 'TEN', 'JACK', 'QUEEN', 'KING', 'ACE')
 
+    COMPACT_ENCODING = False
+
     def __init__(self, card_or_suit, value=None):
         """Card init.
 
@@ -50,6 +60,46 @@ class Card(ImmutableDotDict):
                 'value': value
             })
 
+    @classmethod
+    def from_code(cls, code):
+        """Create card from its integer code.
+
+        :param code: int -- The code produced by `Card.code`.
+        :return: Card
+        """
+        return cls(code >> 4, code & 0xf)
+
+    @classmethod
+    def encode(cls, card):
+        """Persisted form of a card, per `Card.COMPACT_ENCODING`.
+
+        :param card: Card | None
+        :return: int | dict | None
+        """
+        if card is None:
+            return None
+        if cls.COMPACT_ENCODING:
+            return card.code
+        return dict(card)
+
+    @classmethod
+    def decode(cls, obj):
+        """Create card from either persisted form, so that documents saved
+        before `COMPACT_ENCODING` was switched (either way) still load.
+
+        :param obj: int | dict | None -- Card code or card dict.
+        :return: Card | None
+        """
+        if obj is None:
+            return None
+        if isinstance(obj, (int, long)):
+            return cls.from_code(obj)
+        return cls(obj)
+
+    @property
+    def code(self):
+        return (self.suit << 4) | self.value
+
     def __setattr__(self, key, value):
         if hasattr(self, key):
             raise ValueError('Card object cannot be changed once assigned.')
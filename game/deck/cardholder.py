@@ -33,6 +33,10 @@ class CardHolder(DataModelController):
         :type card_count: int -- The number of cards currently held.
 
     Public Methods:
+        has_suit -- Whether any held card is of the given suit.
+        suit_cards -- The held cards of the given suit.
+        playable_cards -- The held cards that may legally be played.
+        is_playable -- Whether a held card may legally be played.
         change_sort -- Update sorting rules.
         add_card -- Create new card and insert it if sort_method defined,
             otherwise append it to card list.
@@ -42,6 +46,11 @@ class CardHolder(DataModelController):
         shuffle -- Shuffle entire card list.
         dump_cards -- Dump entire card list.
 
+    Private Methods:
+        _reindex -- Rebuild the per-suit card index.
+        _index_add -- Add a card to the per-suit card index.
+        _index_remove -- Remove a card from the per-suit card index.
+
     """
 
     SORT_COMP_METHODS = {
@@ -65,13 +74,15 @@ class CardHolder(DataModelController):
         """The rule set for the underlying `DataModel`.
 
         New Model Keys:
-            :key cards: Collection.List(DataModel) -- The list of cards.
+            :key cards: Collection.List(dict) | Collection.List(int) -- The
+                list of cards; card codes if `Card.COMPACT_ENCODING`.
             :key sort: str | None -- The sorting compare method name.
             :key ascend: bool -- Sorting option for ascending order.
         """
         rules = super(CardHolder, cls).MODEL_RULES
         rules.update({
-            'cards': ('cards', Collection.List(dict), lambda x: dict(x)),
+            'cards': ('cards', Collection.List(int if Card.COMPACT_ENCODING
+                                               else dict), Card.encode),
             'sort_method': ('sort_method', None, None),
             'sort_ascend': ('sort_ascend', bool, None)
         })
@@ -89,7 +100,7 @@ class CardHolder(DataModelController):
     @classmethod
     def restore(cls, data_store, data_model, **kwargs):
         kwargs.update({
-            'cards': [Card(c) for c in data_model.cards],
+            'cards': [Card.decode(c) for c in data_model.cards],
             'sort_method': data_model.sort_method,
             'sort_ascend': data_model.sort_ascend
         })
@@ -106,6 +117,15 @@ class CardHolder(DataModelController):
         })
         return super(CardHolder, cls).new(data_store, **kwargs)
 
+    def __init__(self, *args, **kwargs):
+        super(CardHolder, self).__init__(*args, **kwargs)
+        self._reindex()
+
+    def __setattr__(self, key, value):
+        super(CardHolder, self).__setattr__(key, value)
+        if key == 'cards':
+            self._reindex()
+
     @property
     def card_count(self):
         return len(self.cards)
@@ -145,15 +165,66 @@ class CardHolder(DataModelController):
         if changed:
             self.sort()
 
+    def has_suit(self, suit):
+        """Check for held cards of a suit without scanning the card list.
+
+        :param suit: Card.Suit/int
+        :return: bool
+        """
+        return bool(self._suit_index.get(suit))
+
+    def suit_cards(self, suit):
+        """Held cards of a suit.
+
+        :param suit: Card.Suit/int
+        :return: list -- The cards of the suit.
+        """
+        return list(self._suit_index.get(suit, []))
+
+    def playable_cards(self, lead_suit=None):
+        """Cards that may legally be played on the current trick.
+
+        A player must follow the lead suit if able; otherwise any card may be
+        played.
+
+        :param lead_suit: Card.Suit/int | None -- Suit of the card that led
+            the trick, or None when leading.
+        :return: list -- The playable cards.
+        """
+        if lead_suit and self.has_suit(lead_suit):
+            return self.suit_cards(lead_suit)
+        return list(self.cards)
+
+    def is_playable(self, card, lead_suit=None):
+        """Check that a held card may legally be played.
+
+        :param card: Card | int -- The card or its index in the card list.
+        :param lead_suit: Card.Suit/int | None -- Suit of the card that led
+            the trick, or None when leading.
+        :return: bool
+        """
+        if type(card) is int:
+            if not 0 <= card < self.card_count:
+                return False
+            card = self.cards[card]
+        if card not in self._suit_index.get(card.suit, []):
+            return False
+        return (not lead_suit or card.suit == lead_suit or
+                not self.has_suit(lead_suit))
+
     def remove_card(self, card):
         try:
             if type(card) is int:
-                card = self.cards[card]
+                index = card
+                card = self.cards[index]
             else:
                 index = self.cards.index(card)
         except (IndexError, ValueError):
             return None
-        self.cards.remove(card)
+        del self.cards[index]
+        self._index_remove(card)
+        self._update_model_collection('cards', {'action': 'remove',
+                                                'index': index})
         return card
 
     def append_card(self, card):
@@ -162,6 +233,7 @@ class CardHolder(DataModelController):
         :param card: Card -- The card object to add.
         """
         self.cards.append(card)
+        self._index_add(card)
         self._update_model_collection('cards', {'action': 'append'})
         return self.card_count - 1
 
@@ -190,6 +262,7 @@ class CardHolder(DataModelController):
             while index < self.card_count and comp(card, self.cards[index]) == comp_val:
                 index += 1
         self.cards.insert(index, card)
+        self._index_add(card)
         self._update_model_collection('cards', {'action': 'insert',
                                                 'index': index})
         return index
@@ -202,9 +275,15 @@ class CardHolder(DataModelController):
         self.cards.sort(self.__class__.SORT_COMP_METHODS[self.sort_method])
         self._update_model('cards')
 
-    def shuffle(self):
-        """Shuffle cards list."""
-        random.shuffle(self.cards)
+    def shuffle(self, seed=None):
+        """Shuffle cards list.
+
+        :param seed: int | None -- Seed for a reproducible shuffle.
+        """
+        if seed is None:
+            random.shuffle(self.cards)
+        else:
+            random.Random(seed).shuffle(self.cards)
         self._update_model('cards')
 
     def dump_cards(self):
@@ -216,8 +295,29 @@ class CardHolder(DataModelController):
         self.cards = []
         return cards
 
-    def __iter__(self):
-        return (card for card in self.cards)
+    def _reindex(self):
+        """Rebuild the per-suit card index from the card list."""
+        index = {}
+        for card in self.cards or []:
+            index.setdefault(card.suit, []).append(card)
+        self._suit_index = index
 
+    def _index_add(self, card):
+        """Add card to the per-suit card index.
 
+        :param card: Card -- The card that was added to the card list.
+        """
+        self._suit_index.setdefault(card.suit, []).append(card)
+
+    def _index_remove(self, card):
+        """Remove card from the per-suit card index.
+
+        :param card: Card -- The card that was removed from the card list.
+        """
+        suit_cards = self._suit_index.get(card.suit)
+        if suit_cards and card in suit_cards:
+            suit_cards.remove(card)
+
+    def __iter__(self):
+        return (card for card in self.cards)
 
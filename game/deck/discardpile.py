@@ -0,0 +1,86 @@
+"""Team discard pile.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class DiscardPile -- Card holder that keeps a running point total.
+
+"""
+
+from core.decorators import classproperty
+from game.deck.cardholder import CardHolder
+from game.deck.card import Card
+
+
+class DiscardPile(CardHolder):
+    """Card holder for a team's won tricks.
+
+    The point total is kept up to date on every card added or removed, so
+    scoreboards and bots can read it after each trick without recounting
+    the pile.
+
+    Class Properties:
+        :type CARD_POINTS: dict -- Points scored per card value.
+
+    Properties:
+        :type points: int -- Running point total of the held cards.
+
+    Class Methods:
+        card_points -- Points scored by a single card.
+
+    """
+
+    CARD_POINTS = {
+        Card.Value.FIVE: 5,
+        Card.Value.TEN: 10,
+        Card.Value.ACE: 10
+    }
+
+    # noinspection PyPep8Naming,PyMethodParameters,PyCallByClass,PyTypeChecker
+    @classproperty
+    def MODEL_RULES(cls):
+        """The rule set for the underlying `DataModel`.
+
+        New Model Keys:
+            :key points: int -- Running point total of the held cards.
+        """
+        rules = super(DiscardPile, cls).MODEL_RULES
+        rules.update({
+            'points': ('points', int, None)
+        })
+        return rules
+
+    @classproperty
+    def INIT_DEFAULTS(cls):
+        defaults = super(DiscardPile, cls).INIT_DEFAULTS
+        defaults.update({
+            'points': 0
+        })
+        return defaults
+
+    @classmethod
+    def card_points(cls, card):
+        """Points scored by a single card.
+
+        :param card: Card
+        :return: int
+        """
+        return cls.CARD_POINTS.get(card.value, 0)
+
+    def _reindex(self):
+        super(DiscardPile, self)._reindex()
+        self.points = sum(self.card_points(c) for c in self.cards or [])
+
+    def _index_add(self, card):
+        super(DiscardPile, self)._index_add(card)
+        self.points += self.card_points(card)
+
+    def _index_remove(self, card):
+        super(DiscardPile, self)._index_remove(card)
+        self.points -= self.card_points(card)
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -0,0 +1,396 @@
+"""Write-ahead journal of table moves.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class MoveJournal -- Group-committed, append-only journal of accepted
+        moves for one shard.
+
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from game import Game
+from store import VersionConflictError, StaleOwnerError
+from game.deck.card import Card
+from game.table import TableState, Move
+
+_FRAME = struct.Struct('<IH')
+_MOVE = struct.Struct('<IBBB')
+_ACTIONS = (TableState.Action.BET, TableState.Action.TRUMP,
+            TableState.Action.PLAY)
+
+
+class MoveJournal(object):
+    """Group-committed, append-only journal of accepted moves for one shard.
+
+    Every accepted table move is appended as a small checksummed record of
+    the game ID, the move's index in the table's move log, and the move.
+    Appends only buffer the record; a writer thread writes and fsyncs the
+    buffer `flush_interval` seconds after the first pending record, or as
+    soon as `flush_moves` records are pending, so one fsync covers many
+    moves. Callers that must not acknowledge a move before it is durable
+    `wait` for the sequence number `append` returned.
+
+    On startup, `recover` replays the journal onto the last persisted games
+    through the live `Table` methods, skipping moves the stored table
+    already has (so replay is idempotent), then checkpoints. Game ends
+    replayed this way are not counted again (see
+    `StatisticsAccumulator.flush` and `PairRatings.record`). `checkpoint`
+    moves the journal aside, saves every game journaled since the last
+    checkpoint and then deletes the old journal; `start_checkpoints` runs
+    it every `checkpoint_interval` seconds so the journal stays short. A
+    torn or corrupt record at the end of a file, left by a crash
+    mid-write, ends that file.
+
+    Class Properties:
+        :type EXTENSION: str -- Journal file extension.
+        :type FLUSH_INTERVAL: float -- Default seconds between group commits.
+        :type FLUSH_MOVES: int -- Default pending records that force a
+            commit.
+        :type CHECKPOINT_INTERVAL: float -- Default seconds between
+            checkpoints.
+
+    Class Methods:
+        install -- Open a journal and have `Game`s append to it.
+
+    Init Parameters:
+        directory -- Directory of the journal files.
+        shard -- Shard name or number; one journal file per shard.
+        flush_interval -- Seconds between group commits.
+        flush_moves -- Pending records that force a commit.
+
+    Properties:
+        :type path: str -- The journal file.
+        :type durable: int -- Sequence number of the last durable record.
+
+    Public Methods:
+        append -- Journal an accepted move.
+        wait -- Block until a record is durable.
+        sync -- Commit pending records now.
+        entries -- The journaled moves.
+        recover -- Replay the journal onto the stored games.
+        checkpoint -- Save journaled games and drop their moves.
+        start_checkpoints -- Checkpoint periodically in a background thread.
+        close -- Commit pending records and stop the writer.
+
+    """
+
+    EXTENSION = '.wal'
+    FLUSH_INTERVAL = 0.005
+    FLUSH_MOVES = 64
+    CHECKPOINT_INTERVAL = 30.0
+
+    def __init__(self, directory, shard=0, flush_interval=None,
+                 flush_moves=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory,
+                                 'moves.' + str(shard) + self.EXTENSION)
+        self._old_path = self.path + '.old'
+        self._flush_interval = (self.FLUSH_INTERVAL if flush_interval is None
+                                else flush_interval)
+        self._flush_moves = flush_moves or self.FLUSH_MOVES
+        self._file = open(self.path, 'ab')
+        self._cond = threading.Condition(threading.Lock())
+        self._io = threading.Lock()
+        self._checkpointing = threading.Lock()
+        self._buffer = []
+        self._first = None
+        self._force = False
+        self._closed = False
+        self._replaying = False
+        self._seq = 0
+        self.durable = 0
+        self._games = set()
+        self._stop = threading.Event()
+        self._checkpointer = None
+        self._writer = threading.Thread(target=self._run, name='MoveJournal')
+        self._writer.daemon = True
+        self._writer.start()
+
+    @classmethod
+    def install(cls, directory, shard=0, data_store=None,
+                checkpoint_interval=None, **kwargs):
+        """Open a journal and attach it to `Game`.
+
+        :param data_store: The DataStore controller; when given, the
+            journal is checkpointed every `checkpoint_interval` seconds.
+        :return: MoveJournal
+        """
+        journal = cls(directory, shard, **kwargs)
+        Game.journal = journal
+        if data_store is not None:
+            journal.start_checkpoints(data_store, checkpoint_interval)
+        return journal
+
+    def append(self, game_id, seq, move):
+        """Journal an accepted move.
+
+        :param game_id: str -- The game ID.
+        :param seq: int -- Index of the move in the table's move log.
+        :param move: Move | tuple -- (action, seat, value).
+        :return: int -- Sequence number of the record, for `wait`.
+        """
+        if self._replaying:
+            return self._seq
+        action, seat, value = move
+        name = game_id.encode('utf-8')
+        body = (chr(len(name)) + name +
+                _MOVE.pack(seq, _ACTIONS.index(action), seat, int(value)))
+        record = _FRAME.pack(zlib.crc32(body) & 0xffffffff, len(body)) + body
+        with self._cond:
+            if self._closed:
+                raise ValueError("Journal is closed.")
+            self._buffer.append(record)
+            self._games.add(game_id)
+            self._seq += 1
+            if self._first is None:
+                self._first = time.time()
+                self._cond.notify_all()
+            elif len(self._buffer) >= self._flush_moves:
+                self._cond.notify_all()
+            return self._seq
+
+    def wait(self, seq=None, timeout=None):
+        """Block until a record, by default the last appended, is durable.
+
+        :param seq: int | None -- Sequence number returned by `append`.
+        :param timeout: float | None -- Max seconds to wait.
+        :return: bool -- Whether the record is durable.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if seq is None:
+                seq = self._seq
+            while self.durable < seq and not self._closed:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            return self.durable >= seq
+
+    def sync(self):
+        """Commit pending records now and wait for them."""
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+        self.wait()
+
+    def entries(self):
+        """The journaled moves, in order, from the journal files.
+
+        Moves left in a journal moved aside by an unfinished checkpoint come
+        first.
+
+        :return: list -- (game_id, seq, Move) tuples.
+        """
+        entries = []
+        for path in (self._old_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            pos = 0
+            while pos + _FRAME.size <= len(data):
+                crc, size = _FRAME.unpack_from(data, pos)
+                body = data[pos + _FRAME.size:pos + _FRAME.size + size]
+                if len(body) < size or zlib.crc32(body) & 0xffffffff != crc:
+                    break
+                name_size = ord(body[0])
+                seq, action, seat, value = _MOVE.unpack_from(body,
+                                                             1 + name_size)
+                entries.append((body[1:1 + name_size].decode('utf-8'), seq,
+                                Move(_ACTIONS[action], seat, value)))
+                pos += _FRAME.size + size
+        return entries
+
+    def recover(self, data_store):
+        """Replay the journal onto the stored games, then checkpoint.
+
+        :param data_store: The DataStore controller.
+        :return: dict -- Counts of 'applied', 'skipped' and 'failed' moves.
+        """
+        games = OrderedDict()
+        for game_id, seq, move in self.entries():
+            games.setdefault(game_id, []).append((seq, move))
+        counts = {'applied': 0, 'skipped': 0, 'failed': 0}
+        self._replaying = True
+        try:
+            for game_id, moves in games.iteritems():
+                self._games.add(game_id)
+                try:
+                    table = data_store.get_controller(Game, game_id).table
+                except Exception:
+                    counts['failed'] += len(moves)
+                    continue
+                for i, (seq, move) in enumerate(moves):
+                    if seq < len(table.moves):
+                        counts['skipped'] += 1
+                        continue
+                    try:
+                        if seq > len(table.moves):
+                            raise IndexError("Journal is missing moves.")
+                        _apply(table, move)
+                    except Exception:
+                        counts['failed'] += len(moves) - i
+                        break
+                    counts['applied'] += 1
+        finally:
+            self._replaying = False
+        self.checkpoint(data_store)
+        return counts
+
+    def checkpoint(self, data_store):
+        """Save every game journaled since the last checkpoint, then
+        delete their moves from the journal.
+
+        Appends only block while the journal is moved aside for a new one;
+        the games are saved after that, and the old journal is deleted once
+        they all are. If saving fails, the old journal is kept (and added
+        to by the next checkpoint) and its games are saved again next time.
+
+        :param data_store: The DataStore controller.
+        """
+        with self._checkpointing:
+            with self._cond:
+                with self._io:
+                    self._write(''.join(self._buffer))
+                    self._buffer = []
+                    self._first = None
+                    self._rotate()
+                    games, self._games = self._games, set()
+                self.durable = self._seq
+                self._cond.notify_all()
+            try:
+                for game_id in games:
+                    game = data_store.get_strict_controller(Game, game_id)
+                    if not game:
+                        continue
+                    try:
+                        data_store.save_unit(game)
+                    except (VersionConflictError, StaleOwnerError):
+                        # Another node owns the game; its moves here were
+                        # made on stale data.
+                        pass
+            except Exception:
+                with self._cond:
+                    self._games.update(games)
+                raise
+            os.remove(self._old_path)
+
+    def start_checkpoints(self, data_store, interval=None):
+        """Checkpoint every `interval` seconds in a background thread.
+
+        A game that is evicted from the cache between checkpoints has
+        already been written back, and is skipped.
+
+        :param data_store: The DataStore controller.
+        :param interval: float | None -- Seconds between checkpoints.
+        :return: MoveJournal -- self.
+        """
+        if self._checkpointer and self._checkpointer.is_alive():
+            return self
+        interval = interval or self.CHECKPOINT_INTERVAL
+        self._stop.clear()
+        self._checkpointer = threading.Thread(
+            target=self._run_checkpoints, args=(data_store, interval),
+            name='MoveJournalCheckpoint')
+        self._checkpointer.daemon = True
+        self._checkpointer.start()
+        return self
+
+    def close(self):
+        """Commit pending records and stop the writer and checkpoint
+        threads."""
+        self._stop.set()
+        if self._checkpointer:
+            self._checkpointer.join()
+            self._checkpointer = None
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                deadline = self._first + self._flush_interval
+                while (len(self._buffer) < self._flush_moves and
+                        not self._force and not self._closed):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                data = ''.join(self._buffer)
+                seq = self._seq
+                self._buffer = []
+                self._first = None
+                self._force = False
+                self._io.acquire()
+            try:
+                self._write(data)
+            finally:
+                self._io.release()
+            with self._cond:
+                self.durable = max(self.durable, seq)
+                self._cond.notify_all()
+
+    def _run_checkpoints(self, data_store, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.checkpoint(data_store)
+            except Exception:
+                # Keep checkpointing; the journal still holds the moves.
+                pass
+
+    def _rotate(self):
+        # Called with `_io` held.
+        self._file.close()
+        if os.path.exists(self._old_path):
+            with open(self.path, 'rb') as new:
+                data = new.read()
+            with open(self._old_path, 'ab') as old:
+                old.write(data)
+                old.flush()
+                os.fsync(old.fileno())
+        else:
+            os.rename(self.path, self._old_path)
+        self._file = open(self.path, 'wb')
+
+    def _write(self, data):
+        if data:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def _apply(table, move):
+    """Apply a journaled move through the live `Table` methods."""
+    action, seat, value = move
+    player_id = table.players[seat]
+    if action == TableState.Action.BET:
+        table.bet(player_id, value)
+    elif action == TableState.Action.TRUMP:
+        table.set_trump_suit(player_id, value)
+    else:
+        table.play_card(player_id, Card.from_code(value))
+
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
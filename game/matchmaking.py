@@ -0,0 +1,288 @@
+"""Elo-bucketed matchmaking.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class MatchmakingQueue -- Matches solo and duo queues into 2v2 games.
+
+"""
+
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from game import Game
+
+
+class _Ticket(object):
+    """One queued solo player or duo."""
+
+    __slots__ = ('users', 'elo', 'since', 'bucket')
+
+    def __init__(self, users, elo, since, bucket):
+        self.users = users
+        self.elo = elo
+        self.since = since
+        self.bucket = bucket
+
+    @property
+    def duo(self):
+        return len(self.users) == 2
+
+    @property
+    def key(self):
+        """Sort key of the ticket in its bucket: Elo, then age."""
+        return self.elo, self.since, id(self)
+
+
+class MatchmakingQueue(object):
+    """Matches solo and duo queues into balanced 2v2 games.
+
+    Tickets (a solo player or a duo) are kept per Elo bucket, sorted by
+    Elo and then age. A ticket searches the buckets within its window for
+    the nearest tickets that complete a game: another duo, two solos, or,
+    for a solo, a duo and a solo or three more solos. The window starts at
+    `BASE_WINDOW` and widens by `WIDEN_RATE` per second queued, up to
+    `MAX_WINDOW`. The window spans a bounded number of buckets, and only
+    the few tickets nearest in Elo are read from each, so a match attempt
+    grows only with the logarithm of the number of users queued.
+
+    If a matched game cannot be created, its tickets are queued again with
+    their original queue times.
+
+    A duo is rated by its `team_mates` performance rating once the pair has
+    played `DUO_MIN_GAMES` together, and by its members' mean Elo before
+    that; two solos are rated by their mean Elo.
+
+    Class Properties:
+        :type BUCKET_WIDTH: float -- Elo range of one bucket.
+        :type BASE_WINDOW: float -- Initial Elo search window.
+        :type WIDEN_RATE: float -- Window growth per second queued.
+        :type MAX_WINDOW: float -- Largest search window.
+        :type DUO_MIN_GAMES: int -- Games together before a duo is rated by
+            its team rating.
+
+    Init Parameters:
+        data_store -- The DataStore controller.
+        options -- Game options for matched games.
+        on_match -- Called with each matched `Game`.
+        clock -- Time source, in seconds.
+
+    Properties:
+        :type size: int -- Number of queued users.
+
+    Public Methods:
+        enqueue -- Queue a solo player or a duo.
+        dequeue -- Remove a user (and their duo partner) from the queue.
+        tick -- Retry waiting tickets with their widened windows.
+
+    """
+
+    BUCKET_WIDTH = 50.0
+    BASE_WINDOW = 50.0
+    WIDEN_RATE = 10.0
+    MAX_WINDOW = 400.0
+    DUO_MIN_GAMES = 3
+
+    def __init__(self, data_store, options=None, on_match=None,
+                 clock=time.time):
+        self._data_store = data_store
+        self._options = options
+        self._on_match = on_match
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._buckets = ({}, {})
+        self._tickets = OrderedDict()
+        self._by_user = {}
+
+    @property
+    def size(self):
+        return len(self._by_user)
+
+    def enqueue(self, *users):
+        """Queue a solo player or a duo, and try to match them at once.
+
+        :param users: User -- One or two users.
+        :return: Game | None -- The game formed, if any.
+        :raise: ValueError if not one or two users, or a user is queued.
+        """
+        if len(users) not in (1, 2):
+            raise ValueError("Only solo players and duos can be queued.")
+        with self._lock:
+            for u in users:
+                if u.uid in self._by_user:
+                    raise ValueError("User is already queued.")
+            elo = self._rate(users)
+            ticket = _Ticket(users, elo, self._clock(), self._bucket(elo))
+            self._add(ticket)
+            match = self._match(ticket, self._window(ticket, ticket.since))
+        return self._create(match) if match else None
+
+    def dequeue(self, user_id):
+        """Remove a user, and their duo partner, from the queue.
+
+        :param user_id: str -- The user ID.
+        :return: bool -- Whether the user was queued.
+        """
+        with self._lock:
+            ticket = self._by_user.get(user_id)
+            if not ticket:
+                return False
+            self._remove(ticket)
+            return True
+
+    def tick(self):
+        """Retry all waiting tickets, oldest first, with widened windows.
+
+        :return: list -- The games formed.
+        :raise: The first error creating a game, once the other games are
+            created; the failed match's tickets are queued again.
+        """
+        matches = []
+        with self._lock:
+            now = self._clock()
+            for ticket in self._tickets.values():
+                if id(ticket) not in self._tickets:
+                    continue
+                match = self._match(ticket, self._window(ticket, now))
+                if match:
+                    matches.append(match)
+        games = []
+        error = None
+        for m in matches:
+            try:
+                games.append(self._create(m))
+            except Exception as e:
+                error = error or e
+        if error:
+            raise error
+        return games
+
+    def _rate(self, users):
+        if len(users) == 1:
+            return float(users[0].statistics.elo)
+        stats = users[0].statistics
+        mates = stats.team_mates.get(users[1].uid)
+        if mates and mates[0] >= self.DUO_MIN_GAMES:
+            return float(mates[1])
+        return (stats.elo + users[1].statistics.elo) / 2.0
+
+    def _bucket(self, elo):
+        return int(elo // self.BUCKET_WIDTH)
+
+    def _window(self, ticket, now):
+        return min(self.MAX_WINDOW, self.BASE_WINDOW +
+                   self.WIDEN_RATE * max(0.0, now - ticket.since))
+
+    def _nearest(self, duo, elo, window, count, exclude):
+        """The `count` tickets of a kind nearest to `elo` within `window`.
+
+        At most `count` tickets are read from each bucket, outwards from
+        `elo`.
+        """
+        found = []
+        span = int(window // self.BUCKET_WIDTH) + 1
+        center = self._bucket(elo)
+        buckets = self._buckets[duo]
+        for b in xrange(center - span, center + span + 1):
+            queue = buckets.get(b)
+            if not queue:
+                continue
+            hi = bisect.bisect_left(queue, (elo,))
+            lo = hi - 1
+            taken = 0
+            while taken < count:
+                if lo < 0 and hi >= len(queue):
+                    break
+                if hi >= len(queue) or (
+                        lo >= 0 and elo - queue[lo][0] <= queue[hi][0] - elo):
+                    entry = queue[lo]
+                    lo -= 1
+                else:
+                    entry = queue[hi]
+                    hi += 1
+                if abs(entry[0] - elo) > window:
+                    break
+                if entry[3] is not exclude:
+                    found.append(entry[3])
+                    taken += 1
+        found.sort(key=lambda t: (abs(t.elo - elo), t.since))
+        return found[:count]
+
+    def _match(self, ticket, window):
+        """Find tickets completing a game with `ticket` and take them off
+        the queue.
+
+        :return: tuple | None -- (tickets, team_a, team_b) user lists.
+        """
+        elo = ticket.elo
+        if ticket.duo:
+            other = self._nearest(True, elo, window, 1, ticket)
+            if other:
+                match = ([ticket] + other, ticket.users, other[0].users)
+            else:
+                solos = self._nearest(False, elo, window, 2, ticket)
+                if len(solos) < 2:
+                    return None
+                match = ([ticket] + solos, ticket.users,
+                         [s.users[0] for s in solos])
+        else:
+            duos = self._nearest(True, elo, window, 1, ticket)
+            solos = self._nearest(False, elo, window, 3, ticket)
+            if duos and solos:
+                match = ([ticket, duos[0], solos[0]], duos[0].users,
+                         [ticket.users[0], solos[0].users[0]])
+            elif len(solos) == 3:
+                four = sorted([ticket] + solos, key=lambda t: -t.elo)
+                match = (four, [four[0].users[0], four[3].users[0]],
+                         [four[1].users[0], four[2].users[0]])
+            else:
+                return None
+        if abs(self._team_elo(match[1]) - self._team_elo(match[2])) > window:
+            return None
+        for t in match[0]:
+            self._remove(t)
+        return match
+
+    def _team_elo(self, users):
+        first = self._by_user[users[0].uid]
+        if first.duo:
+            return first.elo
+        return (first.elo + self._by_user[users[1].uid].elo) / 2.0
+
+    def _add(self, ticket):
+        bisect.insort(self._buckets[ticket.duo].setdefault(ticket.bucket, []),
+                      ticket.key + (ticket,))
+        self._tickets[id(ticket)] = ticket
+        for u in ticket.users:
+            self._by_user[u.uid] = ticket
+
+    def _remove(self, ticket):
+        del self._tickets[id(ticket)]
+        queue = self._buckets[ticket.duo][ticket.bucket]
+        del queue[bisect.bisect_left(queue, ticket.key)]
+        if not queue:
+            del self._buckets[ticket.duo][ticket.bucket]
+        for u in ticket.users:
+            del self._by_user[u.uid]
+
+    def _create(self, match):
+        tickets, team_a, team_b = match
+        try:
+            game = Game.new_match(self._data_store, team_a, team_b,
+                                  self._options)
+        except Exception:
+            with self._lock:
+                for t in tickets:
+                    if not any(u.uid in self._by_user for u in t.users):
+                        self._add(t)
+            raise
+        if self._on_match:
+            self._on_match(game)
+        return game
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
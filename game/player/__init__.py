@@ -76,6 +76,9 @@ class Player(Spectator):
 
     Properties:
         :type team: str -- The player's team identifier.
+
+    Public Methods:
+        cache_members -- Sub-controllers cached and evicted with the player.
     """
 
     @classproperty
@@ -143,6 +146,10 @@ class Player(Spectator):
             lambda model, key, instruction:
                 self._call_listener('hand', instruction, {'property': key})))
 
+    def cache_members(self):
+        """Sub-controllers cached and evicted as a unit with the player."""
+        return [self.hand]
+
     def new_user(self, user):
         if not self.abandoned:
             raise ValueError('Cannot change user of unabandoned player.')
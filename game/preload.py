@@ -0,0 +1,217 @@
+"""Warm-start preloading of active games.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class GamePreloader -- Restores active games into the controller cache.
+
+"""
+
+import threading
+import time
+from Queue import Queue, Empty
+from store.user import User
+from game import Game
+
+
+class GamePreloader(object):
+    """Restores active games into the `DataStore` controller cache.
+
+    Intended to run once at server boot so that the first move in each
+    active game does not pay for a cold restore. Game IDs are gathered with
+    a single ID-only query (or from users' `active_games`), fetched in
+    batches together with all their sub-documents (one query per collection
+    per nesting level, see `DataStore.prefetch_documents`), and restored
+    from the document cache by a bounded pool of worker threads. The host
+    should report ready once `wait` returns.
+
+    Class Properties:
+        :type ACTIVE_STATES: tuple -- Game states worth preloading.
+
+    Init Parameters:
+        data_store -- The DataStore controller.
+        workers -- Number of worker threads.
+        batch_size -- Number of games fetched per query.
+        time_budget -- Seconds after which preloading gives up.
+        limit -- Max games to preload; defaults to no limit. Running games
+            are pinned in cache, so the cache budget does not apply to them.
+        leases -- Optional `LeaseManager`; only games whose leases this node
+            acquires (one call per batch) are preloaded, the rest are
+            skipped as owned by other nodes.
+
+    Properties:
+        :type ready: bool -- Whether preloading finished or ran out of time.
+        :type progress: dict -- Progress metrics.
+
+    Public Methods:
+        scan_games -- Queue all games in an active state.
+        scan_users -- Queue the active games of the given users.
+        start -- Start the worker threads.
+        wait -- Block until ready or timed out.
+
+    """
+
+    ACTIVE_STATES = (Game.State.RUNNING, Game.State.PAUSED)
+
+    def __init__(self, data_store, workers=4, batch_size=25, time_budget=30.0,
+                 limit=None, leases=None):
+        self._data_store = data_store
+        self._leases = leases
+        self._workers = max(1, workers)
+        self._batch_size = max(1, batch_size)
+        self._time_budget = time_budget
+        self._limit = limit or 0
+        self._uids = []
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._threads = []
+        self._running = 0
+        self._started = None
+        self._loaded = 0
+        self._failed = 0
+        self._skipped = 0
+        self._batches = 0
+
+    @property
+    def ready(self):
+        return self._done.is_set() or self._expired()
+
+    @property
+    def progress(self):
+        with self._lock:
+            return {
+                'total': len(self._uids),
+                'loaded': self._loaded,
+                'failed': self._failed,
+                'skipped': self._skipped,
+                'batches': self._batches,
+                'elapsed': (time.time() - self._started
+                            if self._started else 0.0),
+                'done': self._done.is_set(),
+                'timed_out': self._expired() and not self._queue.empty()
+            }
+
+    def scan_games(self):
+        """Queue all stored games in an active state.
+
+        :return: int -- The number of games queued.
+        """
+        query = {'__data__.state': {'$in': list(self.ACTIVE_STATES)}}
+        return self._add(self._data_store.find_ids(Game, query, self._limit))
+
+    def scan_users(self, user_ids):
+        """Queue the active games of the given users.
+
+        :param user_ids: list -- The user IDs to scan.
+        :return: int -- The number of games queued.
+        """
+        game_ids = []
+        for i in xrange(0, len(user_ids), self._batch_size):
+            batch = user_ids[i:i + self._batch_size]
+            for user in self._data_store.get_models_by_ids(User, batch,
+                                                           resolve=False):
+                game_ids += user.active_games
+        return self._add(game_ids)
+
+    def start(self):
+        """Start the worker threads; does not block.
+
+        :return: GamePreloader -- self.
+        """
+        if self._started:
+            return self
+        self._started = time.time()
+        uids = self._uids[:self._limit or None]
+        for i in xrange(0, len(uids), self._batch_size):
+            self._queue.put(uids[i:i + self._batch_size])
+        if self._queue.empty():
+            self._done.set()
+            return self
+        self._running = min(self._workers, self._queue.qsize())
+        for _ in xrange(self._running):
+            t = threading.Thread(target=self._work, name='GamePreloader')
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def wait(self, timeout=None):
+        """Block until preloading finished or the time budget ran out.
+
+        :param timeout: float | None -- Seconds to wait; defaults to what is
+            left of the time budget.
+        :return: bool -- Whether all queued games were preloaded.
+        """
+        if not self._started:
+            self.start()
+        if timeout is None:
+            timeout = max(0.0, self._started + self._time_budget - time.time())
+        self._done.wait(timeout)
+        return self._done.is_set() and self._queue.empty()
+
+    def _add(self, game_ids):
+        known = set(self._uids)
+        new = []
+        for uid in game_ids:
+            if uid not in known:
+                known.add(uid)
+                new.append(uid)
+        self._uids += new
+        return len(new)
+
+    def _expired(self):
+        return bool(self._started and
+                    time.time() - self._started > self._time_budget)
+
+    def _work(self):
+        try:
+            while not self._expired():
+                try:
+                    batch = self._queue.get_nowait()
+                except Empty:
+                    break
+                self._restore_batch(batch)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if not self._running:
+                    self._done.set()
+
+    def _restore_batch(self, batch):
+        batch = [uid for uid in batch
+                 if not self._data_store.get_strict_controller(Game, uid)]
+        loaded = failed = skipped = 0
+        if self._leases and batch:
+            owned = self._leases.acquire(*batch)
+            skipped = len(batch) - len(owned)
+            batch = [uid for uid in batch if uid in owned]
+        try:
+            self._data_store.prefetch_documents(Game, batch)
+            models = [m for m in (self._data_store.get_strict_model(Game, uid)
+                                  for uid in batch) if m]
+        except Exception:
+            models = []
+        for model in models:
+            if model.state not in self.ACTIVE_STATES:
+                skipped += 1
+                if self._leases:
+                    self._leases.release(model.uid)
+                continue
+            try:
+                Game.restore(self._data_store, model,
+                             prefetch=['players', 'spectators', 'table'])
+                loaded += 1
+            except Exception:
+                failed += 1
+        with self._lock:
+            self._batches += 1
+            self._loaded += loaded
+            self._skipped += skipped
+            self._failed += failed + len(batch) - len(models)
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
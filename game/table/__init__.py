@@ -5,16 +5,23 @@
 Exports:
     :class Table -- The game table.
     :Enum Table.State -- The game table states.
+    :class TableState -- Immutable, detached table state.
+    :class Move -- A single table action for `TableState.apply`.
+    :class MoveLog -- Keyframed log of a game's table moves.
+    :module state
+    :module replay
 
 """
 
+import random
 from combomethod import combomethod
 from core.datamodel import DataModelController, DataModel, Collection
-from core.enum import Enum
 from core.exceptions import StateError
 from core.decorators import classproperty
-from game.deck import CardHolder, Deck, Card
+from game.deck import DiscardPile, Deck, Card
 from game.player import Player
+from game.table.state import TableState, Move
+from game.table.replay import MoveLog
 
 
 # noinspection PyAttributeOutsideInit
@@ -33,19 +40,31 @@ class Table(DataModelController):
         :type active: list -- The cards played for each round.
         :type players: list -- Table's player IDs.
         :type discards: dict -- The team's discard piles.
+        :type scores: dict -- Running point totals of the discard piles.
         :type bet_team: str -- The team with the highest/winning bid.
         :type bet_amount: int -- The highest/winning bid.
         :type deck: Deck -- The table's card deck.
         :type state: Table.State/str -- The table state.
         :type player_turn: int -- The ID of the player who's turn it is.
+        :type lead_suit: Card.Suit/int | None -- The suit led this trick.
+        :type hand_record: dict | None -- Deal, bids and tricks of the
+            current hand, as card codes and seats.
+        :type move_log: MoveLog -- Deals and moves of the whole game, for
+            replay and seeking.
+        :type seed: int | None -- Base of the per-hand shuffle seeds, so a
+            hand's deal is reproduced when its moves are replayed.
 
     Public Methods:
         pause -- Pauses the gameplay.
         resume -- Resumes the gameplay.
+        legal_cards -- The cards a player may legally play.
+        snapshot -- Detached, immutable `TableState` of the table.
+        load_state -- Overwrite the table from a `TableState`.
+        cache_members -- Sub-controllers cached and evicted with the table.
 
     """
 
-    State = Enum('CREATED', 'BETTING', 'PLAYING', 'PAUSED', 'END')
+    State = TableState.State
 
     # noinspection PyCallByClass,PyTypeChecker,PyMethodParameters
     @classproperty
@@ -55,10 +74,8 @@ class Table(DataModelController):
             'deck': ('deck', DataModel,
                      lambda x: x.model if x else DataModel.Null),
             'players': ('players', list, None),
-            'kitty': ('kitty', Collection.List,
-                      lambda x: dict(x) if x else None),
-            'active_cards': ('active_cards', Collection.List,
-                       lambda x: dict(x) if x else None),
+            'kitty': ('kitty', Collection.List, Card.encode),
+            'active_cards': ('active_cards', Collection.List, Card.encode),
             'discards': ('discards', Collection.Dict(DataModel),
                          lambda x: x.model if x else DataModel.Null),
             'state': ('state', str, None),
@@ -69,7 +86,11 @@ class Table(DataModelController):
             'trump_suit': ('trump_suit', int, None),
             'round_start_player': ('round_start_player', int, None),
             'round': ('round', int, None),
-            '_prev_state': ('_prev_state', None, None)
+            '_prev_state': ('_prev_state', None, None),
+            '_hand_log': ('_hand_log', None, None),
+            'keyframes': ('keyframes', Collection.List(dict), None),
+            'moves': ('moves', Collection.List(list), None),
+            'seed': ('seed', int, None)
         })
         return rules
 
@@ -88,7 +109,11 @@ class Table(DataModelController):
             'bet_amount': 0,
             'trump_suit': 0,
             'round': 1,
-            '_prev_state': None
+            '_prev_state': None,
+            '_hand_log': None,
+            'keyframes': [],
+            'moves': [],
+            'seed': None
         })
         return defaults
 
@@ -117,10 +142,11 @@ class Table(DataModelController):
         kwargs.update({'players': players,
                   'deck': deck,
                   'discards': {
-                      'A': CardHolder.new(None, data_store, sort_method='value'),
-                      'B': CardHolder.new(None, data_store, sort_method='value')
+                      'A': DiscardPile.new(None, data_store, sort_method='value'),
+                      'B': DiscardPile.new(None, data_store, sort_method='value')
                   }
         })
+        kwargs.setdefault('seed', random.getrandbits(32))
         return super(Table, cls).new(data_store, **kwargs)
 
     # noinspection PyMethodOverriding
@@ -128,51 +154,92 @@ class Table(DataModelController):
     def restore(cls, data_store, data_model, **kwargs):
         kwargs.update({
             'discards': {
-                'A': CardHolder.restore(data_store, data_model.discards['A']),
-                'B': CardHolder.restore(data_store, data_model.discards['B'])},
-            'kitty': [Card(c) if c else None for c in data_model.kitty],
+                'A': DiscardPile.restore(data_store, data_model.discards['A']),
+                'B': DiscardPile.restore(data_store, data_model.discards['B'])},
+            'kitty': [Card.decode(c) for c in data_model.kitty],
             'active_cards':
-                [Card(c) if c else None for c in data_model.active],
+                [Card.decode(c) for c in data_model.active_cards],
             'state': data_model.state,
             'player_turn': data_model.player_turn,
             'bet_team': data_model.bet_team,
             'bet_amount': data_model.bet_amount,
             '_prev_state': data_model['_prev_state'],
+            '_hand_log': data_model.get('_hand_log'),
+            'keyframes': data_model.get('keyframes') or [],
+            'moves': data_model.get('moves') or [],
+            'seed': data_model.get('seed'),
             'trump_suit': data_model.trump_suit,
             'round_start_player': data_model.round_start_player,
             'round': data_model.round,
             'deck': Deck.restore(data_store, data_model.deck),
             'players': data_model.players
         })
-        return super(Table, cls).restore(data_model, data_store, **kwargs)
+        return super(Table, cls).restore(data_store, data_model, **kwargs)
+
+    def cache_members(self):
+        """Sub-controllers cached and evicted as a unit with the table."""
+        return [self.deck, self.discards['A'], self.discards['B']]
+
+    def snapshot(self):
+        """Detached, immutable copy of the table for search/analysis.
+
+        :return: TableState
+        """
+        return TableState.from_table(self)
+
+    def load_state(self, state):
+        """Overwrite the table and its players' hands from a `TableState`.
+
+        :param state: TableState
+        """
+        state.to_table(self)
 
     def restart(self):
         if self.state is not Table.State.END:
             raise StateError("Cannot restart a game from state: " + self.state)
         self.state = Table.State.CREATED
         self.round += 1
-        self.deck.rebuild(self.dicsards['A'], self.discards['B'])
+        self.deck.rebuild(self.discards['A'], self.discards['B'])
         self._update_model('deck')
         self._update_model('discards')
-        self.kitty = [None] * 4,
+        self.kitty = [None] * 4
         self.active_cards = [None] * 4
         self.betters = [0, 1, 2, 3]
-        self.bet_team = '',
-        self.bet_amount = 0,
-        self.trump_suit = 0,
+        self.bet_team = ''
+        self.bet_amount = 0
+        self.trump_suit = 0
         self.round_start_player = self.round % 4
         self.setup()
 
     def setup(self):
         if self.state is not Table.State.CREATED:
             raise StateError('Table must be CREATED to be setup.')
-        self.deck.shuffle()
+        if self.seed is None:
+            seed = random.getrandbits(32)
+        else:
+            seed = (self.seed + self.round * 0x9e3779b1) & 0xffffffff
+        self.deck.shuffle(seed)
         self.kitty = self.deck.deal(4)
         while self.deck.has_cards:
             for pid in self.players:
                 card = self.deck.deal()
                 Player.get(self._data_store, pid).hand.insert_card(card)
         self._update_model('deck')
+        self._hand_log = {
+            'round': self.round,
+            'start': self.round_start_player,
+            'kitty': [c.code for c in self.kitty],
+            'deal': [[c.code for c in
+                      Player.get(self._data_store, pid).hand.cards]
+                     for pid in self.players],
+            'bids': [],
+            'bettor': None,
+            'tricks': []
+        }
+        self.move_log.add_keyframe(self.round, self.round_start_player, seed,
+                                   self._hand_log['kitty'],
+                                   self._hand_log['deal'])
+        self._update_model_collection('keyframes', {'action': 'append'})
         self.state = Table.State.BETTING
         self.player_turn = self.round_start_player
 
@@ -216,23 +283,61 @@ class Table(DataModelController):
             raise ValueError("Amount must be a multiple of 5.")
         elif amount <= self.bet_amount:
             raise ValueError("Amount cannot be less than current bid.")
+        elif amount > TableState.MAX_BET:
+            raise ValueError("Amount cannot be more than %d." %
+                             TableState.MAX_BET)
         else:
             self.bet_amount = amount
+        self._log('bids', [self.player_turn, amount or 0])
+        self._record(TableState.Action.BET, amount or 0)
         self.next_turn()
 
+    @property
+    def hand_record(self):
+        return self._hand_log
+
+    @property
+    def move_log(self):
+        return MoveLog(self.players, self.keyframes, self.moves)
+
+    @property
+    def scores(self):
+        return {'A': self.discards['A'].points,
+                'B': self.discards['B'].points}
+
+    @property
+    def lead_suit(self):
+        lead = self.active_cards[self.round_start_player]
+        return lead.suit if lead else None
+
+    def legal_cards(self, player_id):
+        """Cards the player may legally play on the current trick.
+
+        :param player_id: str -- The player's ID.
+        :return: list -- The playable cards, or an empty list if it is not
+            the player's turn to play.
+        """
+        if (self.state is not Table.State.PLAYING or not self.trump_suit or
+                player_id != self.players[self.player_turn]):
+            return []
+        p = Player.get(self._data_store, player_id)
+        return p.hand.playable_cards(self.lead_suit)
+
     def play_card(self, player_id, card):
         if not self.trump_suit:
             raise StateError("Cannot play card before trump suit is set.")
         if (self.state is not Table.State.PLAYING or
                 player_id is not self.players[self.player_turn]):
             raise StateError("It is not the player's turn to play a card.")
-        p = Player.get(player_id, self._data_store)
-        if p:
-            c = p.hand.remove_card(card)
-        if not p or not c:
+        p = Player.get(self._data_store, player_id)
+        if not p or not p.hand.is_playable(card):
             raise ValueError("Invalid player or card supplied to play_card.")
+        if not p.hand.is_playable(card, self.lead_suit):
+            raise ValueError("Card does not follow the lead suit.")
+        c = p.hand.remove_card(card)
         self.active_cards[self.player_turn] = c
         self._update_model('active_cards')
+        self._record(TableState.Action.PLAY, c.code)
         self.next_turn()
 
     def set_trump_suit(self, player_id, suit):
@@ -242,11 +347,15 @@ class Table(DataModelController):
                 self.trump_suit is not 0):
             raise StateError("It is not the player's turn to pick a trump suit.")
         self.trump_suit = suit
+        self._record(TableState.Action.TRUMP, suit)
 
     def _end_betting(self):
         self.round_start_player = self.betters[0]
-        p = Player.get(self.players[self.betters[0]], self._data_store)
+        p = Player.get(self._data_store, self.players[self.betters[0]])
         self.bet_team = p.team
+        if self._hand_log:
+            self._hand_log['bettor'] = self.betters[0]
+            self._update_model('_hand_log')
         for c in self.kitty:
             p.hand.insert_card(c)
         self.kitty = [None] * 4
@@ -264,17 +373,28 @@ class Table(DataModelController):
                  (c.suit is high_card.suit and c.value > high_card.value))):
                 high_card = c
         index = self.active_cards.index(high_card)
-        winner = Player.get(self.players[index], self._data_store)
-        for c in self.active_cards:
-            self.discards[winner.team].append(c)
-            self._update_model_collection('discards', {'action': 'append'})
+        self._log('tricks', [self.round_start_player, index] +
+                  [c.code for c in self.active_cards])
+        winner = Player.get(self._data_store, self.players[index])
+        self.discards[winner.team].append_cards(self.active_cards)
+        self._update_model('discards')
         self.active_cards = [None] * 4
-        if not winner.hand.card_count:
+        if not all(Player.get(self._data_store, pid).hand.has_cards
+                   for pid in self.players):
             self.state = Table.State.END
         else:
             self.round_start_player = index
             self.player_turn = index
 
+    def _record(self, action, value):
+        self.move_log.append(Move(action, self.player_turn, value))
+        self._update_model_collection('moves', {'action': 'append'})
+
+    def _log(self, key, entry):
+        if self._hand_log:
+            self._hand_log[key].append(entry)
+            self._update_model('_hand_log')
+
 
 # ----------------------------------------------------------------------------
 __version__ = 0.1
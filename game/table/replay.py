@@ -0,0 +1,258 @@
+"""Game move log and replay.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class MoveLog -- Keyframed log of a game's table moves.
+
+"""
+
+import struct
+from bisect import bisect_right
+from game.table.state import TableState, Move
+
+MAGIC = 'P2ML'
+VERSION = 1
+
+_ACTIONS = (TableState.Action.BET, TableState.Action.TRUMP,
+            TableState.Action.PLAY)
+_NO_CARD = 0xff
+_HEADER = struct.Struct('<4sBB')
+_KEYFRAME = struct.Struct('<IHBI4B')
+
+
+class MoveLog(object):
+    """Keyframed log of every move made at a game's table.
+
+    A keyframe is recorded at each deal: the shuffle seed, the starting
+    seat and the dealt hands and kitty (card codes), which is the whole
+    table state at that point. Every accepted bet, trump pick and card
+    played is then appended as an `[action, seat, value]` triple. Any
+    point of the game is rebuilt from the nearest keyframe before it plus
+    the moves of that hand, so a seek never replays more than one hand.
+
+    The keyframe and move lists are shared, not copied, so a log built on
+    a `Table`'s lists records straight into the table model.
+
+    Init Parameters:
+        players -- Player IDs by seat.
+        keyframes -- Keyframe dicts, one per hand.
+        moves -- Encoded moves.
+
+    Class Methods:
+        from_bytes -- Decode a log written by `to_bytes`.
+
+    Properties:
+        :type players: tuple -- Player IDs by seat.
+        :type keyframes: list -- Dicts of 'move' (index of the hand's first
+            move), 'round', 'start', 'seed', 'kitty' and 'deal'.
+        :type hands: int -- Number of hands dealt.
+
+    Public Methods:
+        add_keyframe -- Record a deal.
+        append -- Record a move.
+        move -- A recorded move.
+        state_at -- Table state after a number of moves.
+        trick_position -- Move index at which a trick starts.
+        seek -- Table state at the start of a trick.
+        to_bytes -- Compact binary encoding of the log.
+
+    """
+
+    def __init__(self, players, keyframes=None, moves=None):
+        self.players = tuple(players)
+        self.keyframes = keyframes if keyframes is not None else []
+        self._moves = moves if moves is not None else []
+
+    def __len__(self):
+        return len(self._moves)
+
+    @property
+    def hands(self):
+        return len(self.keyframes)
+
+    def add_keyframe(self, round, start, seed, kitty, deal):
+        """Record a deal; following moves belong to this hand.
+
+        :param round: int -- The table round.
+        :param start: int -- The seat that bids first.
+        :param seed: int | None -- The deck shuffle seed.
+        :param kitty: list -- Kitty card codes.
+        :param deal: list -- Card codes dealt to each seat.
+        """
+        self.keyframes.append({
+            'move': len(self._moves),
+            'round': round,
+            'start': start,
+            'seed': seed,
+            'kitty': list(kitty),
+            'deal': [list(codes) for codes in deal]
+        })
+
+    def append(self, move):
+        """Record a move.
+
+        :param move: Move | tuple -- (action, seat, value), with value the
+            bid amount, the trump suit or the card code.
+        """
+        action, seat, value = move
+        self._moves.append([_ACTIONS.index(action), seat, int(value)])
+
+    def move(self, index):
+        action, seat, value = self._moves[index]
+        return Move(_ACTIONS[action], seat, value)
+
+    def state_at(self, position=None):
+        """Table state after a number of moves.
+
+        At a position where one hand ends and the next is dealt, the state
+        of the new deal is returned.
+
+        :param position: int | None -- Number of moves; defaults to all.
+        :return: TableState
+        :raise: IndexError if no hand was dealt by then.
+        """
+        if position is None:
+            position = len(self._moves)
+        hand = bisect_right([k['move'] for k in self.keyframes], position) - 1
+        if hand < 0 or position > len(self._moves):
+            raise IndexError("No table state at move " + str(position))
+        state = self._keyframe_state(self.keyframes[hand])
+        for i in xrange(self.keyframes[hand]['move'], position):
+            state = state.apply(self.move(i))
+        return state
+
+    def trick_position(self, hand, trick=0):
+        """Move index at which a trick starts.
+
+        :param hand: int -- 0-based hand number.
+        :param trick: int -- 0-based trick number within the hand.
+        :return: int
+        :raise: IndexError if the trick has not been started.
+        """
+        start = self.keyframes[hand]['move']
+        end = (self.keyframes[hand + 1]['move']
+               if hand + 1 < len(self.keyframes) else len(self._moves))
+        plays = 0
+        play = _ACTIONS.index(TableState.Action.PLAY)
+        for i in xrange(start, end):
+            if self._moves[i][0] == play:
+                if plays == trick * 4:
+                    return i
+                plays += 1
+        raise IndexError("Trick %d of hand %d was not played." % (trick, hand))
+
+    def seek(self, hand, trick=0):
+        """Table state at the start of a trick, before its first card.
+
+        :param hand: int -- 0-based hand number.
+        :param trick: int -- 0-based trick number within the hand.
+        :return: TableState
+        """
+        return self.state_at(self.trick_position(hand, trick))
+
+    def to_bytes(self):
+        """Compact binary encoding of the log.
+
+        Player IDs are length-prefixed UTF-8, each keyframe is a fixed
+        header plus its dealt card codes, and each move is two bytes. A
+        move value always fits in one byte, as bids are capped at
+        `TableState.MAX_BET` and suits and card codes are smaller.
+
+        :return: str
+        """
+        out = [_HEADER.pack(MAGIC, VERSION, len(self.players))]
+        for pid in self.players:
+            name = pid.encode('utf-8')
+            out.append(struct.pack('<H', len(name)) + name)
+        out.append(struct.pack('<I', len(self.keyframes)))
+        for k in self.keyframes:
+            kitty = list(k['kitty']) + [_NO_CARD] * (4 - len(k['kitty']))
+            out.append(_KEYFRAME.pack(k['move'], k['round'], k['start'],
+                                      k['seed'] or 0, *kitty))
+            for codes in k['deal']:
+                out.append(struct.pack('<B%dB' % len(codes), len(codes),
+                                       *codes))
+        moves = bytearray(2 * len(self._moves))
+        for i, (action, seat, value) in enumerate(self._moves):
+            moves[2 * i] = action << 2 | seat
+            moves[2 * i + 1] = value
+        out.append(struct.pack('<I', len(self._moves)))
+        out.append(str(moves))
+        return ''.join(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode a log written by `to_bytes`.
+
+        :param data: str -- The encoded log.
+        :return: MoveLog
+        :raise: ValueError if the data is not a move log.
+        """
+        magic, version, num_players = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a move log, or unsupported version.")
+        pos = _HEADER.size
+        players = []
+        for _ in xrange(num_players):
+            size, = struct.unpack_from('<H', data, pos)
+            players.append(data[pos + 2:pos + 2 + size].decode('utf-8'))
+            pos += 2 + size
+        num_keyframes, = struct.unpack_from('<I', data, pos)
+        pos += 4
+        raw = bytearray(data)
+        keyframes = []
+        for _ in xrange(num_keyframes):
+            values = _KEYFRAME.unpack_from(data, pos)
+            pos += _KEYFRAME.size
+            deal = []
+            for _ in players:
+                size = raw[pos]
+                deal.append(list(raw[pos + 1:pos + 1 + size]))
+                pos += 1 + size
+            keyframes.append({
+                'move': values[0],
+                'round': values[1],
+                'start': values[2],
+                'seed': values[3],
+                'kitty': [c for c in values[4:] if c != _NO_CARD],
+                'deal': deal
+            })
+        num_moves, = struct.unpack_from('<I', data, pos)
+        pos += 4
+        moves = raw[pos:pos + 2 * num_moves]
+        return cls(players, keyframes, [
+            [moves[i] >> 2, moves[i] & 3, moves[i + 1]]
+            for i in xrange(0, len(moves), 2)])
+
+    def _keyframe_state(self, keyframe):
+        start = keyframe['start']
+        return TableState(
+            players=self.players,
+            hands=[_codes_mask(codes) for codes in keyframe['deal']],
+            kitty=_codes_mask(keyframe['kitty']),
+            active_cards=[None] * 4,
+            discards=(0, 0),
+            state=TableState.State.BETTING,
+            betters=(0, 1, 2, 3),
+            player_turn=start,
+            bet_amount=0,
+            bet_team='',
+            trump_suit=0,
+            round_start_player=start,
+            round=keyframe['round'])
+
+
+def _codes_mask(codes):
+    """Card bitmask of a list of card codes."""
+    mask = 0
+    for code in codes:
+        mask |= 1 << code
+    return mask
+
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -0,0 +1,352 @@
+"""Detached game table state.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class TableState -- Immutable table value type for search/analysis.
+    :class Move -- A single table action.
+
+"""
+
+from collections import namedtuple
+from core.enum import Enum
+from core.exceptions import StateError
+from game.deck.card import Card
+from game.deck.discardpile import DiscardPile
+from game.player import Player
+
+
+Move = namedtuple('Move', ['action', 'seat', 'value'])
+
+_SUIT_BITS = 0xffff
+_POINT_MASKS = [(worth, sum(1 << Card(suit, value).code for suit in Card.Suit))
+                for value, worth in DiscardPile.CARD_POINTS.iteritems()]
+
+
+class TableState(object):
+    """Immutable snapshot of a game table.
+
+    Holds no `DataStore`, listeners, or controllers. Hands, kitty and
+    discards are stored as card bitmasks (see `Card.code`), so a state is a
+    handful of ints and small tuples, and every `apply` shares all
+    untouched members with the state it was derived from.
+
+    Class Properties:
+        :type State: Enum -- Enumerated table state types.
+        :type Action: Enum -- Enumerated move actions.
+        :type MAX_BET: int -- Highest allowed bid.
+
+    Class Methods:
+        from_table -- Snapshot a live `Table` controller.
+
+    Properties:
+        :type players: tuple -- Player IDs by seat.
+        :type hands: tuple -- Card bitmask of each seat's hand.
+        :type kitty: int -- Card bitmask of the kitty.
+        :type active_cards: tuple -- Card code played by each seat, or None.
+        :type discards: tuple -- Card bitmasks of team A and B discards.
+        :type lead_suit: Card.Suit/int | None -- The suit led this trick.
+        :type scores: dict -- Point totals of the team discards.
+
+    Public Methods:
+        snapshot -- O(1) snapshot of the state.
+        apply -- New state with a move applied.
+        legal_moves -- Moves available to the seat whose turn it is.
+        hand_cards -- A seat's hand as a list of cards.
+        to_table -- Write the state back to a live `Table` controller.
+
+    """
+
+    State = Enum('CREATED', 'BETTING', 'PLAYING', 'PAUSED', 'END')
+    Action = Enum('BET', 'TRUMP', 'PLAY')
+
+    MAX_BET = 100
+
+    __slots__ = ('players', 'hands', 'kitty', 'active_cards', 'discards',
+                 'state', 'betters', 'player_turn', 'bet_amount', 'bet_team',
+                 'trump_suit', 'round_start_player', 'round')
+
+    def __init__(self, players, hands, kitty, active_cards, discards, state,
+                 betters, player_turn, bet_amount, bet_team, trump_suit,
+                 round_start_player, round):
+        values = (tuple(players), tuple(hands), kitty, tuple(active_cards),
+                  tuple(discards), state, tuple(betters), player_turn,
+                  bet_amount, bet_team, trump_suit, round_start_player, round)
+        for key, value in zip(self.__slots__, values):
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('TableState cannot be changed once created.')
+
+    def __eq__(self, other):
+        return (isinstance(other, TableState) and
+                all(getattr(self, k) == getattr(other, k)
+                    for k in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, k) for k in self.__slots__))
+
+    @classmethod
+    def from_table(cls, table):
+        """Snapshot a live `Table` controller.
+
+        :param table: Table -- The table controller.
+        :return: TableState
+        """
+        hands = [_cards_mask(Player.get(table._data_store, pid).hand)
+                 for pid in table.players]
+        return cls(
+            players=table.players,
+            hands=hands,
+            kitty=_cards_mask(table.kitty),
+            active_cards=[c.code if c else None for c in table.active_cards],
+            discards=(_cards_mask(table.discards['A']),
+                      _cards_mask(table.discards['B'])),
+            state=table.state,
+            betters=table.betters,
+            player_turn=table.player_turn,
+            bet_amount=table.bet_amount,
+            bet_team=table.bet_team,
+            trump_suit=table.trump_suit,
+            round_start_player=table.round_start_player,
+            round=table.round)
+
+    @property
+    def lead_suit(self):
+        lead = self.active_cards[self.round_start_player]
+        return None if lead is None else lead >> 4
+
+    @property
+    def scores(self):
+        return {'A': _mask_points(self.discards[0]),
+                'B': _mask_points(self.discards[1])}
+
+    def snapshot(self):
+        """O(1) snapshot; states are immutable, so this is the state itself.
+
+        :return: TableState
+        """
+        return self
+
+    def hand_cards(self, seat):
+        """A seat's hand as a list of cards.
+
+        :param seat: int -- The seat index.
+        :return: list
+        """
+        return _mask_cards(self.hands[seat])
+
+    def legal_moves(self):
+        """Moves available to the seat whose turn it is.
+
+        :return: list -- List of `Move`s.
+        """
+        seat = self.player_turn
+        if self.state == TableState.State.BETTING:
+            return [Move(TableState.Action.BET, seat, amount) for amount in
+                    [0] + range(self.bet_amount + 5, self.MAX_BET + 1, 5)]
+        if self.state != TableState.State.PLAYING:
+            return []
+        if not self.trump_suit:
+            return [Move(TableState.Action.TRUMP, seat, suit)
+                    for suit in Card.Suit]
+        hand = _playable_mask(self.hands[seat], self.lead_suit)
+        return [Move(TableState.Action.PLAY, seat, code)
+                for code in _mask_codes(hand)]
+
+    def apply(self, move):
+        """New state with a move applied.
+
+        Mirrors the rules of `Table.bet`, `Table.set_trump_suit` and
+        `Table.play_card`.
+
+        :param move: Move | tuple -- (action, seat, value), where value is
+            the bid amount, the trump suit, or the card (or its code).
+        :return: TableState -- The new state.
+        :raise: StateError if the move is not allowed in the current state,
+            ValueError if the move value is invalid.
+        """
+        action, seat, value = move
+        if action == TableState.Action.BET:
+            return self._bet(seat, value)
+        elif action == TableState.Action.TRUMP:
+            return self._set_trump_suit(seat, value)
+        elif action == TableState.Action.PLAY:
+            return self._play_card(seat, value)
+        raise ValueError("Unknown move action: " + str(action))
+
+    def to_table(self, table):
+        """Write the state back to a live `Table` controller.
+
+        :param table: Table -- The table controller. Must seat the same
+            players as the state.
+        :return: Table -- The updated table.
+        """
+        if tuple(table.players) != self.players:
+            raise ValueError("Table players do not match the state.")
+        for pid, mask in zip(self.players, self.hands):
+            hand = Player.get(table._data_store, pid).hand
+            hand.cards = _mask_cards(mask)
+            if hand.sort_method:
+                hand.sort()
+        for team, mask in zip(('A', 'B'), self.discards):
+            table.discards[team].cards = _mask_cards(mask)
+        kitty = _mask_cards(self.kitty)
+        table.kitty = kitty + [None] * (4 - len(kitty)) if kitty else [None] * 4
+        table.active_cards = [Card.from_code(c) if c is not None else None
+                              for c in self.active_cards]
+        table.betters = list(self.betters)
+        table.player_turn = self.player_turn
+        table.bet_amount = self.bet_amount
+        table.bet_team = self.bet_team
+        table.trump_suit = self.trump_suit
+        table.round_start_player = self.round_start_player
+        table.round = self.round
+        table.state = self.state
+        return table
+
+    def _replace(self, **kwargs):
+        values = dict((k, getattr(self, k)) for k in self.__slots__)
+        values.update(kwargs)
+        return TableState(**values)
+
+    def _bet(self, seat, amount):
+        if self.state != TableState.State.BETTING or seat != self.player_turn:
+            raise StateError("It is not the player's turn to bet.")
+        if not amount:
+            betters = tuple(b for b in self.betters if b != seat)
+            state = self._replace(betters=betters)
+        elif (amount % 5) is not 0:
+            raise ValueError("Amount must be a multiple of 5.")
+        elif amount <= self.bet_amount:
+            raise ValueError("Amount cannot be less than current bid.")
+        elif amount > self.MAX_BET:
+            raise ValueError("Amount cannot be more than %d." % self.MAX_BET)
+        else:
+            state = self._replace(bet_amount=amount)
+        return state._next_turn()
+
+    def _set_trump_suit(self, seat, suit):
+        if (self.state != TableState.State.PLAYING or
+                seat != self.player_turn or
+                seat != self.round_start_player or self.trump_suit):
+            raise StateError("It is not the player's turn to pick a trump suit.")
+        return self._replace(trump_suit=suit)
+
+    def _play_card(self, seat, card):
+        if not self.trump_suit:
+            raise StateError("Cannot play card before trump suit is set.")
+        if self.state != TableState.State.PLAYING or seat != self.player_turn:
+            raise StateError("It is not the player's turn to play a card.")
+        code = card if isinstance(card, int) else card.code
+        bit = 1 << code
+        hand = self.hands[seat]
+        if not hand & bit:
+            raise ValueError("Invalid card supplied to play_card.")
+        if not _playable_mask(hand, self.lead_suit) & bit:
+            raise ValueError("Card does not follow the lead suit.")
+        hands = list(self.hands)
+        hands[seat] = hand & ~bit
+        active = list(self.active_cards)
+        active[seat] = code
+        return self._replace(hands=hands, active_cards=active)._next_turn()
+
+    def _next_turn(self, add=1):
+        next_turn = (self.player_turn + add) % len(self.players)
+        if self.state == TableState.State.BETTING and len(self.betters) is 1:
+            return self._end_betting()
+        elif (self.state == TableState.State.BETTING and
+                next_turn not in self.betters):
+            return self._next_turn(add + 1)
+        elif (self.state == TableState.State.PLAYING and
+                next_turn == self.round_start_player):
+            return self._end_round()
+        return self._replace(player_turn=next_turn)
+
+    def _end_betting(self):
+        seat = self.betters[0]
+        hands = list(self.hands)
+        hands[seat] |= self.kitty
+        return self._replace(hands=hands, kitty=0, bet_team=_seat_team(seat),
+                             round_start_player=seat, player_turn=seat,
+                             state=TableState.State.PLAYING)
+
+    def _end_round(self):
+        index = self.round_start_player
+        high = self.active_cards[index]
+        suits = [high >> 4, self.trump_suit]
+        for i, c in enumerate(self.active_cards):
+            if c is None or i == index:
+                continue
+            suit, h_suit = c >> 4, high >> 4
+            if (suit in suits and
+                    (suits.index(suit) > suits.index(h_suit) or
+                     (suit == h_suit and (c & 0xf) > (high & 0xf)))):
+                high, index = c, i
+        trick = 0
+        for c in self.active_cards:
+            if c is not None:
+                trick |= 1 << c
+        discards = list(self.discards)
+        discards[0 if _seat_team(index) == 'A' else 1] |= trick
+        kwargs = {'discards': discards, 'active_cards': [None] * 4}
+        if not all(self.hands):
+            kwargs['state'] = TableState.State.END
+        else:
+            kwargs.update(round_start_player=index, player_turn=index)
+        return self._replace(**kwargs)
+
+
+def _seat_team(seat):
+    """Team of a seat; see `Game.add_player`."""
+    return 'A' if seat in (0, 2) else 'B'
+
+
+def _cards_mask(cards):
+    """Card bitmask of an iterable of cards (None entries are skipped)."""
+    mask = 0
+    for c in cards:
+        if c:
+            mask |= 1 << Card(c).code
+    return mask
+
+
+def _mask_codes(mask):
+    """Card codes set in a card bitmask, in ascending order."""
+    codes = []
+    code = 0
+    while mask:
+        if mask & 1:
+            codes.append(code)
+        mask >>= 1
+        code += 1
+    return codes
+
+
+def _mask_cards(mask):
+    """Cards set in a card bitmask."""
+    return [Card.from_code(code) for code in _mask_codes(mask)]
+
+
+def _mask_points(mask):
+    """Point total of the cards set in a card bitmask."""
+    return sum(worth * bin(mask & value_mask).count('1')
+               for worth, value_mask in _POINT_MASKS)
+
+
+def _playable_mask(hand, lead_suit):
+    """Subset of a hand bitmask that may be played on the lead suit."""
+    if lead_suit is None:
+        return hand
+    follow = hand & (_SUIT_BITS << (lead_suit << 4))
+    return follow or hand
+
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -1,4 +1,34 @@
-"""
+"""Application startup.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :func setup_database -- Create the indexes the stores query by.
 
 """
 
+from game import Game
+from store.user import User
+from store.user.pairs import PairRatings
+
+
+def setup_database(data_store):
+    """Create the indexes the stores query by; run once at startup.
+
+    Declared model indexes of every persisted controller class and the
+    pair rating indexes are created if missing.
+
+    :param data_store: The DataStore controller.
+    :return: dict -- See `DataStore.ensure_indexes`.
+    :raise: ValueError if a unique index could not be created because the
+        stored models hold duplicate values.
+    """
+    report = data_store.ensure_indexes(User, Game)
+    PairRatings.ensure_indexes(data_store)
+    failed = ['%s.%s' % (collection, field)
+              for collection, entry in sorted(report.iteritems())
+              for field in entry.get('failed', [])]
+    if failed:
+        raise ValueError("Duplicate values prevent unique indexes on: " +
+                         ', '.join(failed))
+    return report
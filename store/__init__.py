@@ -5,64 +5,105 @@ Contains all packages and modules dealing with user metadata.
 .. packageauthor:: Dave Zimmelman <zimmed@zimmed.io>
 
 Exports:
-
+    :class DataStore -- Cached controller/model store.
+    :class LazyController -- Proxy that restores a controller on first use.
+    :class VersionConflictError -- A model was saved over a newer version.
+    :class StaleOwnerError -- A model was saved without a current lease.
+    :module lazy
+    :module cachestats
+    :module indexes
 
 """
 
-from .db import db, DBLookupError
-from core.datamodel import DataModelController
+import sys
+import threading
+from collections import OrderedDict
+from .db import (db, DBLookupError, PartialModelError, VersionConflictError,
+                 StaleOwnerError)
+from .lazy import LazyController, SubDocumentRef
+from .cachestats import CacheStats
+from core.datamodel import DataModelController, DataModel
 
 
 class ControllerCollection(object):
+    """Cached controllers of a single doc type.
 
-    MAX_CACHE = 100
-
-    def __init__(self, store, max_cache=None):
-        if not max_cache:
-            max_cache = self.__class__.MAX_CACHE
-        self._max_cache = max_cache
-        self._controllers = []
-        self._ctrl_map = {}
-        self._store = store
+    Eviction is not handled here; `DataStore.prune` evicts across all doc
+    types against a shared byte budget.
 
-    def prune(self):
-        while len(self._controllers) > self._max_cache:
-            c = self._controllers.pop()
-            print 'Pruning: ' + repr(c)
-            del self._ctrl_map[c.uid]
-            self._store.save(c.__class__, c.model)
+    Init Parameters:
+        store -- The DataStore controller.
 
-    def shift_down(self, index):
-        for k in self._ctrl_map.iterkeys():
-            if self._ctrl_map[k] > index:
-                self._ctrl_map[k] -= 1
+    """
 
-    def shift_up(self):
-        for k in self._ctrl_map.iterkeys():
-            self._ctrl_map[k] += 1
+    def __init__(self, store):
+        self._controllers = OrderedDict()
+        self._store = store
 
     def insert(self, ctrl):
-        if ctrl.uid in self._ctrl_map.iterkeys():
-            return
-        self._controllers.insert(0, ctrl)
-        self.shift_up()
-        self._ctrl_map[ctrl.uid] = 0
-        self.prune()
+        if ctrl.uid in self._controllers:
+            return False
+        self._controllers[ctrl.uid] = ctrl
+        return True
 
     def get(self, uid):
-        index = self._ctrl_map[uid]
-        return self._controllers[index]
+        return self._controllers[uid]
 
     def remove(self, uid):
-        index = self._ctrl_map[uid]
-        del self._controllers[index]
-        del self._ctrl_map[uid]
-        self.shift_down(index)
+        del self._controllers[uid]
+
+    def __contains__(self, uid):
+        return uid in self._controllers
+
+    def __len__(self):
+        return len(self._controllers)
+
+    def __iter__(self):
+        return self._controllers.itervalues()
 
 
 class DataStore(object):
+    """Cached controller/model store.
+
+    Controllers of every doc type share one cache budget, expressed in
+    approximate bytes of their models. When over budget, `prune` evicts
+    least recently used controllers, treating a controller and its
+    `cache_members` (e.g. a `Game` with its players, hands, table, deck and
+    discards) as one unit. Units are evicted in order of their root's
+    `cache_priority` (lowest first); a priority of None pins the unit.
+
+    Stored models carry a version number, and saves are compare-and-set on
+    the version the model was loaded at, so a save over another process's
+    newer write raises `VersionConflictError` instead of losing it (see
+    `retry_on_conflict`).
+
+    Doc types can be fenced by a lease manager (see `store.lease`): their
+    models are then only saved with a current fencing token, and the store
+    refuses saves carrying a lower token than one it has already seen.
+
+    Class Properties:
+        :type MAX_CACHE_BYTES: int -- Cache budget in approximate bytes.
+        :type CACHE_LOW_WATER: float -- Fraction of the budget to prune down
+            to, so that pruning is not repeated on every insert.
+        :type DEFAULT_CACHE_PRIORITY: int -- Priority of controllers that do
+            not define `cache_priority`.
+
+    """
+
+    MAX_CACHE_BYTES = 64 * 1024 * 1024
+    CACHE_LOW_WATER = 0.9
+    DEFAULT_CACHE_PRIORITY = 1
 
     _CACHE = {}
+    _LRU = OrderedDict()
+    _cache_bytes = 0
+    _prune_floor = 0
+    _OWNERS = {}
+    _UNITS = {}
+    _STATS = CacheStats()
+    _LOCK = threading.RLock()
+    _FENCES = {}
+    _ON_CONFLICT = None
     _db = None
 
     @classmethod
@@ -93,17 +134,42 @@ class DataStore(object):
         return cls._db.generate_uid(doc_type)
 
     @classmethod
-    def get_controller(cls, doc_type, uid):
+    def get_controller(cls, doc_type, uid, prefetch=None):
+        """Get cached controller, or restore it from the database.
+
+        Doc types with `LAZY_RESTORE` set are read without resolving their
+        sub-documents and restored with `doc_type.restore(...,
+        prefetch=prefetch)`, so only the listed members are restored
+        eagerly and the rest on first use (see `Game.restore`). Other doc
+        types are restored with all their sub-documents.
+
+        :param doc_type: type -- The `DataModelController` class.
+        :param uid: str -- The controller's unique ID.
+        :param prefetch: list | None -- Members to restore eagerly; only for
+            doc types with `LAZY_RESTORE`.
+        :return: DataModelController
+        :raise: DBLookupError if no such object is stored; TypeError if
+            `prefetch` is given for a doc type restored eagerly.
+        """
         if not issubclass(doc_type, DataModelController):
             raise TypeError("`doc_type` must be a sub class of "
                             "DataModelController.")
+        lazy = getattr(doc_type, 'LAZY_RESTORE', False)
+        if prefetch is not None and not lazy:
+            raise TypeError(doc_type.__name__ + " does not support prefetch.")
         key = cls._key(doc_type)
         ctrl = cls.get_strict_controller(key, uid)
-        if not ctrl:
-            model = cls.get_strict_model(key, uid)
+        if ctrl:
+            cls._STATS.hit(key)
+        else:
+            cls._STATS.miss(key, uid, cls.MAX_CACHE_BYTES)
+            model = cls.get_strict_model(key, uid, resolve=not lazy)
             if not model:
                 raise DBLookupError("Object does not exist: " + key + ' -- ' + uid)
-            ctrl = doc_type.restore(cls, model)
+            if lazy:
+                ctrl = doc_type.restore(cls, model, prefetch=prefetch or ())
+            else:
+                ctrl = doc_type.restore(cls, model)
         return ctrl
 
     @classmethod
@@ -115,41 +181,414 @@ class DataStore(object):
         return cls.get_strict_model(doc_type, uid)
 
     @classmethod
-    def get_model_data(cls, doc_type, uid):
+    def get_model_data(cls, doc_type, uid, fields=None):
+        """Get the data of a model, from cache or the database.
+
+        :param doc_type: type | str -- The doc type.
+        :param uid: str -- The model's unique ID.
+        :param fields: list | None -- Model fields to load (plus 'uid');
+            all if None. Only those fields are read from the database.
+        :return: dict
+        """
+        doc_type = cls._key(doc_type)
+        ctrl = cls.get_strict_controller(doc_type, uid)
+        if ctrl:
+            data = dict(ctrl.model)
+            if fields:
+                data = dict((k, data[k]) for k in ('uid',) + tuple(fields)
+                            if k in data)
+            return data
+        return cls._db.get_model_data(doc_type, uid, fields)
+
+    @classmethod
+    def get_raw_model_data(cls, doc_type, uid):
+        """Get the data of a model as undecoded BSON, for forwarding.
+
+        Fields are decoded only when accessed, and `.raw` gives the encoded
+        bytes to pass straight on to clients. Sub-documents are left as
+        stored references. If the controller is cached, its current model
+        is encoded instead, since the stored copy may be stale.
+
+        :param doc_type: type | str -- The doc type.
+        :param uid: str -- The model's unique ID.
+        :return: RawBSONDocument
+        :raise: DBLookupError if no such model is stored.
+        """
         doc_type = cls._key(doc_type)
         ctrl = cls.get_strict_controller(doc_type, uid)
         if ctrl:
-            return dict(ctrl.model)
-        return cls._db.get_model_data(doc_type, uid)
+            return cls._db.encode_raw(ctrl.model)
+        return cls._db.get_raw_model_data(doc_type, uid)
+
+    @classmethod
+    def iter_raw_model_data(cls, doc_type, batch_size=100, **kwargs):
+        """Stream stored model data as undecoded BSON.
+
+        See `get_raw_model_data` and `iter_models`; cached controllers are
+        not consulted.
+
+        :return: generator -- Yields `RawBSONDocument`s.
+        """
+        doc_type = cls._key(doc_type)
+        return cls._db.iter_raw_model_data(doc_type, batch_size, **kwargs)
+
+    @classmethod
+    def get_models(cls, doc_type, fields=None, **kwargs):
+        """Get all stored models matching a filter.
+
+        Models loaded with `fields` are partial and cannot be saved with
+        `save`/`update_model`; use `update_model_fields` or `merge_model`.
+
+        :param doc_type: type | str -- The doc type.
+        :param fields: list | None -- Model fields to load; all if None.
+        :param kwargs: The query filter.
+        :return: list -- `DataModel`s.
+        """
+        doc_type = cls._key(doc_type)
+        return cls._db.get_models(doc_type, fields, **kwargs)
 
     @classmethod
     def get_strict_controller(cls, doc_type, uid):
         doc_type = cls._key(doc_type)
-        try:
-            return cls._CACHE[doc_type].get(uid)
-        except KeyError:
-            return None
+        with cls._LOCK:
+            try:
+                ctrl = cls._CACHE[doc_type].get(uid)
+            except KeyError:
+                return None
+            key = (doc_type, uid)
+            cls._LRU[key] = cls._LRU.pop(key)
+            return ctrl
 
     @classmethod
     def set_controller(cls, doc_type, ctrl):
         doc_type = cls._key(doc_type)
-        if doc_type not in cls._CACHE:
-            cls._CACHE[doc_type] = ControllerCollection(cls)
-        return cls._CACHE[doc_type].insert(ctrl)
+        with cls._LOCK:
+            if doc_type not in cls._CACHE:
+                cls._CACHE[doc_type] = ControllerCollection(cls)
+            if cls._CACHE[doc_type].insert(ctrl):
+                size = _approx_size(ctrl.model)
+                cls._LRU[(doc_type, ctrl.uid)] = size
+                cls._cache_bytes += size
+                cls.register_unit(ctrl)
+                cls.prune()
 
     @classmethod
     def delete_controller(cls, doc_type, uid):
         doc_type = cls._key(doc_type)
-        try:
-            cls._CACHE[doc_type].remove(uid)
+        with cls._LOCK:
+            try:
+                cls._CACHE[doc_type].remove(uid)
+            except KeyError:
+                return False
+            key = (doc_type, uid)
+            cls._cache_bytes -= cls._LRU.pop(key, 0)
+            root = cls._OWNERS.pop(key, None)
+            if root:
+                cls._UNITS.get(root, set()).discard(key)
+            for member in cls._UNITS.pop(key, ()):
+                if cls._OWNERS.get(member) == key:
+                    del cls._OWNERS[member]
             return True
-        except KeyError:
-            return False
+
+    @classmethod
+    def register_unit(cls, ctrl):
+        """Record the cache members of a controller's unit, for `prune`.
+
+        Called as controllers are cached, and by unit roots whose members
+        change (see `Game`), so that pruning never walks the units. A member
+        not yet restored is recorded by ID, and its own members once it is
+        cached. Uncached controllers are ignored.
+
+        :param ctrl: DataModelController -- A unit root or member.
+        """
+        with cls._LOCK:
+            key = (cls._key(ctrl.__class__), ctrl.uid)
+            if key not in cls._LRU:
+                return
+            root = cls._OWNERS.get(key, key)
+            if root == key:
+                for member in cls._UNITS.pop(key, ()):
+                    if cls._OWNERS.get(member) == key:
+                        del cls._OWNERS[member]
+            unit = cls._UNITS.setdefault(root, set())
+            for member in _unit_keys(ctrl):
+                if member == root:
+                    continue
+                # A former root brings its unit along.
+                for sub in cls._UNITS.pop(member, set()) | {member}:
+                    cls._OWNERS[sub] = root
+                    unit.add(sub)
+
+    @classmethod
+    def cache_size(cls):
+        """Approximate size of all cached controller models, in bytes."""
+        return cls._cache_bytes
+
+    @classmethod
+    def cache_stats(cls):
+        """Cache analytics.
+
+        :return: dict -- `CacheStats.report`, plus the number of cached
+            controllers and their approximate bytes for each doc type under
+            'types', and the overall 'bytes' and 'budget'.
+        """
+        with cls._LOCK:
+            report = cls._STATS.report()
+            for (doc_type, _), size in cls._LRU.iteritems():
+                entry = report['types'].setdefault(
+                    doc_type, dict((c, 0) for c in CacheStats.COUNTERS))
+                entry['cached'] = entry.get('cached', 0) + 1
+                entry['bytes'] = entry.get('bytes', 0) + size
+            report['bytes'] = cls._cache_bytes
+            report['budget'] = cls.MAX_CACHE_BYTES
+            return report
+
+    @classmethod
+    def ensure_indexes(cls, *doc_types, **kwargs):
+        """Create or verify the indexes declared by controller classes.
+
+        Meant to be run at startup with every persisted controller class.
+
+        :param doc_types: Controller classes with `MODEL_INDEXES`.
+        :param create: bool -- Keyword; False only reports missing indexes.
+        :return: dict -- See `IndexManager.ensure`.
+        """
+        for doc_type in doc_types:
+            indexes = getattr(doc_type, 'MODEL_INDEXES', None)
+            if indexes:
+                cls._db.indexes.declare(cls._key(doc_type), indexes)
+        return cls._db.indexes.ensure(kwargs.get('create', True))
+
+    @classmethod
+    def slow_query_report(cls):
+        """Model fields filtered on without an index; see `IndexManager`."""
+        return cls._db.indexes.slow_query_report()
+
+    @classmethod
+    def document_cache_stats(cls):
+        """Counters of the read-through stored document cache."""
+        return cls._db.doc_cache.stats()
+
+    @classmethod
+    def reset_cache_stats(cls):
+        """Clear cache counters and the ghost cache."""
+        with cls._LOCK:
+            cls._STATS.reset()
+
+    @classmethod
+    def set_cache_budget(cls, max_bytes):
+        """Change the cache budget and prune down to it.
+
+        :param max_bytes: int -- The new budget in approximate bytes.
+        """
+        with cls._LOCK:
+            cls.MAX_CACHE_BYTES = max_bytes
+            cls._prune_floor = 0
+            cls.prune()
+
+    @classmethod
+    def prune(cls):
+        """Evict controller units until the cache is within budget.
+
+        Pinned units (root `cache_priority` of None) are never evicted, so
+        the cache may stay over budget while they are all that is left; it
+        is then not scanned again until it has grown by the low water
+        margin.
+        """
+        with cls._LOCK:
+            if cls._cache_bytes <= max(cls.MAX_CACHE_BYTES, cls._prune_floor):
+                return
+            margin = cls.MAX_CACHE_BYTES * (1 - cls.CACHE_LOW_WATER)
+            target = cls.MAX_CACHE_BYTES - margin
+            candidates = []
+            for order, key in enumerate(cls._LRU):
+                if key in cls._OWNERS:
+                    continue
+                ctrl = cls._CACHE[key[0]].get(key[1])
+                priority = getattr(ctrl, 'cache_priority',
+                                   cls.DEFAULT_CACHE_PRIORITY)
+                if priority is not None:
+                    candidates.append((priority, order, key, ctrl))
+            candidates.sort()
+            for _, _, key, ctrl in candidates:
+                if cls._cache_bytes <= target:
+                    break
+                cls._evict(ctrl, cls.unit_members(ctrl))
+            cls._prune_floor = 0
+            if cls._cache_bytes > cls.MAX_CACHE_BYTES:
+                cls._prune_floor = cls._cache_bytes + margin
+
+    @classmethod
+    def _evict(cls, ctrl, members):
+        """Write back and uncache a controller and its cache members.
+
+        Members are written before their parents, as a lazily restored root
+        only references them. A unit whose stored version moved on, or
+        whose lease was lost, is dropped without writing the rest back, as
+        its changes were made on stale data; the error is passed to the
+        conflict handler (see `set_conflict_handler`).
+        """
+        try:
+            cls.save_unit(ctrl, members)
+            cls._STATS.write_back(cls._key(ctrl.__class__))
+        except (VersionConflictError, StaleOwnerError) as e:
+            cls._STATS.conflict(cls._key(ctrl.__class__))
+            if cls._ON_CONFLICT:
+                cls._ON_CONFLICT(ctrl, e)
+        for c in [ctrl] + members:
+            key = (cls._key(c.__class__), c.uid)
+            size = cls._LRU.get(key, 0)
+            if cls.delete_controller(*key):
+                cls._STATS.evict(key[0], key[1], size, cls.MAX_CACHE_BYTES)
+
+    @classmethod
+    def unit_members(cls, ctrl):
+        """Restored controllers cached as a unit with `ctrl`, recursively.
+
+        :return: list
+        """
+        return list(_cache_members(ctrl))
+
+    @classmethod
+    def save_unit(cls, ctrl, members=None):
+        """Save a controller and its restored cache members, members first.
+
+        Each member is written once; the models it is nested in only
+        reference it.
+
+        :param ctrl: DataModelController -- The root controller.
+        :param members: list | None -- Its cache members, if already known.
+        :raise: VersionConflictError or StaleOwnerError on the first member
+            that could not be saved; the rest are not saved.
+        """
+        if members is None:
+            members = cls.unit_members(ctrl)
+        saved = set()
+        nested = cls._nested_writer(saved)
+        for c in reversed([ctrl] + members):
+            key = cls._key(c.__class__)
+            cls._db.upsert_model(key, c.model, cls._fence(key, c.uid), nested)
+            saved.add(c.uid)
 
     @classmethod
     def save(cls, doc_type, model):
         doc_type = cls._key(doc_type)
-        cls._db.upsert_model(doc_type, model)
+        cls._db.upsert_model(doc_type, model, cls._fence(doc_type, model.uid),
+                             cls._nested_writer())
+
+    @classmethod
+    def set_fence(cls, doc_type, token_of):
+        """Only save models of a doc type with a current fencing token.
+
+        :param doc_type: type | str -- The doc type.
+        :param token_of: callable | None -- Called with a model ID, returns
+            the writer's fencing token, or None if it holds no lease; None
+            removes the fence.
+        """
+        key = cls._key(doc_type)
+        if token_of:
+            cls._FENCES[key] = token_of
+        else:
+            cls._FENCES.pop(key, None)
+
+    @classmethod
+    def set_conflict_handler(cls, callback):
+        """Report units dropped on eviction because they could not be
+        written back.
+
+        :param callback: callable | None -- Called with the unit's root
+            controller and the `VersionConflictError` or `StaleOwnerError`,
+            with the cache lock held; None removes the handler.
+        """
+        cls._ON_CONFLICT = callback
+
+    @classmethod
+    def fence_models(cls, doc_type, tokens):
+        """Raise the stored fence of models, so lower tokens are refused.
+
+        :param tokens: dict -- Model ID to fencing token.
+        """
+        cls._db.fence_models(cls._key(doc_type), tokens)
+
+    @classmethod
+    def _nested_writer(cls, saved=()):
+        """Writer of the sub-documents nested in a saved model.
+
+        Each is fenced like a model of its own doc type, so a unit member is
+        never written around its lease; those in `saved` were written just
+        before and are only referenced.
+
+        :param saved: set -- IDs of the models already written.
+        :return: callable -- Called with a collection and a nested model.
+        """
+        def write(collection, model):
+            if model.uid not in saved:
+                cls._db.upsert_model(collection, model,
+                                     cls._fence(collection, model.uid), write)
+        return write
+
+    @classmethod
+    def _fence(cls, key, uid):
+        token_of = cls._FENCES.get(key)
+        if not token_of:
+            return None
+        token = token_of(uid)
+        if token is None:
+            raise StaleOwnerError(key, uid, None)
+        return token
+
+    @classmethod
+    def model_version(cls, model):
+        """The stored version a model was loaded or last saved at.
+
+        :return: int | None -- None if the model was never loaded or saved
+            by this process.
+        """
+        return cls._db.version(model)
+
+    @classmethod
+    def reload(cls, doc_type, uid):
+        """Drop a cached controller unit and its cached documents, so the
+        next `get_controller` reads the stored version.
+        """
+        key = cls._key(doc_type)
+        cls._db.doc_cache.invalidate(key, uid)
+        ctrl = cls.get_strict_controller(key, uid)
+        if ctrl:
+            for m in _cache_members(ctrl):
+                cls._db.doc_cache.invalidate(cls._key(m.__class__), m.uid)
+            ctrl.delete_cache(cls)
+
+    @classmethod
+    def retry_on_conflict(cls, doc_type, uid, change, retries=3):
+        """Apply a change to a controller and save it, reloading and
+        retrying on version conflicts.
+
+        Each attempt costs one read (only after a conflict) and one
+        compare-and-set write; no lock is held between them.
+
+        :param doc_type: type -- The `DataModelController` class.
+        :param uid: str -- The controller's unique ID.
+        :param change: callable -- Called with the controller; must be safe
+            to call again on a freshly loaded controller.
+        :param retries: int -- Reloads before giving up.
+        :return: The value returned by the last `change` call.
+        :raise: VersionConflictError if still conflicting after `retries`
+            reloads.
+        """
+        attempt = 0
+        while True:
+            ctrl = cls.get_controller(doc_type, uid)
+            result = change(ctrl)
+            try:
+                cls.save(doc_type, ctrl.model)
+                return result
+            except VersionConflictError as e:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                cls._db.doc_cache.invalidate(e.collection, e.uid)
+                cls.reload(doc_type, uid)
 
     @classmethod
     def store_model(cls, doc_type, model):
@@ -159,7 +598,135 @@ class DataStore(object):
     @classmethod
     def update_model(cls, doc_type, model):
         doc_type = cls._key(doc_type)
-        cls._db.update_model(doc_type, model)
+        cls._db.update_model(doc_type, model, cls._fence(doc_type, model.uid),
+                             cls._nested_writer())
+
+    @classmethod
+    def update_model_fields(cls, doc_type, model, fields=None):
+        """Save only some fields of a model.
+
+        :param fields: list | None -- Fields to save; defaults to the fields
+            a partial model was loaded with.
+        """
+        doc_type = cls._key(doc_type)
+        cls._db.update_model_fields(doc_type, model, fields,
+                                    cls._fence(doc_type, model.uid),
+                                    cls._nested_writer())
+
+    @classmethod
+    def increment_model_fields(cls, doc_type, model, inc, fields=None):
+        """Atomically add to counters of a stored model in one update.
+
+        The model is saved whole instead if it was never stored. If the
+        stored model has moved on since `model` was loaded, the increments
+        alone are applied over it; with `fields`, nothing is applied and the
+        conflict is raised, so the caller can reload and apply its change
+        again.
+
+        :param model: DataModel -- The model, with `inc` already applied.
+        :param inc: dict -- Field name to the amount added.
+        :param fields: list | None -- Other fields to save along with it.
+        :raise: VersionConflictError if `fields` are given and the stored
+            model has moved on.
+        """
+        doc_type = cls._key(doc_type)
+        if not cls._db.increment_model_fields(doc_type, model, inc, fields):
+            cls._db.upsert_model(doc_type, model)
+
+    @classmethod
+    def merge_model(cls, doc_type, model):
+        """Merge a partial model into its full stored model.
+
+        :return: DataModel -- The full model with the partial model's fields
+            applied, which may be saved normally.
+        """
+        doc_type = cls._key(doc_type)
+        return cls._db.merge_model(doc_type, model)
+
+    @classmethod
+    def insert_record(cls, collection, document):
+        """Insert a plain (non-model) document, e.g. an append-only log."""
+        cls._db.insert_record(collection, document)
+
+    @classmethod
+    def find_records(cls, collection, query=None, sort=None, limit=0):
+        """Find plain (non-model) documents.
+
+        :param sort: list | None -- Mongo sort spec, e.g. [('_id', -1)].
+        :return: list -- The raw documents.
+        """
+        return cls._db.find_records(collection, query, sort, limit)
+
+    @classmethod
+    def update_record(cls, collection, query, update, upsert=False):
+        """Update one plain (non-model) document.
+
+        :param update: dict | list -- Mongo update, or update pipeline.
+        :return: int -- The number of documents matched.
+        """
+        return cls._db.update_record(collection, query, update, upsert)
+
+    @classmethod
+    def update_records(cls, collection, query, update):
+        """Update all plain (non-model) documents matching a query.
+
+        :return: int -- The number of documents matched.
+        """
+        return cls._db.update_records(collection, query, update)
+
+    @classmethod
+    def bulk_update_records(cls, collection, updates, upsert=False):
+        """Update plain (non-model) documents in one unordered bulk write.
+
+        With `upsert`, an update whose filter misses an existing document
+        is skipped rather than failing on the duplicate ID.
+
+        :param updates: list -- (query, update) pairs.
+        """
+        cls._db.bulk_update_records(collection, updates, upsert)
+
+    @classmethod
+    def create_record_index(cls, collection, keys, **options):
+        """Create an index on a plain (non-model) collection.
+
+        :param keys: list -- Mongo index spec, e.g. [('rating', -1)].
+        """
+        cls._db.create_record_index(collection, keys, **options)
+
+    @classmethod
+    def iter_records(cls, collection, query=None, sort=None, fields=None,
+                     batch_size=1000):
+        """Iterate plain (non-model) documents without loading them all.
+
+        :param fields: list | None -- Keys to read; defaults to all.
+        :return: iterator -- The raw documents.
+        """
+        return cls._db.iter_records(collection, query, sort, fields,
+                                    batch_size)
+
+    @classmethod
+    def bulk_update_fields(cls, doc_type, updates, batch_size=1000):
+        """Set fields of many stored models in batched bulk writes.
+
+        Cached controllers are updated to match, so they do not write the
+        old values back, and their models' versions are bumped along with
+        the stored ones.
+
+        :param updates: dict -- Model ID to a dict of field values.
+        :param batch_size: int -- Updates sent per bulk write.
+        """
+        key = cls._key(doc_type)
+        with cls._LOCK:
+            cached = cls._CACHE.get(key)
+            ctrls = [(cached.get(uid), values)
+                     for uid, values in updates.iteritems()
+                     if cached and uid in cached]
+        for ctrl, values in ctrls:
+            for f, v in values.iteritems():
+                setattr(ctrl, f, v)
+        cls._db.bulk_update_fields(key, updates, batch_size)
+        for ctrl, _ in ctrls:
+            cls._db.bump_version(ctrl.model)
 
     @classmethod
     def delete_model(cls, doc_type, uid):
@@ -167,9 +734,107 @@ class DataStore(object):
         cls._db.remove_model(doc_type, uid)
 
     @classmethod
-    def get_strict_model(cls, doc_type, uid):
+    def iter_models(cls, doc_type, batch_size=100, fields=None, resolve=False,
+                    **kwargs):
+        """Stream stored models matching a filter.
+
+        Documents are pulled from the database `batch_size` at a time and
+        parsed one by one, so memory use does not grow with the collection.
+
+        :param doc_type: type | str -- The doc type.
+        :param batch_size: int -- Documents fetched per round trip.
+        :param fields: list | None -- Model fields to load; all if None.
+        :param resolve: bool -- Whether to load sub-documents; otherwise
+            they are left as `SubDocumentRef`s (see `LazyController`).
+        :param kwargs: The query filter.
+        :return: generator -- Yields `DataModel`s.
+        """
         doc_type = cls._key(doc_type)
-        return cls._db.get_model(doc_type, uid)
+        return cls._db.iter_models(doc_type, batch_size, fields, resolve,
+                                   **kwargs)
+
+    @classmethod
+    def prefetch_documents(cls, doc_type, uids):
+        """Read stored models and all their sub-documents into the document
+        cache, so restoring them reads nothing more from the database.
+
+        Costs one query per collection per level of nesting, however many
+        models are prefetched.
+
+        :param doc_type: type | str -- The doc type.
+        :param uids: list -- The model IDs.
+        :return: int -- The number of documents read.
+        """
+        key = cls._key(doc_type)
+        return cls._db.prefetch_documents([(key, uid) for uid in uids])
+
+    @classmethod
+    def get_models_by_ids(cls, doc_type, uids, resolve=True):
+        doc_type = cls._key(doc_type)
+        return cls._db.get_models_by_ids(doc_type, uids, resolve)
+
+    @classmethod
+    def find_ids(cls, doc_type, query=None, limit=0):
+        doc_type = cls._key(doc_type)
+        return cls._db.find_ids(doc_type, query, limit)
+
+    @classmethod
+    def get_strict_model(cls, doc_type, uid, resolve=True):
+        doc_type = cls._key(doc_type)
+        return cls._db.get_model(doc_type, uid, resolve)
+
+
+def _cache_members(ctrl):
+    """Controllers cached as part of `ctrl`'s eviction unit, recursively.
+
+    Unrestored `LazyController` members are skipped, as they hold nothing
+    in the cache.
+    """
+    for m in getattr(ctrl, 'cache_members', lambda: [])():
+        if isinstance(m, LazyController):
+            if not m.resolved:
+                continue
+            m = m.resolve()
+        yield m
+        for sub in _cache_members(m):
+            yield sub
+
+
+def _unit_keys(ctrl):
+    """Cache keys of `ctrl`'s eviction unit members, recursively.
+
+    Unrestored `LazyController` members are included, but not their own
+    members.
+    """
+    for m in getattr(ctrl, 'cache_members', lambda: [])():
+        if m is None:
+            continue
+        if isinstance(m, LazyController):
+            yield DataStore._key(m.doc_type), m.uid
+            if not m.resolved:
+                continue
+            m = m.resolve()
+        else:
+            yield DataStore._key(m.__class__), m.uid
+        for sub in _unit_keys(m):
+            yield sub
+
+
+def _approx_size(obj, root=True):
+    """Approximate memory footprint of a model, in bytes.
+
+    Nested models belong to other controllers and are not counted.
+    """
+    if isinstance(obj, DataModel) and not root:
+        return 0
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += sys.getsizeof(k) + _approx_size(v, False)
+    elif isinstance(obj, (list, tuple, set)):
+        for v in obj:
+            size += _approx_size(v, False)
+    return size
 
 
 # ----------------------------------------------------------------------------
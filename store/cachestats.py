@@ -0,0 +1,136 @@
+"""Controller cache analytics.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class CacheStats -- Cache counters with a ghost-cache size simulator.
+
+"""
+
+from collections import OrderedDict
+
+
+class CacheStats(object):
+    """Per-doc-type cache counters and ghost-cache sizing estimates.
+
+    The ghost cache remembers recently evicted keys together with how many
+    bytes had been evicted in total when each was dropped. When a miss hits
+    a ghost entry, the bytes evicted since then tell how much larger the
+    cache would have had to be to keep it, which gives an estimate of the
+    hit rate at a multiple of the current capacity.
+
+    Class Properties:
+        :type COUNTERS: tuple -- Names of the per-doc-type counters.
+        :type GHOST_FACTORS: tuple -- Capacity multiples that are simulated.
+
+    Public Methods:
+        hit -- Record a cache hit.
+        miss -- Record a cache miss.
+        evict -- Record an eviction.
+        write_back -- Record a write-back of an evicted model.
+        conflict -- Record a write-back dropped for a version conflict.
+        report -- Counters and hit rate estimates.
+        reset -- Clear all counters and the ghost cache.
+
+    """
+
+    COUNTERS = ('hits', 'misses', 'evictions', 'write_backs', 'conflicts')
+    GHOST_FACTORS = (2, 4)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear all counters and the ghost cache."""
+        self._counters = {}
+        self._ghost = OrderedDict()
+        self._evicted_bytes = 0
+        self._ghost_hits = dict((f, 0) for f in self.GHOST_FACTORS)
+
+    def hit(self, doc_type):
+        self._count(doc_type, 'hits')
+
+    def miss(self, doc_type, uid, capacity):
+        """Record a cache miss and check it against the ghost cache.
+
+        :param doc_type: str -- The doc type key.
+        :param uid: str -- The missed controller's unique ID.
+        :param capacity: int -- The current cache budget in bytes.
+        """
+        self._count(doc_type, 'misses')
+        evicted_at = self._ghost.pop((doc_type, uid), None)
+        if evicted_at is None:
+            return
+        distance = self._evicted_bytes - evicted_at
+        for factor in self.GHOST_FACTORS:
+            if distance < (factor - 1) * capacity:
+                self._ghost_hits[factor] += 1
+
+    def evict(self, doc_type, uid, size, capacity):
+        """Record an eviction and remember it in the ghost cache.
+
+        :param doc_type: str -- The doc type key.
+        :param uid: str -- The evicted controller's unique ID.
+        :param size: int -- Approximate size of the evicted model in bytes.
+        :param capacity: int -- The current cache budget in bytes.
+        """
+        self._count(doc_type, 'evictions')
+        self._evicted_bytes += size
+        key = (doc_type, uid)
+        self._ghost.pop(key, None)
+        self._ghost[key] = self._evicted_bytes
+        horizon = (max(self.GHOST_FACTORS) - 1) * capacity
+        while self._ghost:
+            oldest = next(self._ghost.itervalues())
+            if self._evicted_bytes - oldest <= horizon:
+                break
+            self._ghost.popitem(last=False)
+
+    def write_back(self, doc_type):
+        self._count(doc_type, 'write_backs')
+
+    def conflict(self, doc_type):
+        self._count(doc_type, 'conflicts')
+
+    def report(self):
+        """Counters and hit rate estimates.
+
+        :return: dict -- 'types' maps each doc type to its counters and hit
+            rate; 'total' holds the same over all types; 'estimated_hit_rate'
+            maps each simulated capacity multiple to its estimated hit rate.
+        """
+        types = {}
+        total = dict((c, 0) for c in self.COUNTERS)
+        for doc_type, counters in self._counters.iteritems():
+            types[doc_type] = dict(counters,
+                                   hit_rate=_rate(counters['hits'],
+                                                  counters['misses']))
+            for c in self.COUNTERS:
+                total[c] += counters[c]
+        total['hit_rate'] = _rate(total['hits'], total['misses'])
+        estimates = dict(
+            (factor, _rate(total['hits'] + self._ghost_hits[factor],
+                           total['misses'] - self._ghost_hits[factor]))
+            for factor in self.GHOST_FACTORS)
+        return {
+            'types': types,
+            'total': total,
+            'estimated_hit_rate': estimates,
+            'ghost_entries': len(self._ghost)
+        }
+
+    def _count(self, doc_type, counter):
+        if doc_type not in self._counters:
+            self._counters[doc_type] = dict((c, 0) for c in self.COUNTERS)
+        self._counters[doc_type][counter] += 1
+
+
+def _rate(hits, misses):
+    total = hits + misses
+    return float(hits) / total if total else 0.0
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
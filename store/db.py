@@ -2,46 +2,150 @@
 
 """
 
-from pymongo import MongoClient as DBClient
-from pymongo.errors import DuplicateKeyError, InvalidDocument
+from pymongo import MongoClient as DBClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, InvalidDocument, BulkWriteError
+from bson import BSON
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 import types
 import uuid
+import weakref
 from core.datamodel import DataModel
+from store.lazy import SubDocumentRef
+from store.doccache import DocumentCache
+from store.indexes import IndexManager
 
 
 class DBLookupError(ValueError):
     pass
 
 
+class PartialModelError(ValueError):
+    pass
+
+
+class VersionConflictError(ValueError):
+    """A model was saved over a newer stored version of it.
+
+    Attributes:
+        :type collection: str -- The model's collection.
+        :type uid: str -- The model's ID.
+        :type expected: int -- The version the model was loaded at.
+        :type actual: int -- The stored version.
+
+    """
+
+    def __init__(self, collection, uid, expected, actual):
+        super(VersionConflictError, self).__init__(
+            "Stale model: %s -- %s is at version %d, not %d." % (
+                collection, uid, actual, expected))
+        self.collection = collection
+        self.uid = uid
+        self.expected = expected
+        self.actual = actual
+
+
+class StaleOwnerError(ValueError):
+    """A model was saved without a current lease on it.
+
+    Attributes:
+        :type collection: str -- The model's collection.
+        :type uid: str -- The model's ID.
+        :type token: int | None -- The writer's fencing token, or None if it
+            holds no lease.
+        :type fence: int | None -- The highest token seen by the store.
+
+    """
+
+    def __init__(self, collection, uid, token, fence=None):
+        if token is None:
+            message = "No lease held on: %s -- %s." % (collection, uid)
+        else:
+            message = "Lease token %d of %s -- %s is fenced off by %d." % (
+                token, collection, uid, fence)
+        super(StaleOwnerError, self).__init__(message)
+        self.collection = collection
+        self.uid = uid
+        self.token = token
+        self.fence = fence
+
+
 def db(host='localhost', port=27017, database='zimmed_test'):
 
     if not hasattr(db, '_database'):
         db._database = DBClient(host, port)[database]
+        db.doc_cache = DocumentCache()
+        db._partial = weakref.WeakKeyDictionary()
+        db._versions = weakref.WeakKeyDictionary()
+        db.indexes = IndexManager(db)
         db.__call__ = lambda *args, **kwargs: db
 
+        def find_document(self, collection, uid):
+            cached, document = self.doc_cache.get(collection, uid)
+            if cached:
+                return document
+            document = self.col(collection).find_one({'_id': uid})
+            if document:
+                self.doc_cache.put(collection, uid, document)
+            else:
+                self.doc_cache.put_missing(collection, uid)
+            return document
+
+        def prefetch_documents(self, refs):
+            # One query per collection per level of nesting.
+            fetched = 0
+            refs = set(refs)
+            while refs:
+                wanted = {}
+                for collection, uid in refs:
+                    if not self.doc_cache.get(collection, uid)[0]:
+                        wanted.setdefault(collection, []).append(uid)
+                refs = set()
+                for collection, uids in wanted.iteritems():
+                    found = set()
+                    for document in self.col(collection).find(
+                            {'_id': {'$in': uids}}):
+                        self.doc_cache.put(collection, document['_id'],
+                                           document)
+                        found.add(document['_id'])
+                        refs.update(_sub_document_refs(document['__data__']))
+                    for uid in uids:
+                        if uid not in found:
+                            self.doc_cache.put_missing(collection, uid)
+                    fetched += len(found)
+            return fetched
+
         def generate_uid(self, collection):
             uid = uuid.uuid4().hex
-            while self.get_model(collection, uid):
+            while self.col(collection).find_one({'_id': uid}, {'_id': True}):
                 uid = uuid.uuid4().hex
             return uid
 
-        def unparse_model(self, item):
+        def unparse_model(self, item, nested=None):
+            # Nested models are written with `nested(collection, model)`,
+            # which defaults to an unfenced upsert.
             if isinstance(item, dict):
                 for k, v in item.iteritems():
                     if isinstance(v, (list, tuple, dict, DataModel)):
-                        item[k] = self.unparse_model(v)
+                        item[k] = self.unparse_model(v, nested)
             elif isinstance(item, (list, set, tuple)):
                 for v in item:
                     if isinstance(v, (list, tuple, dict, DataModel)):
                         i = item.index(v)
-                        item[i] = self.unparse_model(v)
+                        item[i] = self.unparse_model(v, nested)
+            elif isinstance(item, SubDocumentRef):
+                return {
+                    '__sub_document__': True,
+                    '__collection__': item.collection,
+                    '__uid__': item.uid
+                }
             elif isinstance(item, DataModel):
                 uid = None
                 collection = None
                 if item is not DataModel.Null:
                     uid = item.uid
                     collection = item['_collection']
-                    self.upsert_model(collection, item)
+                    (nested or self.upsert_model)(collection, item)
                 return {
                     '__sub_document__': True,
                     '__collection__': collection,
@@ -49,65 +153,285 @@ def db(host='localhost', port=27017, database='zimmed_test'):
                 }
             return item
 
-        def parse_model(self, doc):
+        def parse_model(self, doc, resolve=True):
             if isinstance(doc, dict):
                 doc = dict(((str(k), v) for k, v in doc.iteritems()))
                 if '__sub_document__' in doc:
                     if not doc['__uid__']:
                         doc = DataModel.Null
+                    elif not resolve:
+                        doc = SubDocumentRef(str(doc['__collection__']),
+                                             str(doc['__uid__']))
                     else:
                         doc = self.get_model(doc['__collection__'],
                                              doc['__uid__'])
                 else:
                     for k, v in doc.iteritems():
                         if isinstance(v, (unicode, tuple, list, dict)):
-                            doc[k] = self.parse_model(v)
+                            doc[k] = self.parse_model(v, resolve)
             elif isinstance(doc, (tuple, list)):
                 for v in doc:
                     if isinstance(v, (unicode, tuple, list, dict)):
                         i = doc.index(v)
-                        doc[i] = self.parse_model(v)
+                        doc[i] = self.parse_model(v, resolve)
             elif isinstance(doc, unicode):
                 doc = str(doc)
             return doc
 
-        def model_to_document(self, model):
-            doc = self.unparse_model(dict(model))
+        def model_to_document(self, model, nested=None):
+            doc = self.unparse_model(dict(model), nested)
             return {
                 '_id': model.uid,
                 '__rules__': model.bson_rules,
                 '__data__': doc
             }
 
-        def document_to_model(self, document):
-            data = self.parse_model(document['__data__'])
+        def document_to_model(self, document, resolve=True, fields=None):
+            data = self.parse_model(document['__data__'], resolve)
             rules = document['__rules__']
-            return DataModel.load(rules, data)
+            model = DataModel.load(rules, data)
+            if fields:
+                self._partial[model] = tuple(fields)
+            self._versions[model] = document.get('__version__') or 0
+            return model
+
+        def version(self, model):
+            return self._versions.get(model)
+
+        def version_query(self, uid, version, fence=None):
+            query = {'_id': uid}
+            if fence is not None:
+                query['__fence__'] = {'$not': {'$gt': fence}}
+            if version is None:
+                return query
+            if not version:
+                # Documents stored before versioning have no version field.
+                query['__version__'] = {'$in': [None, 0]}
+            else:
+                query['__version__'] = version
+            return query
+
+        def version_update(self, update, fence=None):
+            update['$inc'] = dict(update.get('$inc') or {}, __version__=1)
+            if fence is not None:
+                update['$max'] = {'__fence__': fence}
+            return update
+
+        def check_version(self, collection, uid, version, fence=None):
+            document = self.col(collection).find_one(
+                {'_id': uid}, {'__version__': True, '__fence__': True})
+            if not document:
+                return
+            if fence is not None and document.get('__fence__') > fence:
+                raise StaleOwnerError(collection, uid, fence,
+                                      document['__fence__'])
+            if version is not None:
+                raise VersionConflictError(collection, uid, version,
+                                           document.get('__version__') or 0)
+
+        def check_complete(self, model):
+            if model in self._partial:
+                raise PartialModelError(
+                    "Model was loaded with fields " +
+                    repr(self._partial[model]) + " only; use "
+                    "`update_model_fields` or `merge_model` to save it.")
 
         def col(self, collection):
             # if collection not in self._database.collection_names():
             #     self._database[collection].create_index('uid')
             return self._database[collection]
 
-        def insert_model(self, collection, model):
-            document = self.model_to_document(model)
-            collection = self.col(collection)
-            collection.insert_one(document)
+        def raw_col(self, collection):
+            return self.col(collection).with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument))
+
+        def get_raw_model_data(self, collection, uid):
+            document = self.raw_col(collection).find_one(
+                {'_id': uid}, {'__data__': True})
+            if not document:
+                raise DBLookupError("Object does not exist: " + collection +
+                                    ' -- ' + uid)
+            return document['__data__']
+
+        def iter_raw_model_data(self, collection, batch_size=100, **kwargs):
+            query = self.data_query(collection, kwargs)
+            cursor = self.raw_col(collection).find(
+                query, {'__data__': True}, batch_size=batch_size)
+            try:
+                for d in cursor:
+                    yield d['__data__']
+            finally:
+                cursor.close()
 
-        def update_model(self, collection, model):
-            document = self.model_to_document(model)['__data__']
+        def encode_raw(self, model):
+            # Unlike `model_to_document`, this neither mutates the model nor
+            # saves its sub-documents.
+            data = dict((k, _stored_data(v))
+                        for k, v in dict(model).iteritems())
+            return RawBSONDocument(BSON.encode(data))
+
+        def insert_model(self, collection, model, fence=None, nested=None):
+            self.check_complete(model)
+            document = self.model_to_document(model, nested)
+            document['__version__'] = 1
+            if fence is not None:
+                document['__fence__'] = fence
+            self.doc_cache.invalidate(collection, document['_id'])
+            self.col(collection).insert_one(document)
+            self._versions[model] = 1
+
+        def update_model(self, collection, model, fence=None, nested=None):
+            self.check_complete(model)
+            document = self.model_to_document(model, nested)['__data__']
             uid = document['uid']
             del document['uid']
-            collection = self.col(collection)
-            collection.update_one({'_id': uid}, {
-                '$set': {'__data__': document}
-            })
+            version = self._versions.get(model)
+            self.doc_cache.invalidate(collection, uid)
+            result = self.col(collection).update_one(
+                self.version_query(uid, version, fence), self.version_update({
+                    '$set': {'__data__': document}
+                }, fence))
+            if result.matched_count and version is not None:
+                self._versions[model] = version + 1
+            elif not result.matched_count:
+                self.check_version(collection, uid, version, fence)
+            return result.matched_count
 
-        def upsert_model(self, collection, model):
+        def update_model_fields(self, collection, model, fields=None,
+                                fence=None, nested=None):
+            if fields is None:
+                fields = self._partial.get(model)
+            if not fields:
+                return self.update_model(collection, model, fence, nested)
+            document = self.unparse_model(dict((f, model[f]) for f in fields),
+                                          nested)
+            version = self._versions.get(model)
+            self.doc_cache.invalidate(collection, model.uid)
+            result = self.col(collection).update_one(
+                self.version_query(model.uid, version, fence),
+                self.version_update({
+                    '$set': dict(('__data__.' + f, v)
+                                 for f, v in document.iteritems())
+                }, fence))
+            if result.matched_count and version is not None:
+                self._versions[model] = version + 1
+            elif not result.matched_count:
+                self.check_version(collection, model.uid, version, fence)
+
+        def increment_model_fields(self, collection, model, inc, fields=None):
+            update = {'$inc': dict(('__data__.' + f, n)
+                                   for f, n in inc.iteritems())}
+            update['$inc']['__version__'] = 1
+            if fields:
+                document = self.unparse_model(
+                    dict((f, model[f]) for f in fields))
+                update['$set'] = dict(('__data__.' + f, v)
+                                      for f, v in document.iteritems())
+            version = self._versions.get(model)
+            self.doc_cache.invalidate(collection, model.uid)
+            col = self.col(collection)
+            result = col.update_one(
+                self.version_query(model.uid, version), update)
+            if result.matched_count and version is not None:
+                self._versions[model] = version + 1
+            elif version is not None and fields:
+                # The set fields were derived from the stale model and
+                # would overwrite the newer values.
+                self.check_version(collection, model.uid, version)
+            elif version is not None:
+                # Increments commute, so they are applied over a newer
+                # version too; the model stays stale for full saves.
+                result = col.update_one({'_id': model.uid},
+                                        {'$inc': update['$inc']})
+            return result.matched_count
+
+        def bump_version(self, model):
+            version = self._versions.get(model)
+            if version is not None:
+                self._versions[model] = version + 1
+
+        def merge_model(self, collection, model):
+            fields = self._partial.get(model)
+            if not fields:
+                return model
+            full = self.get_model(collection, model.uid)
+            if not full:
+                raise DBLookupError("Object does not exist: " + collection +
+                                    ' -- ' + model.uid)
+            for f in fields:
+                full[f] = model[f]
+            return full
+
+        def upsert_model(self, collection, model, fence=None, nested=None):
+            if self._versions.get(model) and self.update_model(
+                    collection, model, fence, nested):
+                return
             try:
-                self.insert_model(collection, model)
+                self.insert_model(collection, model, fence, nested)
             except DuplicateKeyError:
-                self.update_model(collection, model)
+                # Duplicates on a unique secondary index must not be
+                # mistaken for an existing `_id`.
+                if not self.update_model(collection, model, fence, nested):
+                    raise
+
+        def fence_models(self, collection, tokens):
+            requests = [UpdateOne({'_id': uid}, {'$max': {'__fence__': token}})
+                        for uid, token in tokens.iteritems()]
+            if requests:
+                self.col(collection).bulk_write(requests, ordered=False)
+
+        def insert_record(self, collection, document):
+            self.col(collection).insert_one(document)
+
+        def find_records(self, collection, query=None, sort=None, limit=0):
+            cursor = self.col(collection).find(query or {}, sort=sort,
+                                               limit=limit)
+            return list(cursor)
+
+        def update_record(self, collection, query, update, upsert=False):
+            result = self.col(collection).update_one(query, update,
+                                                     upsert=upsert)
+            return result.matched_count
+
+        def update_records(self, collection, query, update):
+            result = self.col(collection).update_many(query, update)
+            return result.matched_count
+
+        def bulk_update_records(self, collection, updates, upsert=False):
+            requests = [UpdateOne(query, update, upsert=upsert)
+                        for query, update in updates]
+            if not requests:
+                return
+            try:
+                self.col(collection).bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                # An upsert whose filter missed an existing `_id` is a
+                # skipped update, not a failure.
+                if any(err.get('code') != 11000
+                       for err in e.details.get('writeErrors', [])):
+                    raise
+
+        def create_record_index(self, collection, keys, **options):
+            self.col(collection).create_index(keys, **options)
+
+        def iter_records(self, collection, query=None, sort=None, fields=None,
+                         batch_size=1000):
+            return self.col(collection).find(query or {}, fields, sort=sort,
+                                             batch_size=batch_size)
+
+        def bulk_update_fields(self, collection, updates, batch_size=1000):
+            requests = []
+            for uid, values in updates.iteritems():
+                self.doc_cache.invalidate(collection, uid)
+                requests.append(UpdateOne({'_id': uid}, {
+                    '$set': dict(('__data__.' + f, v)
+                                 for f, v in values.iteritems()),
+                    '$inc': {'__version__': 1}
+                }))
+            collection = self.col(collection)
+            for i in xrange(0, len(requests), batch_size):
+                collection.bulk_write(requests[i:i + batch_size],
+                                      ordered=False)
 
         def insert_models(self, collection, models):
             for m in models:
@@ -121,48 +445,167 @@ def db(host='localhost', port=27017, database='zimmed_test'):
             for m in models:
                 self.upsert_model(collection, m)
 
-        def get_model_data(self, collection, uid):
-            collection = self.col(collection)
-            return collection.find_one({'_id': uid})['__data__']
+        def get_model_data(self, collection, uid, fields=None):
+            cached, document = self.doc_cache.get(collection, uid)
+            if not cached and fields:
+                document = self.col(collection).find_one(
+                    {'_id': uid}, self.projection(fields))
+            elif not cached:
+                document = self.find_document(collection, uid)
+            if not document:
+                raise DBLookupError("Object does not exist: " + collection +
+                                    ' -- ' + uid)
+            data = document['__data__']
+            if fields:
+                data = dict((k, data[k]) for k in ('uid',) + tuple(fields)
+                            if k in data)
+            return data
 
-        def get_model(self, collection, uid):
-            collection = self.col(collection)
-            document = collection.find_one({'_id': uid})
+        def get_model(self, collection, uid, resolve=True):
+            document = self.find_document(collection, uid)
             if document:
-                return self.document_to_model(document)
+                return self.document_to_model(document, resolve)
             return None
 
-        def get_models(self, collection, **kwargs):
+        def get_models_by_ids(self, collection, uids, resolve=True):
+            collection = self.col(collection)
+            documents = collection.find({'_id': {'$in': list(uids)}})
+            return [self.document_to_model(d, resolve) for d in documents]
+
+        def data_query(self, collection, query):
+            query = dict((k if k.startswith(('_', '$')) else '__data__.' + k,
+                          v) for k, v in (query or {}).iteritems())
+            self.indexes.record_query(collection, query)
+            return query
+
+        def find_ids(self, collection, query=None, limit=0):
+            query = self.data_query(collection, query)
+            collection = self.col(collection)
+            documents = collection.find(query or {}, {'_id': True},
+                                        limit=limit)
+            return [str(d['_id']) for d in documents]
+
+        def projection(self, fields):
+            if not fields:
+                return None
+            spec = {'__rules__': True, '__version__': True,
+                    '__data__.uid': True}
+            for f in fields:
+                spec['__data__.' + f] = True
+            return spec
+
+        def iter_models(self, collection, batch_size=100, fields=None,
+                        resolve=False, **kwargs):
+            query = self.data_query(collection, kwargs)
             collection = self.col(collection)
-            documents = collection.find(kwargs)
+            cursor = collection.find(query, self.projection(fields),
+                                     batch_size=batch_size)
+            try:
+                for d in cursor:
+                    yield self.document_to_model(d, resolve, fields)
+            finally:
+                cursor.close()
+
+        def get_models(self, collection, fields=None, **kwargs):
+            query = self.data_query(collection, kwargs)
+            collection = self.col(collection)
+            documents = collection.find(query, self.projection(fields))
             if documents:
-                return [self.document_to_model(d) for d in documents]
+                return [self.document_to_model(d, fields=fields)
+                        for d in documents]
             return []
 
         def remove_model(self, collection, uid):
+            self.doc_cache.invalidate(collection, uid)
             collection = self.col(collection)
             collection.delete_one({'_id': uid})
 
         def remove_models(self, collection, **kwargs):
+            self.doc_cache.invalidate_collection(collection)
+            query = self.data_query(collection, kwargs)
             collection = self.col(collection)
-            collection.delete_many(kwargs)
+            collection.delete_many(query)
 
         db.generate_uid = types.MethodType(generate_uid, db)
+        db.prefetch_documents = types.MethodType(prefetch_documents, db)
+        db.find_document = types.MethodType(find_document, db)
         db.document_to_model = types.MethodType(document_to_model, db)
+        db.check_complete = types.MethodType(check_complete, db)
+        db.version = types.MethodType(version, db)
+        db.bump_version = types.MethodType(bump_version, db)
+        db.version_query = types.MethodType(version_query, db)
+        db.check_version = types.MethodType(check_version, db)
+        db.version_update = types.MethodType(version_update, db)
+        db.fence_models = types.MethodType(fence_models, db)
+        db.update_records = types.MethodType(update_records, db)
+        db.bulk_update_records = types.MethodType(bulk_update_records, db)
+        db.update_model_fields = types.MethodType(update_model_fields, db)
+        db.merge_model = types.MethodType(merge_model, db)
         db.model_to_document = types.MethodType(model_to_document, db)
         db.col = types.MethodType(col, db)
+        db.raw_col = types.MethodType(raw_col, db)
+        db.get_raw_model_data = types.MethodType(get_raw_model_data, db)
+        db.iter_raw_model_data = types.MethodType(iter_raw_model_data, db)
+        db.encode_raw = types.MethodType(encode_raw, db)
         db.insert_model = types.MethodType(insert_model, db)
         db.upsert_model = types.MethodType(upsert_model, db)
         db.update_model = types.MethodType(update_model, db)
         db.insert_models = types.MethodType(insert_models, db)
+        db.insert_record = types.MethodType(insert_record, db)
+        db.find_records = types.MethodType(find_records, db)
         db.upsert_models = types.MethodType(upsert_models, db)
         db.update_models = types.MethodType(update_models, db)
         db.get_model_data = types.MethodType(get_model_data, db)
         db.get_model = types.MethodType(get_model, db)
         db.get_models = types.MethodType(get_models, db)
+        db.projection = types.MethodType(projection, db)
+        db.data_query = types.MethodType(data_query, db)
+        db.iter_models = types.MethodType(iter_models, db)
+        db.get_models_by_ids = types.MethodType(get_models_by_ids, db)
+        db.find_ids = types.MethodType(find_ids, db)
         db.remove_model = types.MethodType(remove_model, db)
         db.remove_models = types.MethodType(remove_models, db)
         db.parse_model = types.MethodType(parse_model, db)
         db.unparse_model = types.MethodType(unparse_model, db)
+        db.increment_model_fields = types.MethodType(increment_model_fields,
+                                                     db)
+        db.iter_records = types.MethodType(iter_records, db)
+        db.bulk_update_fields = types.MethodType(bulk_update_fields, db)
+        db.update_record = types.MethodType(update_record, db)
+        db.create_record_index = types.MethodType(create_record_index, db)
 
     return db
+
+
+def _stored_data(item):
+    """Copy of a model field in its stored form, sub-documents as
+    references."""
+    if item is DataModel.Null:
+        return {'__sub_document__': True, '__collection__': None,
+                '__uid__': None}
+    if isinstance(item, DataModel):
+        return {'__sub_document__': True,
+                '__collection__': item['_collection'], '__uid__': item.uid}
+    if isinstance(item, SubDocumentRef):
+        return {'__sub_document__': True, '__collection__': item.collection,
+                '__uid__': item.uid}
+    if isinstance(item, dict):
+        return dict((k, _stored_data(v)) for k, v in item.iteritems())
+    if isinstance(item, (list, tuple, set)):
+        return [_stored_data(v) for v in item]
+    return item
+
+
+def _sub_document_refs(item):
+    """(collection, uid) of the sub-documents referenced in stored data."""
+    if isinstance(item, dict):
+        if item.get('__sub_document__'):
+            if item.get('__uid__'):
+                yield str(item['__collection__']), str(item['__uid__'])
+            return
+        item = item.itervalues()
+    elif not isinstance(item, (list, tuple)):
+        return
+    for v in item:
+        for ref in _sub_document_refs(v):
+            yield ref
@@ -0,0 +1,129 @@
+"""Read-through stored document cache.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class DocumentCache -- Bounded LRU of stored documents with negative
+        entries.
+
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class DocumentCache(object):
+    """Bounded LRU cache of stored documents keyed by (collection, uid).
+
+    Lookups that found nothing are remembered for `negative_ttl` seconds,
+    so repeated reads of stale or deleted IDs do not reach the database.
+    Documents are copied on the way in and out, since parsing mutates them.
+
+    Class Properties:
+        :type MAX_ENTRIES: int -- Default entry limit.
+        :type NEGATIVE_TTL: float -- Default lifetime of negative entries.
+
+    Init Parameters:
+        max_entries -- Max number of cached entries (positive or negative).
+        negative_ttl -- Seconds a negative entry is trusted.
+
+    Public Methods:
+        get -- Look up a document.
+        put -- Cache a found document.
+        put_missing -- Cache a failed lookup.
+        invalidate -- Drop one entry.
+        invalidate_collection -- Drop all entries of a collection.
+        clear -- Drop all entries.
+        stats -- Hit/miss counters.
+
+    """
+
+    MAX_ENTRIES = 10000
+    NEGATIVE_TTL = 5.0
+
+    _MISSING = object()
+
+    def __init__(self, max_entries=None, negative_ttl=None):
+        self._max_entries = max_entries or self.MAX_ENTRIES
+        self._negative_ttl = (self.NEGATIVE_TTL if negative_ttl is None
+                              else negative_ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+
+    def get(self, collection, uid):
+        """Look up a document.
+
+        :param collection: str -- The collection name.
+        :param uid: str -- The document ID.
+        :return: tuple -- (cached, document); document is None for a cached
+            miss, and cached is False when the database must be asked.
+        """
+        key = (collection, uid)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return False, None
+            document, expires = entry
+            if document is self._MISSING:
+                if expires < time.time():
+                    self._misses += 1
+                    return False, None
+                self._negative_hits += 1
+                self._entries[key] = entry
+                return True, None
+            self._hits += 1
+            self._entries[key] = entry
+        return True, copy.deepcopy(document)
+
+    def put(self, collection, uid, document):
+        self._set((collection, uid), (copy.deepcopy(document), None))
+
+    def put_missing(self, collection, uid):
+        if self._negative_ttl > 0:
+            self._set((collection, uid),
+                      (self._MISSING, time.time() + self._negative_ttl))
+
+    def invalidate(self, collection, uid):
+        with self._lock:
+            self._entries.pop((collection, uid), None)
+
+    def invalidate_collection(self, collection):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters.
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses
+            }
+
+    def _set(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
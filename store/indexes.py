@@ -0,0 +1,147 @@
+"""Secondary indexes declared by controllers.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class IndexManager -- Creates declared indexes and flags unindexed
+        queries.
+
+"""
+
+import threading
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+_DUPLICATE_KEY = 11000
+
+
+class IndexManager(object):
+    """Creates indexes declared by controllers and flags unindexed queries.
+
+    Controllers declare indexed model fields next to their `MODEL_RULES`
+    as a `MODEL_INDEXES` dict of field name to index options, e.g.
+    `{'username': {'unique': True}}`. Each becomes an index on
+    `__data__.<field>` of the controller's collection.
+
+    Init Parameters:
+        database -- The `db` object.
+
+    Public Methods:
+        declare -- Register the indexes of a controller class.
+        ensure -- Create (or verify) all registered indexes.
+        record_query -- Note a query filter run against a collection.
+        slow_query_report -- Filter fields queried without an index.
+
+    """
+
+    def __init__(self, database):
+        self._db = database
+        self._declared = {}
+        self._unindexed = {}
+        self._lock = threading.Lock()
+
+    def declare(self, collection, indexes):
+        """Register indexed fields of a collection.
+
+        :param collection: str -- The collection (doc type key).
+        :param indexes: dict -- Field name to index options.
+        """
+        self._declared.setdefault(collection, {}).update(indexes)
+
+    def indexed_paths(self, collection):
+        """Document paths with a declared index, including `_id`."""
+        return set(['_id'] + ['__data__.' + f
+                              for f in self._declared.get(collection, {})])
+
+    def ensure(self, create=True):
+        """Create (or, with `create=False`, only check) declared indexes.
+
+        A declared field counts as indexed by an existing index on that
+        field alone, or by one that starts with it, as long as its options
+        match; a unique field needs a unique single-field index. A
+        single-field index with other options is reported as conflicting
+        and left alone, since Mongo refuses to create a second one. A unique
+        index that cannot be created because stored models already hold
+        duplicate values is reported as failed; the other indexes are still
+        created.
+
+        :param create: bool -- Whether to create missing indexes.
+        :return: dict -- Collection to {'existing': [...], 'conflicting':
+            [...], 'created' and 'failed', or 'missing': [...]} lists of
+            field names.
+        """
+        report = {}
+        for collection, indexes in self._declared.iteritems():
+            col = self._db.col(collection)
+            existing = col.index_information().values()
+            entry = report[collection] = {'existing': [], 'conflicting': []}
+            if create:
+                entry.update(created=[], failed=[])
+            else:
+                entry['missing'] = []
+            for field, options in sorted(indexes.iteritems()):
+                path = '__data__.' + field
+                if any(_serves(info, path, options) for info in existing):
+                    entry['existing'].append(field)
+                elif any(info['key'] == [(path, ASCENDING)]
+                         for info in existing):
+                    entry['conflicting'].append(field)
+                elif create:
+                    try:
+                        col.create_index([(path, ASCENDING)],
+                                         name='__data__.' + field, **options)
+                    except OperationFailure as e:
+                        if e.code != _DUPLICATE_KEY:
+                            raise
+                        entry['failed'].append(field)
+                    else:
+                        entry['created'].append(field)
+                else:
+                    entry['missing'].append(field)
+        return report
+
+    def record_query(self, collection, query):
+        """Note the filter fields of a query that have no declared index.
+
+        :param collection: str -- The collection queried.
+        :param query: dict -- The Mongo filter.
+        """
+        if not query:
+            return
+        indexed = self.indexed_paths(collection)
+        missing = [k for k in query if not k.startswith('$') and
+                   k not in indexed]
+        if not missing:
+            return
+        with self._lock:
+            for path in missing:
+                key = (collection, path)
+                self._unindexed[key] = self._unindexed.get(key, 0) + 1
+
+    def slow_query_report(self):
+        """Filter fields queried without an index, most frequent first.
+
+        :return: list -- Dicts of 'collection', 'field' and 'count'.
+        """
+        with self._lock:
+            items = self._unindexed.items()
+        return [{'collection': c, 'field': f, 'count': n}
+                for (c, f), n in sorted(items, key=lambda i: -i[1])]
+
+
+def _serves(info, path, options):
+    """Whether an existing index (`index_information` entry) indexes `path`
+    with the declared options."""
+    key = info['key']
+    if not key or key[0][0] != path:
+        return False
+    if options.get('unique') and len(key) > 1:
+        return False
+    return all(info.get(k, False) == v for k, v in options.iteritems()
+               if k != 'name')
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -0,0 +1,172 @@
+"""Lazy controller restoration.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class SubDocumentRef -- Unresolved reference to a stored sub-document.
+    :class LazyController -- Proxy that restores a controller on first use.
+
+"""
+
+
+class SubDocumentRef(object):
+    """Unresolved reference to a stored sub-document.
+
+    Produced in place of a nested `DataModel` when a document is read with
+    `resolve=False`, so that reading a parent touches a single document.
+
+    Init Parameters:
+        collection -- The collection (doc_type key) of the sub-document.
+        uid -- The unique ID of the sub-document.
+
+    """
+
+    __slots__ = ('collection', 'uid')
+
+    def __init__(self, collection, uid):
+        self.collection = collection
+        self.uid = uid
+
+    def __eq__(self, other):
+        return (isinstance(other, SubDocumentRef) and
+                other.collection == self.collection and other.uid == self.uid)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.collection, self.uid))
+
+    def __repr__(self):
+        return 'SubDocumentRef(%r, %r)' % (self.collection, self.uid)
+
+
+class LazyController(object):
+    """Proxy that restores a sub-controller on first attribute access.
+
+    The `uid` and `model` of the proxied controller are available without
+    restoring it (`model` is read from the `DataStore` when only a
+    reference is held); any other attribute access restores the controller
+    and is forwarded to it.
+
+    Init Parameters:
+        doc_type -- The `DataModelController` class to restore.
+        data_store -- The DataStore controller.
+        source -- The `DataModel` or `SubDocumentRef` to restore from.
+
+    Properties:
+        :type doc_type: type -- The class of the proxied controller.
+        :type uid: str -- The unique ID of the proxied controller.
+        :type model: DataModel -- The proxied controller's model.
+        :type resolved: bool -- Whether the controller has been restored.
+
+    Public Methods:
+        resolve -- Restore (once) and return the proxied controller.
+        on_resolve -- Call back once the controller is restored.
+        delete_cache -- Delete the proxied controller from cache, if cached.
+
+    """
+
+    __slots__ = ('_doc_type', '_data_store', '_source', '_ctrl',
+                 '_callbacks')
+
+    def __init__(self, doc_type, data_store, source):
+        object.__setattr__(self, '_doc_type', doc_type)
+        object.__setattr__(self, '_data_store', data_store)
+        object.__setattr__(self, '_source', source)
+        object.__setattr__(self, '_ctrl', None)
+        object.__setattr__(self, '_callbacks', [])
+
+    @property
+    def doc_type(self):
+        return self._doc_type
+
+    @property
+    def uid(self):
+        return self._source.uid
+
+    @property
+    def model(self):
+        if self._ctrl is not None:
+            return self._ctrl.model
+        if isinstance(self._source, SubDocumentRef):
+            return self._data_store.get_model(self._doc_type, self.uid)
+        return self._source
+
+    @property
+    def resolved(self):
+        return self._ctrl is not None
+
+    def resolve(self):
+        """Restore the proxied controller if needed.
+
+        Controllers already in the `DataStore` cache are reused rather than
+        restored again.
+
+        :return: DataModelController -- The proxied controller.
+        """
+        if self._ctrl is None:
+            ctrl = self._data_store.get_strict_controller(self._doc_type,
+                                                          self.uid)
+            if not ctrl and isinstance(self._source, SubDocumentRef):
+                ctrl = self._data_store.get_controller(self._doc_type,
+                                                       self.uid)
+            elif not ctrl:
+                ctrl = self._doc_type.restore(self._data_store, self._source)
+            object.__setattr__(self, '_ctrl', ctrl)
+            callbacks = list(self._callbacks)
+            del self._callbacks[:]
+            for callback in callbacks:
+                callback(ctrl)
+        return self._ctrl
+
+    def on_resolve(self, callback):
+        """Call back with the controller once it is restored, e.g. to
+        attach listeners without restoring it early.
+
+        :param callback: callable -- Called with the restored controller;
+            at once if it already is.
+        """
+        if self._ctrl is None:
+            self._callbacks.append(callback)
+        else:
+            callback(self._ctrl)
+
+    def delete_cache(self, data_store, uid=None):
+        """Delete the proxied controller from cache without restoring it.
+
+        :param data_store: The DataStore controller.
+        """
+        ctrl = self._ctrl or data_store.get_strict_controller(self._doc_type,
+                                                              self.uid)
+        if ctrl:
+            ctrl.delete_cache(data_store)
+
+    def __getattr__(self, key):
+        return getattr(self.resolve(), key)
+
+    def __setattr__(self, key, value):
+        setattr(self.resolve(), key, value)
+
+    def __eq__(self, other):
+        return other is self or getattr(other, 'uid', None) == self.uid
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.uid)
+
+    def __nonzero__(self):
+        return True
+
+    def __repr__(self):
+        return '<LazyController %s %s%s>' % (
+            self._doc_type.__name__, self.uid,
+            '' if self._ctrl is None else ' (resolved)')
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
@@ -0,0 +1,401 @@
+"""Lease ownership of models across nodes.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class LeaseManager -- Holds and renews one node's leases.
+    :class MongoLeaseBackend -- Lease records in the backing store.
+    :class MemoryLeaseBackend -- In-process lease records, for tests.
+
+"""
+
+import threading
+import time
+import uuid
+
+from store.lazy import LazyController
+
+
+class MongoLeaseBackend(object):
+    """Lease records in the backing store.
+
+    One record per leased key holds the owner, the expiry time and the
+    fencing token, which goes up by one whenever the lease changes owner.
+    Every call covers any number of keys in at most two round trips.
+
+    Class Properties:
+        :type COLLECTION: str -- The backing collection name.
+
+    Init Parameters:
+        data_store -- The DataStore controller.
+
+    Public Methods:
+        acquire -- Take free or expired leases.
+        renew -- Extend leases still held.
+        release -- Give up leases.
+
+    """
+
+    COLLECTION = 'Lease'
+
+    def __init__(self, data_store):
+        self._data_store = data_store
+
+    def acquire(self, keys, owner, now, ttl):
+        """Take the leases that are free, expired or already held.
+
+        :param keys: list -- Lease keys.
+        :param owner: str -- The node ID.
+        :param now: float -- Current time, in seconds.
+        :param ttl: float -- Lease duration, in seconds.
+        :return: dict -- Key to fencing token of the leases now held.
+        """
+        self._data_store.bulk_update_records(self.COLLECTION, [(
+            {'_id': key, '$or': [{'owner': owner},
+                                 {'expires': {'$lt': now}}]},
+            [{'$set': {
+                'token': {'$cond': [
+                    {'$eq': ['$owner', owner]}, '$token',
+                    {'$add': [{'$ifNull': ['$token', 0]}, 1]}]},
+                'owner': owner,
+                'expires': now + ttl
+            }}]) for key in keys], upsert=True)
+        return self._held(keys, owner)
+
+    def renew(self, keys, owner, now, ttl):
+        """Extend the leases still held.
+
+        :return: dict -- Key to fencing token of the leases still held.
+        """
+        self._data_store.update_records(
+            self.COLLECTION, {'_id': {'$in': list(keys)}, 'owner': owner},
+            {'$set': {'expires': now + ttl}})
+        return self._held(keys, owner)
+
+    def release(self, keys, owner):
+        self._data_store.update_records(
+            self.COLLECTION, {'_id': {'$in': list(keys)}, 'owner': owner},
+            {'$set': {'expires': 0}})
+
+    def _held(self, keys, owner):
+        records = self._data_store.find_records(
+            self.COLLECTION, {'_id': {'$in': list(keys)}, 'owner': owner})
+        return dict((str(r['_id']), r['token']) for r in records)
+
+
+class MemoryLeaseBackend(object):
+    """In-process lease records with the semantics of `MongoLeaseBackend`.
+
+    Public Methods:
+        acquire -- Take free or expired leases.
+        renew -- Extend leases still held.
+        release -- Give up leases.
+
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, keys, owner, now, ttl):
+        held = {}
+        with self._lock:
+            for key in keys:
+                record = self._records.get(key)
+                if record and record[0] != owner and record[1] >= now:
+                    continue
+                token = record[2] if record else 0
+                if not record or record[0] != owner:
+                    token += 1
+                self._records[key] = (owner, now + ttl, token)
+                held[key] = token
+        return held
+
+    def renew(self, keys, owner, now, ttl):
+        held = {}
+        with self._lock:
+            for key in keys:
+                record = self._records.get(key)
+                if record and record[0] == owner:
+                    self._records[key] = (owner, now + ttl, record[2])
+                    held[key] = record[2]
+        return held
+
+    def release(self, keys, owner):
+        with self._lock:
+            for key in keys:
+                record = self._records.get(key)
+                if record and record[0] == owner:
+                    self._records[key] = (owner, 0, record[2])
+
+
+class LeaseManager(object):
+    """Holds and renews one node's leases on models.
+
+    A lease gives its owner the sole right to change a model for `ttl`
+    seconds. The leases of all the models a node owns are renewed together
+    in one backend call every `renew_interval` seconds, by a background
+    thread, so the overhead is per node rather than per model. A lease is
+    treated as lost locally `margin` seconds before its expiry, measured
+    from when the renewal was sent.
+
+    Each acquisition comes with a fencing token that only ever goes up.
+    Once `install`ed, the `DataStore` refuses to save a model of the doc
+    type without a current lease, and refuses saves carrying a lower token
+    than one it has already seen, so a node that stalled past its lease
+    cannot overwrite the new owner's writes. The members of a leased
+    model's cache unit (e.g. a game's table, players, hands, deck and
+    discards) are fenced with the token of the leased model; units are
+    mapped to their model with `register` as they are restored or created.
+
+    Class Properties:
+        :type TTL: float -- Default lease duration, in seconds.
+
+    Init Parameters:
+        backend -- `MongoLeaseBackend` or `MemoryLeaseBackend`.
+        node_id -- This node's ID; defaults to a random one.
+        ttl -- Lease duration, in seconds.
+        renew_interval -- Seconds between renewals; defaults to a third of
+            `ttl`.
+        margin -- Seconds before expiry at which a lease counts as lost;
+            defaults to a tenth of `ttl`.
+        on_lost -- Called with the list of keys whose leases were lost.
+        clock -- Time source, in seconds.
+
+    Properties:
+        :type node_id: str -- This node's ID.
+        :type held: list -- Keys of the leases currently held.
+
+    Public Methods:
+        install -- Fence a doc type in the `DataStore` with these leases.
+        acquire -- Take leases.
+        release -- Give up leases.
+        register -- Map the members of a leased model's cache unit to it.
+        token -- Fencing token of a held lease.
+        owns -- Whether a lease is held.
+        member_token -- Fencing token covering a cache unit member.
+        renew -- Renew all held leases now.
+        start -- Start background renewal.
+        stop -- Stop background renewal.
+
+    """
+
+    TTL = 15.0
+
+    def __init__(self, backend, node_id=None, ttl=None, renew_interval=None,
+                 margin=None, on_lost=None, clock=time.time):
+        self.node_id = node_id or uuid.uuid4().hex
+        self._backend = backend
+        self._ttl = ttl or self.TTL
+        self._renew_interval = renew_interval or self._ttl / 3.0
+        self._margin = self._ttl / 10.0 if margin is None else margin
+        self._on_lost = on_lost
+        self._clock = clock
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._data_store = None
+        self._doc_type = None
+        self._owners = {}
+        self._units = {}
+
+    @property
+    def held(self):
+        now = self._clock()
+        with self._lock:
+            return [k for k, (_, expires) in self._leases.iteritems()
+                    if expires > now]
+
+    def install(self, data_store, doc_type, members=()):
+        """Fence a doc type in the `DataStore` with these leases.
+
+        Models acquired afterwards are fenced in the store at once, and
+        cached controllers of lost leases are dropped. A doc type with a
+        `leases` attribute (see `Game`) is given this manager, so it can
+        lease the models it creates and `register` their units.
+
+        :param data_store: The DataStore controller.
+        :param doc_type: type -- The `DataModelController` class leased.
+        :param members: list -- Doc types of the leased models' cache
+            members (see `Game.UNIT_TYPES`), fenced by the lease of the
+            model whose unit they are in.
+        :return: LeaseManager -- self.
+        """
+        self._data_store = data_store
+        self._doc_type = doc_type
+        if hasattr(doc_type, 'leases'):
+            doc_type.leases = self
+        data_store.set_fence(doc_type, self.token)
+        for member_type in members:
+            data_store.set_fence(member_type, self.member_token)
+        return self
+
+    def acquire(self, *keys):
+        """Take leases, in one backend call.
+
+        :param keys: str -- Lease keys (model IDs).
+        :return: dict -- Key to fencing token of the leases acquired or
+            already held; keys leased by other nodes are left out.
+        """
+        if not keys:
+            return {}
+        sent = self._clock()
+        tokens = self._backend.acquire(keys, self.node_id, sent, self._ttl)
+        with self._lock:
+            for key, token in tokens.iteritems():
+                self._leases[key] = (token,
+                                     sent + self._ttl - self._margin)
+        if self._data_store and tokens:
+            self._data_store.fence_models(self._doc_type, tokens)
+            for key in tokens:
+                ctrl = self._data_store.get_strict_controller(self._doc_type,
+                                                              key)
+                if ctrl:
+                    self.register(ctrl)
+        return tokens
+
+    def release(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._leases.pop(key, None)
+            self._forget(keys)
+        if keys:
+            self._backend.release(keys, self.node_id)
+
+    def token(self, key):
+        """Fencing token of a held lease.
+
+        :param key: str -- The lease key.
+        :return: int | None -- None if the lease is not held or has run out.
+        """
+        with self._lock:
+            lease = self._leases.get(key)
+        if lease and lease[1] > self._clock():
+            return lease[0]
+        return None
+
+    def owns(self, key):
+        return self.token(key) is not None
+
+    def register(self, ctrl):
+        """Map the members of a leased model's cache unit to it.
+
+        Called when the unit is restored or created, and again when members
+        are added to it; units already cached are registered on `acquire`.
+        Members still lazily restored are mapped by ID at once, and their
+        own members once they are restored.
+
+        :param ctrl: DataModelController -- The leased model's controller.
+        """
+        key = ctrl.uid
+
+        def walk(parent):
+            for m in getattr(parent, 'cache_members', lambda: [])():
+                if m is None:
+                    continue
+                with self._lock:
+                    self._owners[m.uid] = key
+                    self._units.setdefault(key, set()).add(m.uid)
+                if isinstance(m, LazyController) and not m.resolved:
+                    m.on_resolve(walk)
+                else:
+                    walk(m)
+
+        walk(ctrl)
+
+    def member_token(self, uid):
+        """Fencing token of the leased model whose cache unit holds a
+        member.
+
+        :param uid: str -- The member's ID.
+        :return: int | None -- None if the member was not `register`ed or
+            its model's lease is not held.
+        """
+        with self._lock:
+            key = self._owners.get(uid)
+        return None if key is None else self.token(key)
+
+    def renew(self):
+        """Renew all held leases in one backend call.
+
+        :return: list -- Keys whose leases were lost.
+        """
+        with self._lock:
+            keys = list(self._leases)
+        if not keys:
+            return []
+        sent = self._clock()
+        tokens = self._backend.renew(keys, self.node_id, sent, self._ttl)
+        lost = []
+        with self._lock:
+            for key in keys:
+                lease = self._leases.get(key)
+                if not lease:
+                    continue
+                if tokens.get(key) == lease[0]:
+                    self._leases[key] = (lease[0],
+                                         sent + self._ttl - self._margin)
+                else:
+                    del self._leases[key]
+                    lost.append(key)
+            self._forget(lost)
+        if lost:
+            self._lost(lost)
+        return lost
+
+    def start(self):
+        """Start renewing held leases in a background thread.
+
+        :return: LeaseManager -- self.
+        """
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='LeaseManager')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, release=True):
+        """Stop background renewal.
+
+        :param release: bool -- Whether to give up all held leases.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if release:
+            with self._lock:
+                keys = list(self._leases)
+            self.release(*keys)
+
+    def _run(self):
+        while not self._stop.wait(self._renew_interval):
+            try:
+                self.renew()
+            except Exception:
+                # Leases run out locally if renewals keep failing.
+                pass
+
+    def _forget(self, keys):
+        # Called with `_lock` held.
+        for key in keys:
+            for uid in self._units.pop(key, ()):
+                if self._owners.get(uid) == key:
+                    del self._owners[uid]
+
+    def _lost(self, keys):
+        if self._data_store:
+            for key in keys:
+                self._data_store.reload(self._doc_type, key)
+        if self._on_lost:
+            self._on_lost(keys)
+
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
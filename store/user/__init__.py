@@ -31,6 +31,11 @@ class User(DataModelController):
             'show_avatars': True
         })
 
+    MODEL_INDEXES = {
+        'username': {'unique': True},
+        'email': {}
+    }
+
     @classproperty
     def MODEL_RULES(cls):
         rules = super(User, cls).MODEL_RULES
@@ -0,0 +1,281 @@
+"""Ranked game log and batch Elo recomputation.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class RankedGameLog -- Append-only log of ranked game results.
+    :func team_elo -- Games-weighted average Elo of a team.
+    :func record_ranked_game -- Rate a finished ranked game and log it.
+    :func compute_ratings -- Replay a columnar game log (NumPy).
+    :func recompute_ratings -- Replay the whole log and save the ratings.
+
+NumPy is only needed by `compute_ratings` and `recompute_ratings`.
+
+"""
+
+import math
+import time
+from store.user.statistics import UserStatistics, MIN_ELO, MAX_RANK
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RankedGameLog(object):
+    """Append-only log of ranked game results, oldest first.
+
+    The record `_id` starts with the zero-padded finish time in
+    microseconds, so reading the log in `_id` order replays it in the order
+    the games were rated.
+
+    Class Properties:
+        :type COLLECTION: str -- The backing collection name.
+
+    Class Methods:
+        append -- Log a ranked game result.
+        load_columns -- Read the whole log as columns.
+
+    """
+
+    COLLECTION = 'RankedGameLog'
+
+    @classmethod
+    def append(cls, data_store, game_id, team_a, team_b, a_won):
+        """Log a ranked game result.
+
+        :param data_store: The DataStore controller.
+        :param game_id: str -- The game ID.
+        :param team_a: list -- The (`UserStatistics`) IDs of team A.
+        :param team_b: list -- The (`UserStatistics`) IDs of team B.
+        :param a_won: bool -- Whether team A won.
+        """
+        now = time.time()
+        data_store.insert_record(cls.COLLECTION, {
+            '_id': '%017d:%s' % (int(now * 1e6), game_id),
+            'game': game_id,
+            'time': now,
+            'players': list(team_a) + list(team_b),
+            'a_won': bool(a_won)
+        })
+
+    @classmethod
+    def load_columns(cls, data_store, batch_size=10000):
+        """Read the whole log as columns, oldest game first.
+
+        :param data_store: The DataStore controller.
+        :param batch_size: int -- Records fetched per round trip.
+        :return: tuple -- (user_ids, players, a_won): the list of distinct
+            user IDs, an (n, 4) int array of indexes into it (team A then
+            team B) and an (n,) bool array.
+        """
+        _require_numpy()
+        index = {}
+        user_ids = []
+        players = []
+        a_won = []
+        for record in data_store.iter_records(
+                cls.COLLECTION, sort=[('_id', 1)],
+                fields=['players', 'a_won'], batch_size=batch_size):
+            for uid in record['players']:
+                if uid not in index:
+                    index[uid] = len(user_ids)
+                    user_ids.append(uid)
+            players.extend(index[uid] for uid in record['players'])
+            a_won.append(record['a_won'])
+        return (user_ids,
+                np.array(players, dtype=np.int64).reshape(-1, 4),
+                np.array(a_won, dtype=bool))
+
+
+def team_elo(*stats):
+    """Average Elo of a team, weighted by ranked games played.
+
+    :param stats: UserStatistics -- The team members' statistics.
+    :return: float
+    """
+    elo = 0.0
+    games = 0
+    for s in stats:
+        _games = s.ranked_wins + s.ranked_losses
+        elo += s.elo * _games
+        games += _games
+    if not games:
+        return sum(s.elo for s in stats) / float(len(stats))
+    return elo / games
+
+
+def record_ranked_game(data_store, game_id, team_a, team_b, a_won):
+    """Rate a finished ranked game and log it for later recomputation.
+
+    Both team ratings are taken before any member is updated. A game
+    already in a member's recent history was rated before (e.g. its end is
+    being replayed from the move journal) and is not rated again.
+
+    :param data_store: The DataStore controller.
+    :param game_id: str -- The game ID.
+    :param team_a: list -- Team A members' `UserStatistics`.
+    :param team_b: list -- Team B members' `UserStatistics`.
+    :param a_won: bool -- Whether team A won.
+    """
+    if any(game_id in s.history for s in list(team_a) + list(team_b)):
+        return
+    elo_a = team_elo(*team_a)
+    elo_b = team_elo(*team_b)
+    for s in team_a:
+        s.update_comp_game_stats(game_id, elo_a, elo_b, a_won)
+    for s in team_b:
+        s.update_comp_game_stats(game_id, elo_b, elo_a, not a_won)
+    RankedGameLog.append(data_store, game_id, [s.uid for s in team_a],
+                         [s.uid for s in team_b], a_won)
+
+
+def compute_ratings(players, a_won, num_users, initial_elo=None):
+    """Replay a columnar game log with vectorized Elo math.
+
+    Games are grouped into slices in which no user plays twice, each game
+    going in the slice after the last one of its players' previous games.
+    Every user's games are so still rated in log order, and each slice is
+    rated in one pass with the same float operations as `record_ranked_game`
+    and `UserStatistics.update_comp_game_stats`, giving identical results.
+
+    :param players: array -- (n, 4) user indexes, team A then team B.
+    :param a_won: array -- (n,) whether team A won.
+    :param num_users: int -- Number of distinct users.
+    :param initial_elo: float | None -- Starting Elo; defaults to the
+        `UserStatistics` default.
+    :return: tuple -- (elo, wins, losses, rank) arrays indexed by user.
+    """
+    _require_numpy()
+    if initial_elo is None:
+        initial_elo = UserStatistics.INIT_DEFAULTS['elo']
+    players = np.asarray(players, dtype=np.int64).reshape(-1, 4)
+    a_won = np.asarray(a_won, dtype=bool)
+    elo = np.full(num_users, float(initial_elo))
+    wins = np.zeros(num_users, dtype=np.int64)
+    losses = np.zeros(num_users, dtype=np.int64)
+    slices = _slices(players, num_users)
+    order = np.argsort(slices, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(slices[order])) + 1
+    for games in np.split(order, bounds):
+        _rate_slice(players[games], a_won[games], elo, wins, losses)
+    rank = np.where(wins < 10, 1,
+                    np.minimum(MAX_RANK, 1 + (elo / 200).astype(np.int64)))
+    return elo, wins, losses, rank
+
+
+def recompute_ratings(data_store, batch_size=1000):
+    """Replay the whole ranked game log and save the ratings in bulk.
+
+    Users start over from the default Elo with no ranked games; users
+    without logged ranked games are left untouched. An installed
+    `Leaderboard` is rebuilt afterwards.
+
+    :param data_store: The DataStore controller.
+    :param batch_size: int -- Updates sent per bulk write.
+    :return: int -- The number of users updated.
+    """
+    user_ids, players, a_won = RankedGameLog.load_columns(data_store)
+    elo, wins, losses, rank = compute_ratings(players, a_won, len(user_ids))
+    updates = {}
+    for i, uid in enumerate(user_ids):
+        updates[uid] = {
+            'elo': float(elo[i]),
+            'ranked_wins': int(wins[i]),
+            'ranked_losses': int(losses[i]),
+            'rank': int(rank[i])
+        }
+    data_store.bulk_update_fields(UserStatistics, updates, batch_size)
+    if UserStatistics.leaderboard:
+        UserStatistics.leaderboard.rebuild(data_store)
+    return len(updates)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for batch Elo recomputation.")
+
+
+def _slices(players, num_users):
+    last = [-1] * num_users
+    slices = np.empty(len(players), dtype=np.int64)
+    for g, row in enumerate(players.tolist()):
+        s = max(last[row[0]], last[row[1]], last[row[2]], last[row[3]]) + 1
+        last[row[0]] = last[row[1]] = last[row[2]] = last[row[3]] = s
+        slices[g] = s
+    return slices
+
+
+def _team_elos(e, g):
+    """Vectorized `team_elo` of two-member teams."""
+    games = g[:, 0] + g[:, 1]
+    weighted = (0.0 + e[:, 0] * g[:, 0] + e[:, 1] * g[:, 1]) / np.maximum(
+        games, 1)
+    plain = (e[:, 0] + e[:, 1]) / 2.0
+    return np.where(games > 0, weighted, plain)
+
+
+def _rate_slice(players, a_won, elo, wins, losses):
+    e = elo[players]
+    g = wins[players] + losses[players]
+    elo_a = _team_elos(e[:, :2], g[:, :2])
+    elo_b = _team_elos(e[:, 2:], g[:, 2:])
+    team = np.column_stack((elo_a, elo_a, elo_b, elo_b)).ravel()
+    opponent = np.column_stack((elo_b, elo_b, elo_a, elo_a)).ravel()
+    win = np.column_stack((a_won, a_won, ~a_won, ~a_won)).ravel()
+    users = players.ravel()
+    won = wins[users] + win
+    played = won + losses[users] + ~win
+    change = _elo_calc(team, played, opponent, win, won)
+    elo[users] = np.maximum(MIN_ELO, elo[users] + change)
+    wins[users] = won
+    losses[users] = played - won
+
+
+def _elo_calc(player_elo, num_games, opponent_elo, win, num_games_won):
+    """Vectorized `statistics._elo_calc`."""
+    outcome = win.astype(np.int64)
+    effective_games = _effective_games(num_games, player_elo)
+    unranked = num_games_won <= 10
+    effective_games = effective_games + np.where(unranked, num_games_won, 0)
+    prediction = _unranked_prediction(player_elo, opponent_elo)
+    ranked = ~unranked
+    prediction[ranked] = _prediction(player_elo[ranked], opponent_elo[ranked])
+    if not effective_games.all():
+        raise ZeroDivisionError("Zero effective games in Elo calculation.")
+    k_factor = 800.0 / effective_games
+    return k_factor * (outcome - prediction)
+
+
+def _effective_games(num_games, player_elo):
+    """Vectorized `statistics._effective_games`."""
+    diff = 2569 - player_elo
+    fifty = 50 / np.sqrt(0.662 + 0.00000739 * (diff * diff))
+    low = (np.maximum(num_games - 50, 0) - 50) + np.floor(
+        0.5 + fifty).astype(np.int64)
+    return np.where(player_elo > 2355, num_games, low)
+
+
+def _prediction(player_elo, opponent_elo):
+    """Vectorized `statistics._prediction`.
+
+    The power goes through `math.pow`, since NumPy's own may round the
+    last bit differently and the results must match the scalar ones.
+    """
+    exponent = -1 * (player_elo - opponent_elo) / 400.0
+    power = np.frompyfunc(math.pow, 2, 1)(10, exponent).astype(np.float64)
+    return 1.0 / (1.0 + power)
+
+
+def _unranked_prediction(player_elo, opponent_elo):
+    """Vectorized `statistics._unranked_prediction`."""
+    return np.where(player_elo >= opponent_elo + 400, 1.0,
+                    np.where(player_elo <= opponent_elo - 400, 0.0,
+                             0.5 + (player_elo - opponent_elo) / 800))
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
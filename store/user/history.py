@@ -0,0 +1,101 @@
+"""Append-only user game history.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class GameHistory -- Full per-user game history log.
+
+"""
+
+
+class GameHistory(object):
+    """Full per-user game history, one record per game.
+
+    Records are keyed by (user, sequence number) and only ever inserted,
+    so appending costs the same however long the history is. The record
+    `_id` is `<user>:<zero-padded sequence>`, which keeps a user's records
+    contiguous and ordered in the `_id` index; pages are read as `_id`
+    ranges without any secondary index or skip.
+
+    Class Properties:
+        :type COLLECTION: str -- The backing collection name.
+        :type PAGE_SIZE: int -- Default page size.
+
+    Class Methods:
+        append -- Record a game in a user's history.
+        migrate -- Record a whole history at once, idempotently.
+        page -- Read one page of a user's history, newest first.
+
+    """
+
+    COLLECTION = 'GameHistory'
+    PAGE_SIZE = 25
+
+    @classmethod
+    def _id(cls, user_id, seq):
+        return '%s:%012d' % (user_id, seq)
+
+    @classmethod
+    def append(cls, data_store, user_id, seq, game_id):
+        """Record a game in a user's history.
+
+        A record already at `seq` is left as it is, so an append that is
+        repeated (e.g. when a game end is replayed, or a statistics save is
+        retried from a stale model) writes nothing.
+
+        :param data_store: The DataStore controller.
+        :param user_id: str -- The owner's (`UserStatistics`) ID.
+        :param seq: int -- The game's sequence number in the history.
+        :param game_id: str -- The game ID.
+        :return: bool -- Whether the game was recorded.
+        """
+        return not data_store.update_record(
+            cls.COLLECTION, {'_id': cls._id(user_id, seq)},
+            {'$setOnInsert': {'user': user_id, 'seq': seq, 'game': game_id}},
+            upsert=True)
+
+    @classmethod
+    def migrate(cls, data_store, user_id, game_ids):
+        """Record a whole history in one bulk write.
+
+        Records already present are left as they are, so a migration that
+        is run again (e.g. when the unmigrated model is restored on another
+        node before it is saved) writes nothing new.
+
+        :param data_store: The DataStore controller.
+        :param user_id: str -- The owner's (`UserStatistics`) ID.
+        :param game_ids: list -- The game IDs, oldest first.
+        """
+        data_store.bulk_update_records(cls.COLLECTION, [
+            ({'_id': cls._id(user_id, seq)},
+             {'$setOnInsert': {'user': user_id, 'seq': seq, 'game': game_id}})
+            for seq, game_id in enumerate(game_ids)], upsert=True)
+
+    @classmethod
+    def page(cls, data_store, user_id, count, page=0, page_size=None):
+        """Read one page of a user's history, newest first.
+
+        :param data_store: The DataStore controller.
+        :param user_id: str -- The owner's (`UserStatistics`) ID.
+        :param count: int -- Total number of games in the history.
+        :param page: int -- Page number, 0 being the most recent games.
+        :param page_size: int | None -- Games per page.
+        :return: list -- The game IDs.
+        """
+        if not page_size:
+            page_size = cls.PAGE_SIZE
+        stop = count - page * page_size
+        start = max(0, stop - page_size)
+        if stop <= 0:
+            return []
+        records = data_store.find_records(cls.COLLECTION, {
+            '_id': {'$gte': cls._id(user_id, start),
+                    '$lt': cls._id(user_id, stop)}
+        }, sort=[('_id', -1)])
+        return [str(r['game']) for r in records]
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
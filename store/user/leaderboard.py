@@ -0,0 +1,200 @@
+"""Elo leaderboard.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class Leaderboard -- Order-statistics index of ranked players by Elo.
+
+"""
+
+import threading
+from bisect import bisect_left, insort
+from store.user.statistics import UserStatistics, MIN_ELO
+
+
+class Leaderboard(object):
+    """Order-statistics index of ranked players by Elo.
+
+    Elo is split into `BUCKET_WIDTH` buckets, highest first, with a Fenwick
+    tree over the bucket sizes; each bucket keeps its players sorted by
+    exact Elo (then ID). A player's position is the number of players in
+    higher buckets plus their place in their own bucket, and the bucket
+    holding a given position is found by descending the tree, so rank and
+    page lookups, and updates, are O(log n).
+
+    Once `install`ed, `UserStatistics.update_comp_game_stats` keeps the
+    leaderboard current.
+
+    Class Properties:
+        :type BUCKET_WIDTH: float -- Elo range of one bucket.
+        :type MAX_ELO: float -- Elo at or above which players share the top
+            bucket (ordering within it stays exact).
+
+    Class Methods:
+        install -- Build a leaderboard from the store and attach it.
+
+    Properties:
+        :type size: int -- Number of ranked players.
+
+    Public Methods:
+        rebuild -- Reload all ranked players from the store.
+        update -- Add or move a player.
+        remove -- Remove a player.
+        rank -- A player's 1-based position.
+        top -- The `k` best players.
+        page -- Players by position range.
+
+    """
+
+    BUCKET_WIDTH = 1.0
+    MAX_ELO = 3400.0
+
+    def __init__(self):
+        self._num_buckets = int((self.MAX_ELO - MIN_ELO) /
+                                self.BUCKET_WIDTH) + 1
+        self._lock = threading.RLock()
+        self._clear()
+
+    @classmethod
+    def install(cls, data_store):
+        """Build a leaderboard from the store and attach it to
+        `UserStatistics`.
+
+        :param data_store: The DataStore controller.
+        :return: Leaderboard
+        """
+        board = cls()
+        board.rebuild(data_store)
+        UserStatistics.leaderboard = board
+        return board
+
+    @property
+    def size(self):
+        return len(self._elos)
+
+    def rebuild(self, data_store, batch_size=1000):
+        """Reload all players with ranked games from the store.
+
+        :param data_store: The DataStore controller.
+        :param batch_size: int -- Documents fetched per round trip.
+        """
+        entries = []
+        for model in data_store.iter_models(
+                UserStatistics, batch_size=batch_size,
+                fields=['elo', 'ranked_wins', 'ranked_losses']):
+            if model.ranked_wins or model.get('ranked_losses'):
+                entries.append((model.uid, model.elo))
+        with self._lock:
+            self._clear()
+            for uid, elo in entries:
+                self._insert(uid, elo)
+
+    def update(self, uid, elo):
+        """Add a player, or move them to their new Elo.
+
+        :param uid: str -- The player's (`UserStatistics`) ID.
+        :param elo: float -- The player's Elo.
+        """
+        with self._lock:
+            if uid in self._elos:
+                self._delete(uid)
+            self._insert(uid, elo)
+
+    def remove(self, uid):
+        with self._lock:
+            if uid in self._elos:
+                self._delete(uid)
+
+    def rank(self, uid):
+        """A player's 1-based position.
+
+        :param uid: str -- The player's (`UserStatistics`) ID.
+        :return: int | None -- None if the player is not ranked.
+        """
+        with self._lock:
+            elo = self._elos.get(uid)
+            if elo is None:
+                return None
+            b = self._bucket(elo)
+            return (self._prefix(b) +
+                    bisect_left(self._buckets[b], (-elo, uid)) + 1)
+
+    def top(self, k):
+        return self.page(1, k)
+
+    def page(self, start, count):
+        """Players by position range.
+
+        :param start: int -- 1-based position of the first player.
+        :param count: int -- Max number of players.
+        :return: list -- (position, uid, elo) tuples, best first.
+        """
+        result = []
+        with self._lock:
+            pos = max(1, start)
+            stop = min(pos + count, len(self._elos) + 1)
+            while pos < stop:
+                b = self._find(pos)
+                members = self._buckets[b]
+                i = pos - self._prefix(b) - 1
+                for neg_elo, uid in members[i:i + stop - pos]:
+                    result.append((pos, uid, -neg_elo))
+                    pos += 1
+        return result
+
+    def _clear(self):
+        self._tree = [0] * (self._num_buckets + 1)
+        self._buckets = {}
+        self._elos = {}
+
+    def _bucket(self, elo):
+        b = int((self.MAX_ELO - elo) / self.BUCKET_WIDTH)
+        return min(max(b, 0), self._num_buckets - 1)
+
+    def _insert(self, uid, elo):
+        b = self._bucket(elo)
+        insort(self._buckets.setdefault(b, []), (-elo, uid))
+        self._elos[uid] = elo
+        self._add(b, 1)
+
+    def _delete(self, uid):
+        elo = self._elos.pop(uid)
+        b = self._bucket(elo)
+        members = self._buckets[b]
+        del members[bisect_left(members, (-elo, uid))]
+        if not members:
+            del self._buckets[b]
+        self._add(b, -1)
+
+    def _add(self, b, n):
+        i = b + 1
+        while i <= self._num_buckets:
+            self._tree[i] += n
+            i += i & -i
+
+    def _prefix(self, b):
+        """Number of players in buckets before `b`."""
+        total = 0
+        i = b
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, pos):
+        """The bucket holding 1-based position `pos`."""
+        i = 0
+        step = 1 << self._num_buckets.bit_length()
+        while step:
+            j = i + step
+            if j <= self._num_buckets and self._tree[j] < pos:
+                i = j
+                pos -= self._tree[j]
+            step >>= 1
+        return i
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
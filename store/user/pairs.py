@@ -0,0 +1,140 @@
+"""Partner pair ratings.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+Exports:
+    :class PairRatings -- Team performance ratings per pair of users.
+
+"""
+
+from store.user.statistics import _performance_rating
+
+
+class PairRatings(object):
+    """Team performance ratings per pair of users.
+
+    One record per pair, keyed by the ordered pair of user IDs, holds the
+    games played together and the pair's performance rating (the mean of
+    the opposing Elo +/- 400 over those games, as in `team_mates`). Both
+    are updated in a single atomic pipeline update per game, along with
+    the last game recorded, so recording a game again changes nothing.
+    Records are indexed by (user, rating) and by rating, so best-partner
+    and best-pair queries read only the records they return.
+
+    Class Properties:
+        :type COLLECTION: str -- The backing collection name.
+        :type MIN_GAMES: int -- Default games together before a pair is
+            listed by `best_partners` and `best_pairs`.
+
+    Class Methods:
+        ensure_indexes -- Create the query indexes.
+        key -- The record ID of a pair.
+        get -- A pair's record.
+        record -- Add a game played together.
+        best_partners -- A user's best-rated partners.
+        best_pairs -- The best-rated pairs overall.
+
+    """
+
+    COLLECTION = 'PairRating'
+    MIN_GAMES = 3
+
+    @classmethod
+    def ensure_indexes(cls, data_store):
+        data_store.create_record_index(cls.COLLECTION,
+                                       [('users', 1), ('rating', -1)])
+        data_store.create_record_index(cls.COLLECTION, [('rating', -1)])
+
+    @classmethod
+    def key(cls, user_a, user_b):
+        return ':'.join(sorted((user_a, user_b)))
+
+    @classmethod
+    def get(cls, data_store, user_a, user_b):
+        """A pair's record.
+
+        :return: dict | None -- With 'users', 'count' and 'rating'.
+        """
+        records = data_store.find_records(
+            cls.COLLECTION, {'_id': cls.key(user_a, user_b)}, limit=1)
+        return records[0] if records else None
+
+    @classmethod
+    def record(cls, data_store, user_a, user_b, opposing_elo, win,
+               game_id=None):
+        """Add a game the pair played together.
+
+        :param data_store: The DataStore controller.
+        :param user_a: str -- One user's ID.
+        :param user_b: str -- The other user's ID.
+        :param opposing_elo: float -- Average Elo of the opposing team.
+        :param win: bool -- Whether the pair won.
+        :param game_id: str | None -- The game; not added again if it was
+            the last game recorded for the pair.
+        """
+        performance = _performance_rating(0, 0, opposing_elo, win)
+        query = {'_id': cls.key(user_a, user_b)}
+        fields = {
+            'users': sorted((user_a, user_b)),
+            'count': {'$add': [{'$ifNull': ['$count', 0]}, 1]},
+            'total': {'$add': [{'$ifNull': ['$total', 0]}, performance]}
+        }
+        if game_id is not None:
+            # The filter misses a pair that has recorded the game, and its
+            # upsert is skipped as a duplicate.
+            query['game'] = {'$ne': game_id}
+            fields['game'] = game_id
+        data_store.bulk_update_records(cls.COLLECTION, [(query, [
+            {'$set': fields},
+            {'$set': {'rating': {'$divide': ['$total', '$count']}}}
+        ])], upsert=True)
+
+    @classmethod
+    def best_partners(cls, data_store, user_id, k=10, min_games=None):
+        """A user's best-rated partners.
+
+        :param data_store: The DataStore controller.
+        :param user_id: str -- The user's ID.
+        :param k: int -- Max number of partners.
+        :param min_games: int | None -- Games together needed to be listed;
+            defaults to `MIN_GAMES`.
+        :return: list -- Dicts of 'partner', 'count' and 'rating'.
+        """
+        if min_games is None:
+            min_games = cls.MIN_GAMES
+        records = data_store.find_records(cls.COLLECTION, {
+            'users': user_id,
+            'count': {'$gte': min_games}
+        }, sort=[('rating', -1)], limit=k)
+        return [{
+            'partner': [u for u in r['users'] if u != user_id][0],
+            'count': r['count'],
+            'rating': r['rating']
+        } for r in records]
+
+    @classmethod
+    def best_pairs(cls, data_store, k=10, min_games=None):
+        """The best-rated pairs overall.
+
+        :param data_store: The DataStore controller.
+        :param k: int -- Max number of pairs.
+        :param min_games: int | None -- Games together needed to be listed;
+            defaults to `MIN_GAMES`.
+        :return: list -- Dicts of 'users', 'count' and 'rating'.
+        """
+        if min_games is None:
+            min_games = cls.MIN_GAMES
+        records = data_store.find_records(cls.COLLECTION, {
+            'count': {'$gte': min_games}
+        }, sort=[('rating', -1)], limit=k)
+        return [{
+            'users': r['users'],
+            'count': r['count'],
+            'rating': r['rating']
+        } for r in records]
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
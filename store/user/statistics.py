@@ -3,15 +3,44 @@
 .. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
 
 Exports:
+    :class UserStatistics -- User game statistics controller.
+    :class StatisticsAccumulator -- Per-game buffer of round statistics.
 
 """
 
 import math
 from core.datamodel import DataModelController, Collection
 from core.decorators import classproperty
+from store.db import VersionConflictError
+from store.user.history import GameHistory
+
+
+MIN_ELO = 200.0
+MAX_RANK = 14
 
 
 class UserStatistics(DataModelController):
+    """User game statistics.
+
+    Only the most recent `HISTORY_SIZE` game IDs are kept in the model, in
+    a ring buffer; the full history is appended to `GameHistory`.
+
+    Class Properties:
+        :type HISTORY_SIZE: int -- Capacity of the recent history buffer.
+        :type leaderboard: Leaderboard | None -- Kept current with ranked
+            Elo changes once installed (see `Leaderboard.install`).
+
+    Properties:
+        :type recent_history: list -- Recent game IDs, newest first.
+        :type history_count: int -- Total number of games in the history.
+
+    Public Methods:
+        history_page -- One page of the full history, newest first.
+    """
+
+    HISTORY_SIZE = 20
+
+    leaderboard = None
 
     @classproperty
     def MODEL_RULES(cls):
@@ -19,7 +48,8 @@ class UserStatistics(DataModelController):
         rules.update({
             'games_won': ('games_won', int, None),
             'games_lost': ('games_lost', int, None),
-            'history': ('history', Collection.List(int), None),
+            'history': ('history', Collection.List(str), None),
+            'history_count': ('history_count', int, None),
             'twofers': ('twofers', int, None),
             'won_bet_rounds': ('won_bet_rounds', int, None),
             'lost_bet_rounds': ('lost_bet_rounds', int, None),
@@ -31,7 +61,7 @@ class UserStatistics(DataModelController):
             'elo': ('elo', float, None),
             'rank': ('rank', int, None),
             'ranked_wins': ('ranked_wins', int, None),
-            'ranked_losses': ('ranked_wins', int, None)
+            'ranked_losses': ('ranked_losses', int, None)
         })
         return rules
 
@@ -42,6 +72,7 @@ class UserStatistics(DataModelController):
             'games_won': 0,
             'games_lost': 0,
             'history': [],
+            'history_count': 0,
             'twofers': 0,
             'won_bet_rounds': 0,
             'lost_bet_rounds': 0,
@@ -58,13 +89,19 @@ class UserStatistics(DataModelController):
         return defaults
 
     @classmethod
-    def restore(cls, data_model, data_store, **kwargs):
-        ctrl = data_store.get_controller(cls, data_model.uid)
+    def restore(cls, data_store, data_model, **kwargs):
+        ctrl = data_store.get_strict_controller(cls, data_model.uid)
         if not ctrl:
+            history = data_model.history
+            history_count = data_model.get('history_count')
+            if history_count is None:
+                history, history_count = cls._migrate_history(
+                    data_store, data_model.uid, history)
             kwargs.update({
                 'games_won': data_model.games_won,
                 'games_lost': data_model.games_lost,
-                'history': data_model.history,
+                'history': history,
+                'history_count': history_count,
                 'twofers': data_model.twofers,
                 'won_bet_rounds': data_model.won_bet_rounds,
                 'lost_bet_rounds': data_model.lost_bet_rounds,
@@ -75,12 +112,65 @@ class UserStatistics(DataModelController):
                 'elo': data_model.elo,
                 'rank': data_model.rank,
                 'ranked_wins': data_model.ranked_wins,
+                'ranked_losses': data_model.get('ranked_losses') or 0,
                 'team_mates': data_model.team_mates
             })
             ctrl = super(UserStatistics, cls).restore(
-                data_model, data_store, **kwargs)
+                data_store, data_model, **kwargs)
         return ctrl
 
+    @classmethod
+    def _migrate_history(cls, data_store, uid, history):
+        """Move an uncapped, newest-first history into `GameHistory`.
+
+        :return: tuple -- The ring buffer and the history count.
+        """
+        oldest_first = list(reversed(history))
+        GameHistory.migrate(data_store, uid, oldest_first)
+        count = len(oldest_first)
+        ring = [None] * min(count, cls.HISTORY_SIZE)
+        for seq in xrange(max(0, count - cls.HISTORY_SIZE), count):
+            ring[seq % cls.HISTORY_SIZE] = oldest_first[seq]
+        return ring, count
+
+    @property
+    def recent_history(self):
+        size = len(self.history)
+        head = self.history_count % self.HISTORY_SIZE
+        return [self.history[(head - i - 1) % size] for i in xrange(size)]
+
+    def history_page(self, page=0, page_size=None):
+        """One page of the full game history, newest first.
+
+        :param page: int -- Page number, 0 being the most recent games.
+        :param page_size: int | None -- Games per page.
+        :return: list -- The game IDs.
+        """
+        return GameHistory.page(self._data_store, self.uid,
+                                self.history_count, page, page_size)
+
+    def apply_round_deltas(self, delta):
+        """Apply round results buffered by a `StatisticsAccumulator`.
+
+        :param delta: dict -- One player's buffered deltas.
+        :return: dict -- The counter increments applied.
+        """
+        won_bets = delta.get('won_bet_rounds', 0)
+        if won_bets:
+            self.avg_win_bet = _merge_avg(
+                self.won_bet_rounds, self.avg_win_bet, won_bets,
+                delta['win_bet_total'])
+        won_counters = delta.get('won_counter_rounds', 0)
+        if won_counters:
+            self.avg_counter_win = _merge_avg(
+                self.won_counter_rounds, self.avg_counter_win, won_counters,
+                delta['counter_win_total'])
+        inc = dict((k, delta[k]) for k in StatisticsAccumulator.COUNTERS
+                   if delta.get(k))
+        for k, n in inc.iteritems():
+            setattr(self, k, getattr(self, k) + n)
+        return inc
+
     def won_bet_round(self, bet):
         self.avg_win_bet = _avg(self.won_bet_rounds,
                                 self.avg_win_bet, bet)
@@ -100,9 +190,15 @@ class UserStatistics(DataModelController):
         self.lost_counter_rounds += 1
 
     def add_game_to_history(self, game_id):
-        self.history.insert(0, game_id)
-        self._update_model_collection('history', {'action': 'insert',
-                                                  'index': 0})
+        seq = self.history_count
+        GameHistory.append(self._data_store, self.uid, seq, game_id)
+        if len(self.history) < self.HISTORY_SIZE:
+            self.history.append(game_id)
+            self._update_model_collection('history', {'action': 'append'})
+        else:
+            self.history[seq % self.HISTORY_SIZE] = game_id
+            self._update_model('history')
+        self.history_count = seq + 1
 
     def update_comp_game_stats(self, game_id, team_elo, opposing_team_elo,
                                win):
@@ -116,8 +212,11 @@ class UserStatistics(DataModelController):
         games_played = self.ranked_wins + self.ranked_losses
         elo_change = _elo_calc(team_elo, games_played, opposing_team_elo, win,
                                self.ranked_wins)
-        self.elo = min(200, self.elo + elo_change)
+        self.elo = max(MIN_ELO, self.elo + elo_change)
         self.rank = _elo_rank(self.elo, self.ranked_wins)
+        leaderboard = getattr(type(self), 'leaderboard', None)
+        if leaderboard:
+            leaderboard.update(self.uid, self.elo)
 
     def update_casual_game_stats(self, game_id, team_mate, opposing_team_elo,
                                  win):
@@ -127,18 +226,112 @@ class UserStatistics(DataModelController):
         else:
             self.games_lost += 1
         self.rank = _elo_rank(self.elo, self.ranked_wins)
-        if team_mate not in self.team_mates:
-            self.team_mates[team_mate] = (0, 0)
-        self.team_mates[team_mate][1] = _performance_rating(
-            self.team_mates[team_mate][0],
-            self.team_mates[team_mate][1],
-            opposing_team_elo, win)
-        self.team_mates[team_mate][0] += 1
+        count, rating = self.team_mates.get(team_mate) or (0, 0)
+        self.team_mates[team_mate] = [
+            count + 1,
+            _performance_rating(count, rating, opposing_team_elo, win)]
+        self._update_model('team_mates')
 
     def update_free_game_stats(self, game_id):
         self.add_game_to_history(game_id)
 
 
+class StatisticsAccumulator(object):
+    """Per-game buffer of round statistics.
+
+    Round results are summed here for the whole game and applied to each
+    player's `UserStatistics` by `flush`, in one update per player, instead
+    of touching four statistics controllers every hand. Deltas are plain
+    dicts keyed by `UserStatistics` ID, so the owning game can keep them in
+    its model across restores.
+
+    Class Properties:
+        :type COUNTERS: tuple -- Fields buffered as plain increments.
+        :type RETRIES: int -- Reloads `flush` makes on version conflicts.
+
+    Init Parameters:
+        deltas -- Existing deltas to continue from; updated in place.
+
+    Properties:
+        :type deltas: dict -- Buffered deltas by `UserStatistics` ID.
+
+    Public Methods:
+        won_bet_round -- Record a won bet round.
+        lost_bet_round -- Record a lost bet round.
+        won_counter_round -- Record a won counter round.
+        lost_counter_round -- Record a lost counter round.
+        flush -- Apply and save one player's deltas.
+
+    """
+
+    COUNTERS = ('won_bet_rounds', 'lost_bet_rounds', 'won_counter_rounds',
+                'lost_counter_rounds', 'twofers')
+    RETRIES = 3
+
+    def __init__(self, deltas=None):
+        self.deltas = {} if deltas is None else deltas
+
+    def won_bet_round(self, stats_id, bet):
+        self._add(stats_id, won_bet_rounds=1, win_bet_total=bet,
+                  twofers=1 if bet == 100 else 0)
+
+    def lost_bet_round(self, stats_id):
+        self._add(stats_id, lost_bet_rounds=1)
+
+    def won_counter_round(self, stats_id, points):
+        self._add(stats_id, won_counter_rounds=1, counter_win_total=points)
+
+    def lost_counter_round(self, stats_id):
+        self._add(stats_id, lost_counter_rounds=1)
+
+    def flush(self, stats, result=None):
+        """Apply one player's deltas and save them in a single update.
+
+        Counters are saved as `$inc` increments; averages and, with a
+        `result`, the game record fields are set alongside them. A game
+        already in the recent history was flushed before (e.g. its end is
+        being replayed from the move journal), so its deltas are dropped. If
+        the stored statistics moved on since `stats` was loaded, they are
+        reloaded and the deltas applied again, up to `RETRIES` times.
+
+        :param stats: UserStatistics -- The player's statistics.
+        :param result: tuple | None -- `update_casual_game_stats` arguments
+            (game_id, team_mate, opposing_team_elo, win) for a finished game.
+        :raise: VersionConflictError if still conflicting after `RETRIES`
+            reloads.
+        """
+        delta = self.deltas.pop(stats.uid, None)
+        if not delta and not result:
+            return
+        data_store = stats._data_store
+        attempt = 0
+        while True:
+            if result and result[0] in stats.history:
+                return
+            try:
+                inc = stats.apply_round_deltas(delta or {})
+                fields = ['avg_win_bet', 'avg_counter_win']
+                if result:
+                    stats.update_casual_game_stats(*result)
+                    inc['games_won' if result[3] else 'games_lost'] = 1
+                    fields += ['rank', 'team_mates', 'history',
+                               'history_count']
+                data_store.increment_model_fields(
+                    UserStatistics, stats.model, inc, fields)
+                return
+            except VersionConflictError:
+                if attempt >= self.RETRIES:
+                    raise
+                attempt += 1
+                data_store.reload(UserStatistics, stats.uid)
+                stats = data_store.get_controller(UserStatistics, stats.uid)
+
+    def _add(self, stats_id, **amounts):
+        delta = self.deltas.setdefault(stats_id, {})
+        for k, n in amounts.iteritems():
+            delta[k] = delta.get(k, 0) + n
+
+
 def _avg(count, avg, new_num):
     """Incremental average.
 
@@ -152,6 +345,18 @@ def _avg(count, avg, new_num):
     return (count * avg + new_num) / (count + 1.0)
 
 
+def _merge_avg(count, avg, new_count, new_total):
+    """Average of a previous average and a batch of new numbers.
+
+    :param count: int -- The previous total.
+    :param avg: float -- The previous average.
+    :param new_count: int -- How many new numbers.
+    :param new_total: int|float -- The sum of the new numbers.
+    :return: float -- The new average.
+    """
+    return (count * avg + new_total) / float(count + new_count)
+
+
 def _performance_rating(count, rating, opposing_elo, win=True):
     """Elo-based performance rating.
 
@@ -179,7 +384,8 @@ def _effective_games(num_games, player_elo):
     if player_elo > 2355:
         return num_games
     else:
-        fifty = 50 / math.sqrt(0.662 + 0.00000739 * math.pow(2569 - player_elo, 2))
+        diff = 2569 - player_elo
+        fifty = 50 / math.sqrt(0.662 + 0.00000739 * (diff * diff))
         num_games -= 50
         if num_games < 0:
             num_games = 0
@@ -243,4 +449,4 @@ def _elo_rank(player_elo, num_games_won):
     if num_games_won < 10:
         return 1
     else:
-        return max(14, 1 + (player_elo / 200))
+        return min(MAX_RANK, 1 + int(player_elo / 200))
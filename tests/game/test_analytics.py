@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Unit tests for `game.analytics.ArchiveQuery` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from .. import TestCase
+from game.archive import write_archive
+
+try:
+    from game.analytics import ArchiveQuery
+except ImportError:
+    ArchiveQuery = None
+
+
+@unittest.skipIf(ArchiveQuery is None, "NumPy is not installed.")
+class ArchiveQueryTest(TestCase):
+    """Filter, derived column and group-by tests."""
+
+    def setUp(self):
+        super(ArchiveQueryTest, self).setUp()
+        self._dir = tempfile.mkdtemp()
+        hands = [
+            # bet team A makes 100 with five trumps (suit 1), three kitty aces
+            {'bettor': 0, 'bet_team': 'A', 'bet_amount': 100, 'trump': 1,
+             'points': [100, 0], 'kitty': [30, 46, 62, 17],
+             'deal': [[18, 19, 20, 35, 36, 37, 38]] * 4, 'bids': [[0, 100]],
+             'tricks': []},
+            # bet team B misses 100 with two trumps (suit 2)
+            {'bettor': 1, 'bet_team': 'B', 'bet_amount': 100, 'trump': 2,
+             'points': [45, 55], 'kitty': [17, 18, 19, 20],
+             'deal': [[35, 36, 49, 50, 51, 52, 53]] * 4, 'bids': [[1, 100]],
+             'tricks': []},
+            # bet team A makes 60
+            {'bettor': 2, 'bet_team': 'A', 'bet_amount': 60, 'trump': 3,
+             'points': [70, 30], 'kitty': [17, 18, 19, 20],
+             'deal': [[49, 50, 51, 52, 53, 54, 55]] * 4, 'bids': [[2, 60]],
+             'tricks': []}
+        ]
+        for i, compress in enumerate((True, False)):
+            write_archive(os.path.join(self._dir, 'f%d.p200a' % i), [{
+                'id': 'game%d' % i,
+                'players': ['u1', 'u2', 'u3', 'u4'],
+                'points': {'A': 200, 'B': 40},
+                'sixes': bool(i),
+                'hands': hands
+            }], compress)
+        self._query = ArchiveQuery(self._dir,
+                                   cache_dir=os.path.join(self._dir, 'cache'))
+
+    def tearDown(self):
+        super(ArchiveQueryTest, self).tearDown()
+        shutil.rmtree(self._dir)
+
+    def test_derived(self):
+        """Tests derived columns over both files."""
+        q = self._query
+        self.assertEqual(q.size, 6)
+        self.assertEqual(list(q['game']), [0, 0, 0, 1, 1, 1])
+        self.assertEqual(list(q['sixes']), [0, 0, 0, 1, 1, 1])
+        self.assertEqual(list(q['trump_length'])[:3], [5, 2, 7])
+        self.assertEqual(list(q['kitty_aces'])[:3], [3, 0, 0])
+        self.assertEqual(list(q['counter_points'])[:3], [0, 45, 30])
+
+    def test_group_by(self):
+        """Tests make rate of 100-point bids by trump length."""
+        result = self._query.group_by(
+            ['trump_length'],
+            {'make_rate': ('mean', 'made'), 'hands': ('count', None)},
+            where=lambda q: q['bet_amount'] == 100)
+        self.assertEqual(result.rows(), [(2, 2, 0.0), (5, 2, 1.0)])
+        out = StringIO()
+        result.to_csv(out)
+        self.assertEqual(out.getvalue().splitlines()[0],
+                         'trump_length,hands,make_rate')
+        self.assertEqual(list(result.to_numpy().make_rate), [0.0, 1.0])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Unit tests for `game.archive` file format.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import os
+import shutil
+import tempfile
+from .. import TestCase
+from game.archive import (ArchiveFile, GameArchiver, MAX_HAND, MAX_TRICKS,
+                          write_archive)
+
+
+class _Game(object):
+
+    def __init__(self, store, uid, hands):
+        self._store = store
+        self.uid = uid
+        self.players = []
+        self.points = {'A': 200, 'B': 40}
+        self.options = type('Options', (object,), {'sixes': True})
+        self.hands = hands
+
+    def delete(self, data_store):
+        del self._store.games[self.uid]
+
+
+class _DataStore(object):
+
+    def __init__(self):
+        self.games = {}
+
+    def find_ids(self, doc_type, query, limit):
+        skip = query.get('_id', {}).get('$nin', [])
+        return sorted(uid for uid in self.games if uid not in skip)[:limit]
+
+    def get_controller(self, doc_type, uid):
+        if isinstance(self.games[uid], Exception):
+            raise self.games[uid]
+        return self.games[uid]
+
+
+class ArchiveFileTest(TestCase):
+    """Archive write/read round trip tests."""
+
+    def setUp(self):
+        super(ArchiveFileTest, self).setUp()
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'test.p200a')
+        hand = {
+            'round': 1,
+            'start': 1,
+            'kitty': [17, 18, 19, 20],
+            'deal': [[33, 34, 35, 36, 37, 38, 39]] * 4,
+            'bids': [[1, 60], [2, 65], [3, 0]],
+            'bettor': 2,
+            'tricks': [[2, 3, 33, 34, 35, 36]] * 7,
+            'bet_team': 'A',
+            'bet_amount': 65,
+            'trump': 2,
+            'points': [70, 30]
+        }
+        self._records = [{
+            'id': 'game%d' % g,
+            'players': ['u1', 'u2', 'u3', 'u4'],
+            'points': {'A': 200, 'B': 40},
+            'sixes': bool(g % 2),
+            'hands': [dict(hand, round=h + 1) for h in xrange(g + 1)]
+        } for g in xrange(3)]
+
+    def tearDown(self):
+        super(ArchiveFileTest, self).tearDown()
+        shutil.rmtree(self._dir)
+
+    def test_round_trip(self):
+        """Tests that records read back unchanged, compressed or not."""
+        for compress in (True, False):
+            write_archive(self._path, self._records, compress)
+            archive = ArchiveFile(self._path)
+            self.assertEqual(archive.games, ['game0', 'game1', 'game2'])
+            self.assertEqual(archive.rows('hands'), 6)
+            self.assertEqual(archive.rows('bids'), 18)
+            self.assertEqual(list(archive.records()), self._records)
+
+    def test_sixes_round_trip(self):
+        """Tests that a full sixes hand of nine cards and tricks fits."""
+        self.assertEqual((MAX_HAND, MAX_TRICKS), (9, 9))
+        hand = self._records[1]['hands'][0]
+        hand['deal'] = [range(69, 78)] * 4
+        hand['tricks'] = [[t % 4, (t + 1) % 4, 69, 70, 71, 72]
+                          for t in xrange(9)]
+        write_archive(self._path, self._records)
+        self.assertEqual(list(ArchiveFile(self._path).records()),
+                         self._records)
+
+    def test_bad_game_skipped(self):
+        """Tests that one failing game does not block the batch."""
+        store = _DataStore()
+        for record in self._records:
+            store.games[record['id']] = _Game(store, record['id'],
+                                              record['hands'])
+        store.games['game1'].hands = [dict(self._records[1]['hands'][0],
+                                           tricks=[[0, 0, 1, 2, 3, 4]] * 10)]
+        store.games['game9'] = ValueError("Corrupt game.")
+        archiver = GameArchiver(store, self._dir, batch_size=2)
+        self.assertEqual(archiver.run(), 2)
+        self.assertEqual(sorted(archiver.failed), ['game1', 'game9'])
+        self.assertEqual(sorted(store.games), ['game1', 'game9'])
+        self.assertEqual(sorted(archiver.archived_ids()), ['game0', 'game2'])
+
+    def test_invalid_file(self):
+        """Tests that non-archive files are rejected."""
+        with open(self._path, 'wb') as f:
+            f.write('not an archive')
+        with self.assertRaises(ValueError):
+            ArchiveFile(self._path)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Unit tests for `game.deck.cardholder.CardHolder` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from .. import TestCase
+from game.deck import CardHolder, DiscardPile, Card
+from store import DataStore
+
+
+class CardHolderTestCase(TestCase):
+
+    def setUp(self):
+        super(CardHolderTestCase, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._hand = CardHolder.new(None, self._ds, sort_method='suit')
+        self._hand.insert_card(Card(Card.Suit.HEARTS, Card.Value.ACE))
+        self._hand.insert_card(Card(Card.Suit.HEARTS, Card.Value.FIVE))
+        self._hand.insert_card(Card(Card.Suit.SPADES, Card.Value.TEN))
+
+    def tearDown(self):
+        super(CardHolderTestCase, self).tearDown()
+        self._hand.delete(self._ds)
+        self._hand = None
+
+
+class CardHolderLegalMoveTest(CardHolderTestCase):
+    """Per-suit index and legal move tests."""
+
+    def test_suit_index(self):
+        """Tests that the suit index follows inserts and removes."""
+        self.assertTrue(self._hand.has_suit(Card.Suit.HEARTS))
+        self.assertFalse(self._hand.has_suit(Card.Suit.CLUBS))
+        self.assertEqual(len(self._hand.suit_cards(Card.Suit.HEARTS)), 2)
+        self._hand.remove_card(Card(Card.Suit.SPADES, Card.Value.TEN))
+        self.assertFalse(self._hand.has_suit(Card.Suit.SPADES))
+        self._hand.dump_cards()
+        self.assertFalse(self._hand.has_suit(Card.Suit.HEARTS))
+
+    def test_playable_cards(self):
+        """Tests that the lead suit must be followed when possible."""
+        self.assertEqual(len(self._hand.playable_cards()), 3)
+        self.assertEqual(len(self._hand.playable_cards(Card.Suit.HEARTS)), 2)
+        self.assertEqual(len(self._hand.playable_cards(Card.Suit.CLUBS)), 3)
+        spade = Card(Card.Suit.SPADES, Card.Value.TEN)
+        self.assertFalse(self._hand.is_playable(spade, Card.Suit.HEARTS))
+        self.assertTrue(self._hand.is_playable(spade, Card.Suit.CLUBS))
+        self.assertFalse(self._hand.is_playable(
+            Card(Card.Suit.CLUBS, Card.Value.ACE)))
+
+
+class DiscardPilePointsTest(TestCase):
+    """Running discard point total tests."""
+
+    def setUp(self):
+        super(DiscardPilePointsTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._pile = DiscardPile.new(None, self._ds, sort_method='value')
+
+    def tearDown(self):
+        super(DiscardPilePointsTest, self).tearDown()
+        self._pile.delete(self._ds)
+        self._pile = None
+
+    def test_points(self):
+        """Tests that points follow appends, removes and dumps."""
+        self.assertEqual(self._pile.points, 0)
+        self._pile.append_cards([Card(Card.Suit.HEARTS, Card.Value.ACE),
+                                 Card(Card.Suit.HEARTS, Card.Value.FIVE),
+                                 Card(Card.Suit.SPADES, Card.Value.NINE),
+                                 Card(Card.Suit.CLUBS, Card.Value.TEN)])
+        self.assertEqual(self._pile.points, 25)
+        self._pile.remove_card(Card(Card.Suit.HEARTS, Card.Value.ACE))
+        self.assertEqual(self._pile.points, 15)
+        self._pile.dump_cards()
+        self.assertEqual(self._pile.points, 0)
+
+
+class CardHolderCompactTest(CardHolderTestCase):
+    """Compact card encoding tests."""
+
+    def tearDown(self):
+        Card.COMPACT_ENCODING = False
+        super(CardHolderCompactTest, self).tearDown()
+
+    def test_encode_decode(self):
+        """Tests that both persisted forms decode to the same card."""
+        card = Card(Card.Suit.CLUBS, Card.Value.QUEEN)
+        self.assertEqual(Card.decode(Card.encode(card)), card)
+        Card.COMPACT_ENCODING = True
+        self.assertIsInstance(Card.encode(card), int)
+        self.assertEqual(Card.decode(Card.encode(card)), card)
+        self.assertEqual(Card.decode(dict(card)), card)
+
+    def test_compact_restore(self):
+        """Tests that holders saved in either form restore when compact."""
+        uid = self._hand.uid
+        cards = list(self._hand.cards)
+        self._hand.save(self._ds)
+        self._hand.delete_cache(self._ds)
+        Card.COMPACT_ENCODING = True
+        self._hand = CardHolder.get(self._ds, uid)
+        self.assertEqual(self._hand.cards, cards)
+        self._hand.save(self._ds)
+        self._hand.delete_cache(self._ds)
+        self._hand = CardHolder.get(self._ds, uid)
+        self.assertEqual(self._hand.cards, cards)
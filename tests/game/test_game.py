@@ -9,7 +9,10 @@ from . import (GameNoInitTestCase, GameInitTestCase, GameCreatedTestCase,
                GameReadyTestCase, GameRunningTestCase)
 from core.exceptions import StateError
 from game import Game
+from game.table import Table
 from store.db import DBLookupError
+from store import LazyController, StaleOwnerError
+from store.lease import LeaseManager, MemoryLeaseBackend
 
 
 class GameNewTest(GameNoInitTestCase):
@@ -83,6 +86,24 @@ class GameLoadTest(GameInitTestCase):
         with self.assertRaises(ValueError):
             self._ds.get_controller(Game, uid)
 
+    def test_load_lazy(self):
+        """Tests Game.get_lazy restores members on first access."""
+        uid = self._game.uid
+        creator_id = self._game.players[0].uid
+        self._game.save(self._ds)
+        self._game.delete_cache(self._ds)
+        self._game = Game.get_lazy(self._ds, uid)
+        self.assertIsCREATED(self._game)
+        player = self._game.players[0]
+        self.assertIsInstance(player, LazyController)
+        self.assertFalse(player.resolved)
+        self.assertEqual(player.uid, creator_id)
+        self.assertEqual(player.team, 'A')
+        self.assertTrue(player.resolved)
+        self._game.delete_cache(self._ds)
+        self._game = Game.get_lazy(self._ds, uid, prefetch=['players'])
+        self.assertNotIsInstance(self._game.players[0], LazyController)
+
     def test_load_stored(self):
         """Tests Game.get/load with non-existing controller."""
         uid = self._game.uid
@@ -216,3 +237,173 @@ class GamePauseResumeTest(GameRunningTestCase):
         self.assertIsPAUSED(self._game)
         with self.assertRaises(StateError):
             self._game.new_game()
+
+
+class GameStatisticsTest(GameRunningTestCase):
+    """Buffered round statistics tests."""
+
+    def test_round_stats_buffered(self):
+        """Tests that round results are buffered, not applied per hand."""
+        stats = self._game.players[0].user.statistics
+        table = self._game.table
+        table.bet_team = 'A'
+        table.bet_amount = 60
+        table.state = Table.State.END
+        self.assertIn(stats.uid, self._game.stat_deltas)
+        self.assertEqual(stats.won_bet_rounds + stats.lost_bet_rounds, 0,
+                         "Statistics updated before the game ended.")
+
+    def test_round_points(self):
+        """Tests that a lost bet is taken off the bet team's points."""
+        table = self._game.table
+        table.bet_team = 'A'
+        table.bet_amount = 60
+        scores = table.scores
+        table.state = Table.State.END
+        self.assertIs(table.state, Table.State.BETTING)
+        self.assertEqual(self._game.points,
+                         {'A': -60, 'B': scores['B']})
+
+    def test_abandon_flushes_stats(self):
+        """Tests that an abandoning player's statistics are applied."""
+        player = self._game.players[1]
+        stats = player.user.statistics
+        self._game.stat_deltas[stats.uid] = {'lost_bet_rounds': 2}
+        self._game.remove_player(player)
+        self.assertNotIn(stats.uid, self._game.stat_deltas)
+        self.assertEqual(stats.lost_bet_rounds, 2)
+
+    def test_ranked_game_end(self):
+        """Tests that the end of a ranked game rates its players."""
+        self._game.options['ranked'] = True
+        self._game._end_game('A')
+        for p in self._game.players:
+            stats = p.user.statistics
+            self.assertEqual((stats.ranked_wins, stats.ranked_losses),
+                             (1, 0) if p.team == 'A' else (0, 1))
+            self.assertIn(self._game.uid, stats.history)
+
+
+class GameCacheTest(GameRunningTestCase):
+    """Cache pinning and eviction tests."""
+
+    def test_running_game_pinned(self):
+        """Tests that a running game and its members survive pruning."""
+        budget = self._ds.MAX_CACHE_BYTES
+        try:
+            self._ds.set_cache_budget(1)
+            self.assertIs(self._ds.get_strict_controller(Game, self._game.uid),
+                          self._game)
+            table = self._game.table
+            self.assertIs(self._ds.get_strict_controller(type(table),
+                                                         table.uid), table)
+        finally:
+            self._ds.set_cache_budget(budget)
+
+    def test_finished_game_evicted(self):
+        """Tests that a finished game is evicted with its members."""
+        budget = self._ds.MAX_CACHE_BYTES
+        table = self._game.table
+        self._game.state = Game.State.END
+        try:
+            self._ds.set_cache_budget(1)
+            self.assertIsNone(
+                self._ds.get_strict_controller(Game, self._game.uid))
+            self.assertIsNone(
+                self._ds.get_strict_controller(type(table), table.uid))
+        finally:
+            self._ds.set_cache_budget(budget)
+
+    def test_lazy_members_written_back(self):
+        """Tests that changed members of a lazily loaded game are saved on
+        eviction."""
+        uid = self._game.uid
+        self._game.state = Game.State.END
+        self._game.save(self._ds)
+        self._game.delete_cache(self._ds)
+        self._game = Game.get_lazy(self._ds, uid)
+        table = self._game.table
+        table.bet_amount = 95
+        budget = self._ds.MAX_CACHE_BYTES
+        try:
+            self._ds.set_cache_budget(1)
+            self.assertIsNone(self._ds.get_strict_controller(Game, uid))
+        finally:
+            self._ds.set_cache_budget(budget)
+        self._ds._db.doc_cache.clear()
+        self.assertEqual(
+            self._ds.get_strict_model(type(table), table.uid)['bet_amount'],
+            95)
+
+    def test_stats_count_public_lookups(self):
+        """Tests that only `get_controller` lookups are counted."""
+        self._ds.reset_cache_stats()
+        self._ds.get_strict_controller(Game, self._game.uid)
+        self._ds.get_strict_controller(Game, 'missing')
+        stats = self._ds.cache_stats()['types']['Game']
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
+        self._ds.get_controller(Game, self._game.uid)
+        stats = self._ds.cache_stats()['types']['Game']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 0))
+
+    def test_lazy_table_watched(self):
+        """Tests that a lazily loaded running game watches its table from
+        when the table is restored."""
+        uid = self._game.uid
+        self._game.save(self._ds)
+        self._game.delete_cache(self._ds)
+        self._game = Game.get_lazy(self._ds, uid)
+        self.assertFalse(self._game.table.resolved)
+        journaled = []
+        Game.journal = type('Journal', (object,), {
+            'append': lambda _, *args: journaled.append(args)})()
+        try:
+            table = self._game.table
+            table.bet(table.players[table.player_turn], 60)
+        finally:
+            Game.journal = None
+        self.assertTrue(self._game.table.resolved)
+        self.assertEqual([(g, s) for g, s, _ in journaled], [(uid, 0)])
+
+
+class GameFenceTest(GameRunningTestCase):
+    """Lease fencing of a game's cache unit."""
+
+    def setUp(self):
+        super(GameFenceTest, self).setUp()
+        self._leases = LeaseManager(MemoryLeaseBackend(), 'a').install(
+            self._ds, Game, members=Game.UNIT_TYPES)
+
+    def tearDown(self):
+        for doc_type in (Game,) + Game.UNIT_TYPES:
+            self._ds.set_fence(doc_type, None)
+        Game.leases = None
+        super(GameFenceTest, self).tearDown()
+
+    def test_new_game_leased(self):
+        """Tests that games created under installed leases are leased, and
+        their units saved."""
+        games = [Game.new(self._creator, self._ds),
+                 Game.new_match(self._ds, self._users[:2], self._users[2:4])]
+        try:
+            for game in games:
+                self.assertTrue(self._leases.owns(game.uid))
+                self._ds.save_unit(game)
+                player = game.players[0]
+                self._ds.save(type(player), player.model)
+        finally:
+            for game in games:
+                game.delete(self._ds)
+
+    def test_stale_table_save_refused(self):
+        """Tests that a table is saved under its game's lease, and refused
+        once a newer owner has written it."""
+        table = self._game.table
+        with self.assertRaises(StaleOwnerError):
+            self._ds.save(type(table), table.model)
+        self._leases.acquire(self._game.uid)
+        self._ds.save_unit(self._game)
+        self._ds.fence_models(type(table), {table.uid: 2})
+        table.bet_amount = 95
+        with self.assertRaises(StaleOwnerError):
+            self._ds.save(type(table), table.model)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Unit tests for `game.journal.MoveJournal` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from .. import TestCase
+from game.journal import MoveJournal
+from game.table import TableState, Move
+
+
+class MoveJournalTest(TestCase):
+    """Append, group commit and torn-tail tests."""
+
+    def setUp(self):
+        super(MoveJournalTest, self).setUp()
+        self._dir = tempfile.mkdtemp()
+        self._journal = MoveJournal(self._dir, shard=3, flush_interval=0.01,
+                                    flush_moves=8)
+
+    def tearDown(self):
+        super(MoveJournalTest, self).tearDown()
+        self._journal.close()
+        shutil.rmtree(self._dir)
+
+    def test_append(self):
+        """Tests that appended moves are durable once waited for."""
+        moves = [Move(TableState.Action.BET, 1, 60),
+                 Move(TableState.Action.TRUMP, 2, 3),
+                 Move(TableState.Action.PLAY, 2, 62)]
+        seqs = [self._journal.append('game1', i, m)
+                for i, m in enumerate(moves)]
+        self.assertTrue(self._journal.wait(seqs[-1], timeout=5))
+        self.assertTrue(self._journal.path.endswith('moves.3.wal'))
+        self.assertEqual(self._journal.entries(),
+                         [('game1', i, m) for i, m in enumerate(moves)])
+
+    def test_group_commit(self):
+        """Tests that a full batch is committed without waiting."""
+        move = Move(TableState.Action.BET, 0, 0)
+        for i in xrange(20):
+            seq = self._journal.append('game%d' % (i % 3), i, move)
+        self._journal.sync()
+        self.assertEqual(self._journal.durable, seq)
+        self.assertEqual(len(self._journal.entries()), 20)
+
+    def test_torn_tail(self):
+        """Tests that a partly written last record ends the journal."""
+        move = Move(TableState.Action.PLAY, 0, 17)
+        self._journal.append('game1', 0, move)
+        self._journal.append('game1', 1, move)
+        self._journal.sync()
+        with open(self._journal.path, 'r+b') as f:
+            f.seek(-3, 2)
+            f.truncate()
+        self.assertEqual(self._journal.entries(), [('game1', 0, move)])
+
+    def test_checkpoint_timer(self):
+        """Tests that the journal is checkpointed in the background."""
+        saved = []
+
+        class _DataStore(object):
+            def get_strict_controller(self, doc_type, uid):
+                return None if uid == 'evicted' else uid
+
+            def save_unit(self, ctrl):
+                saved.append(ctrl)
+
+        self._journal.start_checkpoints(_DataStore(), 0.01)
+        move = Move(TableState.Action.BET, 0, 60)
+        self._journal.append('game1', 0, move)
+        self._journal.append('evicted', 0, move)
+        self._journal.sync()
+        deadline = time.time() + 5
+        while not saved and time.time() < deadline:
+            time.sleep(0.01)
+        self._journal.close()
+        self.assertEqual(os.path.getsize(self._journal.path), 0)
+        self.assertEqual(saved, ['game1'])
+
+    def test_failed_checkpoint(self):
+        """Tests that moves of games that could not be saved are kept and
+        replayed after later moves are checkpointed."""
+
+        class _DataStore(object):
+            fail = True
+
+            def get_strict_controller(self, doc_type, uid):
+                return uid
+
+            def save_unit(self, ctrl):
+                if self.fail:
+                    raise IOError("Database unreachable.")
+
+        data_store = _DataStore()
+        first = Move(TableState.Action.BET, 0, 60)
+        second = Move(TableState.Action.BET, 1, 65)
+        self._journal.append('game1', 0, first)
+        with self.assertRaises(IOError):
+            self._journal.checkpoint(data_store)
+        self._journal.append('game1', 1, second)
+        self._journal.sync()
+        self.assertEqual(self._journal.entries(),
+                         [('game1', 0, first), ('game1', 1, second)])
+        data_store.fail = False
+        self._journal.checkpoint(data_store)
+        self.assertEqual(self._journal.entries(), [])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Unit tests for `game.matchmaking.MatchmakingQueue` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import GameCreatedTestCase
+from game.matchmaking import MatchmakingQueue
+
+
+class MatchmakingQueueTest(GameCreatedTestCase):
+    """Solo and duo matchmaking tests."""
+
+    def setUp(self):
+        super(MatchmakingQueueTest, self).setUp()
+        self._now = [0.0]
+        self._queue = MatchmakingQueue(self._ds, clock=lambda: self._now[0])
+        self._matched = None
+
+    def tearDown(self):
+        if self._matched:
+            self._matched.delete(self._ds)
+        super(MatchmakingQueueTest, self).tearDown()
+
+    def _set_elos(self, *elos):
+        for user, elo in zip(self._users, elos):
+            user.statistics.elo = elo
+
+    def test_solo_match(self):
+        """Tests that four close solos are seated in a balanced game."""
+        self._set_elos(1000.0, 1010.0, 1020.0, 1030.0)
+        for user in self._users[:3]:
+            self.assertIsNone(self._queue.enqueue(user))
+        self._matched = self._queue.enqueue(self._users[3])
+        self.assertIsREADY(self._matched)
+        self.assertEqual(self._matched.active_players(), 4)
+        self.assertEqual(self._queue.size, 0)
+        teams = dict((p.user.uid, p.team) for p in self._matched.players)
+        self.assertEqual(teams[self._users[0].uid],
+                         teams[self._users[3].uid])
+
+    def test_duo_window_widens(self):
+        """Tests that distant tickets match once their windows widen."""
+        self._set_elos(1000.0, 1000.0, 1200.0, 1200.0)
+        self.assertIsNone(self._queue.enqueue(*self._users[:2]))
+        self.assertIsNone(self._queue.enqueue(*self._users[2:4]))
+        self.assertEqual(self._queue.tick(), [])
+        self._now[0] += 60
+        games = self._queue.tick()
+        self.assertEqual(len(games), 1)
+        self._matched = games[0]
+        self.assertEqual(self._queue.size, 0)
+
+    def test_dequeue(self):
+        """Tests that a duo leaves the queue together."""
+        self._queue.enqueue(*self._users[:2])
+        self.assertTrue(self._queue.dequeue(self._users[1].uid))
+        self.assertFalse(self._queue.dequeue(self._users[0].uid))
+        self.assertEqual(self._queue.size, 0)
+        with self.assertRaises(ValueError):
+            self._queue.enqueue(*self._users[:3])
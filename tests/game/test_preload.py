@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Unit tests for `game.preload.GamePreloader` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import GameRunningTestCase
+from game import Game
+from game.preload import GamePreloader
+
+
+class GamePreloaderTest(GameRunningTestCase):
+    """Warm-start preloading tests."""
+
+    def test_preload_running(self):
+        """Tests that saved running games are restored into cache."""
+        uid = self._game.uid
+        self._game.save(self._ds)
+        self._game.delete_cache(self._ds)
+        self._game = None
+        preloader = GamePreloader(self._ds, workers=2, time_budget=10.0)
+        self.assertGreaterEqual(preloader.scan_games(), 1)
+        self.assertTrue(preloader.wait())
+        self.assertTrue(preloader.ready)
+        self.assertGreaterEqual(preloader.progress['loaded'], 1)
+        self._game = self._ds.get_strict_controller(Game, uid)
+        self.assertIsInstance(self._game, Game)
+        self.assertIsRUNNING(self._game)
+
+    def test_preload_empty(self):
+        """Tests that an empty preload is immediately ready."""
+        preloader = GamePreloader(self._ds)
+        self.assertTrue(preloader.wait())
+        self.assertEqual(preloader.progress['total'], 0)
+
+    def test_prefetch_documents(self):
+        """Tests that a game's sub-documents are read in one pass."""
+        self._game.save(self._ds)
+        self._ds._db.doc_cache.clear()
+        fetched = self._ds.prefetch_documents(Game, [self._game.uid])
+        self.assertGreater(fetched, 4)
+        cached, table = self._ds._db.doc_cache.get('Table',
+                                                   self._game.table.uid)
+        self.assertTrue(cached)
+        self.assertEqual(table['_id'], self._game.table.uid)
+        self.assertEqual(self._ds.prefetch_documents(Game,
+                                                     [self._game.uid]), 0)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Unit tests for `game.table.replay.MoveLog` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import random
+from .. import TestCase
+from game.deck.card import Card
+from game.table import TableState, MoveLog
+
+
+class MoveLogTest(TestCase):
+    """Keyframe replay, seek and binary round trip tests."""
+
+    def setUp(self):
+        super(MoveLogTest, self).setUp()
+        self._log = MoveLog(['p1', 'p2', 'p3', 'p4'])
+        self._states = {}
+        rng = random.Random(200)
+        for hand in xrange(2):
+            codes = [Card(suit, value).code for suit in Card.Suit
+                     for value in Card.Value if value != Card.Value.JOKER]
+            rng.shuffle(codes)
+            deal = [codes[4 + 12 * s:16 + 12 * s] for s in xrange(4)]
+            self._log.add_keyframe(hand + 1, hand + 1, hand, codes[:4], deal)
+            state = self._log.state_at()
+            self._states[len(self._log)] = state
+            while state.state != TableState.State.END:
+                moves = state.legal_moves()
+                if state.state == TableState.State.BETTING:
+                    move = moves[0] if state.bet_amount else moves[1]
+                else:
+                    move = rng.choice(moves)
+                self._log.append(move)
+                state = state.apply(move)
+                self._states[len(self._log)] = state
+
+    def test_state_at(self):
+        """Tests that every position replays to the recorded state."""
+        self.assertEqual(sorted(self._states), range(len(self._log) + 1))
+        for position, state in self._states.iteritems():
+            self.assertEqual(self._log.state_at(position), state)
+        self.assertEqual(self._log.state_at().state, TableState.State.END)
+
+    def test_seek(self):
+        """Tests jumping to the start of a trick."""
+        state = self._log.seek(1, 3)
+        self.assertEqual(state.round, 2)
+        self.assertEqual(state.active_cards, (None,) * 4)
+        self.assertEqual(sum(len(state.hand_cards(s)) for s in xrange(4)),
+                         52 - 4 * 3)
+        with self.assertRaises(IndexError):
+            self._log.seek(1, 13)
+
+    def test_bytes(self):
+        """Tests the binary encoding round trip."""
+        data = self._log.to_bytes()
+        log = MoveLog.from_bytes(data)
+        self.assertEqual(len(log), len(self._log))
+        self.assertEqual(log.players, self._log.players)
+        self.assertEqual(log.keyframes, self._log.keyframes)
+        self.assertEqual(log.state_at(), self._log.state_at())
+        self.assertLess(len(data), 3 * len(self._log) + 300)
+        with self.assertRaises(ValueError):
+            MoveLog.from_bytes('XXXX' + data[4:])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Unit tests for `game.table.Table` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import GameRunningTestCase
+from core.exceptions import StateError
+from game.deck.card import Card
+from game.table import Table, TableState, Move
+
+
+class TableSnapshotTest(GameRunningTestCase):
+    """Detached `TableState` tests."""
+
+    def test_snapshot(self):
+        """Tests that snapshots are detached from the live table."""
+        table = self._game.table
+        state = table.snapshot()
+        self.assertIsInstance(state, TableState)
+        self.assertIs(state.snapshot(), state)
+        self.assertEqual(state.state, Table.State.BETTING)
+        self.assertEqual(sum(len(state.hand_cards(s)) for s in xrange(4)),
+                         sum(p.hand.card_count for p in self._game.players))
+        with self.assertRaises(AttributeError):
+            state.bet_amount = 50
+
+    def test_apply(self):
+        """Tests that applying moves returns new, structurally shared states."""
+        table = self._game.table
+        state = table.snapshot()
+        seat = state.player_turn
+        new_state = state.apply(Move(TableState.Action.BET, seat, 50))
+        self.assertEqual(new_state.bet_amount, 50)
+        self.assertEqual(state.bet_amount, 0)
+        self.assertIs(new_state.hands, state.hands)
+        self.assertEqual(table.bet_amount, 0)
+        with self.assertRaises(StateError):
+            new_state.apply(Move(TableState.Action.BET, seat, 55))
+        with self.assertRaises(ValueError):
+            new_state.apply(
+                Move(TableState.Action.BET, new_state.player_turn, 50))
+
+    def test_to_table(self):
+        """Tests that a state round-trips through the live table."""
+        table = self._game.table
+        state = table.snapshot().apply(
+            Move(TableState.Action.BET, table.player_turn, 50))
+        table.load_state(state)
+        self.assertEqual(table.bet_amount, 50)
+        self.assertEqual(table.snapshot(), state)
+
+
+class TableTrickTest(GameRunningTestCase):
+    """Betting, trump and trick play through the live table."""
+
+    def test_max_bet(self):
+        """Tests that bids over the maximum are refused."""
+        table = self._game.table
+        pid = table.players[table.player_turn]
+        with self.assertRaises(ValueError):
+            table.bet(pid, TableState.MAX_BET + 5)
+        with self.assertRaises(ValueError):
+            table.snapshot().apply(Move(TableState.Action.BET,
+                                        table.player_turn, 300))
+        table.bet(pid, TableState.MAX_BET)
+        self.assertEqual(table.move_log.move(len(table.moves) - 1).value,
+                         TableState.MAX_BET)
+
+    def test_full_trick(self):
+        """Tests that a full trick goes to the winning team's discards."""
+        table = self._game.table
+        table.bet(table.players[table.player_turn], 60)
+        while table.state is Table.State.BETTING:
+            table.bet(table.players[table.player_turn], 0)
+        self.assertIs(table.state, Table.State.PLAYING)
+        bettor = table.players[table.player_turn]
+        table.set_trump_suit(bettor, Card.Suit.SPADES)
+        for _ in xrange(4):
+            pid = table.players[table.player_turn]
+            table.play_card(pid, table.legal_cards(pid)[0])
+        self.assertEqual(table.active_cards, [None] * 4)
+        self.assertEqual(len(table.discards['A'].cards) +
+                         len(table.discards['B'].cards), 4)
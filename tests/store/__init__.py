@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+"""Store tests package.
+
+.. packageauthor: zimmed <zimmed@zimmed.io>
+
+"""
+
+from .. import TestCase, main
+
+
+if __name__ == '__main__':
+    main()
+
+# ----------------------------------------------------------------------------
+__version__ = 0.1
+__license__ = "MIT"
+__credits__ = ["zimmed"]
+# ----------------------------------------------------------------------------
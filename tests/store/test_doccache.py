@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Unit tests for `store.doccache.DocumentCache` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import time
+
+from . import TestCase
+from store import DataStore
+from store.doccache import DocumentCache
+from store.user import User
+
+
+class DocumentCacheTest(TestCase):
+    """Positive and negative entry, eviction and invalidation tests."""
+
+    def setUp(self):
+        super(DocumentCacheTest, self).setUp()
+        self._cache = DocumentCache(max_entries=2, negative_ttl=60.0)
+
+    def test_copies(self):
+        """Tests that cached documents are copied in and out."""
+        document = {'_id': 'a', '__data__': {'n': 1}}
+        self._cache.put('C', 'a', document)
+        document['__data__']['n'] = 2
+        cached, found = self._cache.get('C', 'a')
+        self.assertTrue(cached)
+        self.assertEqual(found['__data__']['n'], 1)
+        found['__data__']['n'] = 3
+        self.assertEqual(self._cache.get('C', 'a')[1]['__data__']['n'], 1)
+
+    def test_negative_entry(self):
+        """Tests that a failed lookup is remembered until it expires."""
+        self.assertEqual(self._cache.get('C', 'a'), (False, None))
+        self._cache.put_missing('C', 'a')
+        self.assertEqual(self._cache.get('C', 'a'), (True, None))
+        self.assertEqual(self._cache.stats()['negative_hits'], 1)
+        expired = DocumentCache(negative_ttl=0.01)
+        expired.put_missing('C', 'a')
+        time.sleep(0.02)
+        self.assertEqual(expired.get('C', 'a'), (False, None))
+        disabled = DocumentCache(negative_ttl=0)
+        disabled.put_missing('C', 'a')
+        self.assertEqual(disabled.get('C', 'a'), (False, None))
+
+    def test_invalidate(self):
+        """Tests that invalidated entries are looked up again."""
+        self._cache.put_missing('C', 'a')
+        self._cache.put('D', 'b', {'_id': 'b'})
+        self._cache.invalidate('C', 'a')
+        self.assertEqual(self._cache.get('C', 'a'), (False, None))
+        self.assertTrue(self._cache.get('D', 'b')[0])
+        self._cache.invalidate_collection('D')
+        self.assertEqual(self._cache.get('D', 'b'), (False, None))
+
+    def test_lru(self):
+        """Tests that the least recently used entry is dropped first."""
+        self._cache.put('C', 'a', {'_id': 'a'})
+        self._cache.put_missing('C', 'b')
+        self._cache.get('C', 'a')
+        self._cache.put('C', 'c', {'_id': 'c'})
+        self.assertTrue(self._cache.get('C', 'a')[0])
+        self.assertFalse(self._cache.get('C', 'b')[0])
+        self.assertEqual(self._cache.stats()['entries'], 2)
+
+
+class StoredDocumentCacheTest(TestCase):
+    """Read-through cache tests against the database."""
+
+    def setUp(self):
+        super(StoredDocumentCacheTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._ds._db.doc_cache.clear()
+
+    def test_missing_then_inserted(self):
+        """Tests that inserting a model drops its negative entry."""
+        user = User.new(None, 'doccache', 'doccache@user.us', 'pw', self._ds)
+        try:
+            self.assertIsNone(self._ds.get_strict_model(User, user.uid))
+            hits = self._ds.document_cache_stats()['negative_hits']
+            self.assertIsNone(self._ds.get_strict_model(User, user.uid))
+            self.assertEqual(
+                self._ds.document_cache_stats()['negative_hits'], hits + 1)
+            self._ds.save(User, user.model)
+            self.assertEqual(
+                self._ds.get_strict_model(User, user.uid)['email'],
+                'doccache@user.us')
+        finally:
+            user.force_delete(self._ds)
+
+    def test_update_invalidates(self):
+        """Tests that a saved change is seen by the next read."""
+        user = User.new(None, 'doccache', 'doccache@user.us', 'pw', self._ds)
+        try:
+            self._ds.save(User, user.model)
+            self._ds.get_strict_model(User, user.uid)
+            user.profile_name = 'changed'
+            self._ds.save(User, user.model)
+            self.assertEqual(
+                self._ds.get_strict_model(User, user.uid)['profile_name'],
+                'changed')
+        finally:
+            user.force_delete(self._ds)
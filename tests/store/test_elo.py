@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Unit tests for `store.user.elo` batch recomputation.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import random
+import unittest
+from . import TestCase
+from store.user import elo
+from store.user.statistics import UserStatistics
+
+
+class _Stats(object):
+    """Bare statistics object rated by the scalar `UserStatistics` code."""
+
+    update_comp_game_stats = UserStatistics.update_comp_game_stats.__func__
+
+    def __init__(self):
+        self.elo = UserStatistics.INIT_DEFAULTS['elo']
+        self.rank = 1
+        self.games_won = self.games_lost = 0
+        self.ranked_wins = self.ranked_losses = 0
+
+    def add_game_to_history(self, game_id):
+        pass
+
+
+@unittest.skipIf(elo.np is None, "NumPy is not installed.")
+class ComputeRatingsTest(TestCase):
+    """Vectorized replay against scalar rating tests."""
+
+    def test_matches_scalar(self):
+        """Tests that replayed ratings equal the scalar ones exactly."""
+        rand = random.Random(200)
+        users = [_Stats() for _ in xrange(40)]
+        players = []
+        a_won = []
+        for g in xrange(300):
+            seats = rand.sample(xrange(len(users)), 4)
+            win = rand.random() < 0.5
+            players.append(seats)
+            a_won.append(win)
+            team_a = [users[i] for i in seats[:2]]
+            team_b = [users[i] for i in seats[2:]]
+            elo_a, elo_b = elo.team_elo(*team_a), elo.team_elo(*team_b)
+            for s in team_a:
+                s.update_comp_game_stats(str(g), elo_a, elo_b, win)
+            for s in team_b:
+                s.update_comp_game_stats(str(g), elo_b, elo_a, not win)
+        ratings, wins, losses, rank = elo.compute_ratings(
+            players, a_won, len(users))
+        for i, s in enumerate(users):
+            self.assertEqual(ratings[i], s.elo)
+            self.assertEqual(wins[i], s.ranked_wins)
+            self.assertEqual(losses[i], s.ranked_losses)
+            self.assertEqual(rank[i], s.rank)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Unit tests for `store.user.history.GameHistory` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import TestCase
+from store import DataStore
+from store.user.history import GameHistory
+from store.user.statistics import UserStatistics
+
+
+class GameHistoryTest(TestCase):
+    """History append, paging and legacy migration tests."""
+
+    def setUp(self):
+        super(GameHistoryTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._uid = self._ds.uid(UserStatistics)
+
+    def tearDown(self):
+        super(GameHistoryTest, self).tearDown()
+        self._ds._db.col(GameHistory.COLLECTION).delete_many(
+            {'user': self._uid})
+
+    def test_page(self):
+        """Tests that pages are read newest first."""
+        for seq in xrange(5):
+            GameHistory.append(self._ds, self._uid, seq, 'g' + str(seq))
+        self.assertEqual(GameHistory.page(self._ds, self._uid, 5, 0, 2),
+                         ['g4', 'g3'])
+        self.assertEqual(GameHistory.page(self._ds, self._uid, 5, 2, 2),
+                         ['g0'])
+        self.assertEqual(GameHistory.page(self._ds, self._uid, 5, 3, 2), [])
+
+    def test_append_twice(self):
+        """Tests that appending at a taken sequence number keeps the first
+        record."""
+        self.assertTrue(GameHistory.append(self._ds, self._uid, 0, 'g0'))
+        self.assertFalse(GameHistory.append(self._ds, self._uid, 0, 'g1'))
+        self.assertEqual(GameHistory.page(self._ds, self._uid, 1), ['g0'])
+        self.assertEqual(self._ds._db.col(GameHistory.COLLECTION).count(
+            {'user': self._uid}), 1)
+
+    def test_migrate_twice(self):
+        """Tests that migrating a legacy history again adds nothing."""
+        legacy = ['g' + str(n) for n in reversed(xrange(25))]
+        first = UserStatistics._migrate_history(self._ds, self._uid, legacy)
+        second = UserStatistics._migrate_history(self._ds, self._uid, legacy)
+        self.assertEqual(first, second)
+        ring, count = first
+        self.assertEqual(count, 25)
+        self.assertEqual(len(ring), UserStatistics.HISTORY_SIZE)
+        self.assertEqual(
+            GameHistory.page(self._ds, self._uid, count, 0, 30), legacy)
+        self.assertEqual(self._ds._db.col(GameHistory.COLLECTION).count(
+            {'user': self._uid}), 25)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Unit tests for `store.indexes.IndexManager` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from pymongo.errors import DuplicateKeyError
+
+from . import TestCase
+from store.indexes import IndexManager
+
+
+class _Collection(object):
+
+    def __init__(self, indexes):
+        self.indexes = dict(indexes, _id_={'key': [('_id', 1)]})
+        self.created = []
+        self.duplicates = ()
+
+    def index_information(self):
+        return self.indexes
+
+    def create_index(self, keys, name, **options):
+        if options.get('unique') and keys[0][0] in self.duplicates:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        self.created.append((keys[0][0], options))
+        self.indexes[name] = dict(options, key=keys)
+
+
+class _Database(object):
+
+    def __init__(self, **collections):
+        self.collections = collections
+
+    def col(self, collection):
+        return self.collections[collection]
+
+
+class IndexManagerTest(TestCase):
+    """Index creation, verification and slow query report tests."""
+
+    def setUp(self):
+        super(IndexManagerTest, self).setUp()
+        self._col = _Collection({
+            'compound': {'key': [('__data__.client', 1),
+                                 ('__data__.username', 1)]},
+            'email': {'key': [('__data__.email', 1)]},
+            'suffix': {'key': [('__data__.state', 1),
+                               ('__data__.profile_name', 1)]}
+        })
+        self._indexes = IndexManager(_Database(User=self._col))
+        self._indexes.declare('User', {
+            'client': {},
+            'username': {'unique': True},
+            'email': {'unique': True},
+            'profile_name': {}
+        })
+
+    def test_report(self):
+        """Tests that only matching indexes count as existing."""
+        report = self._indexes.ensure(create=False)['User']
+        self.assertEqual(report, {
+            'existing': ['client'],
+            'conflicting': ['email'],
+            'missing': ['profile_name', 'username']
+        })
+        self.assertEqual(self._col.created, [])
+
+    def test_ensure(self):
+        """Tests that missing indexes are created with their options."""
+        report = self._indexes.ensure()['User']
+        self.assertEqual(report['created'], ['profile_name', 'username'])
+        self.assertEqual(self._col.created, [
+            ('__data__.profile_name', {}),
+            ('__data__.username', {'unique': True})])
+        report = self._indexes.ensure()['User']
+        self.assertEqual(report['existing'],
+                         ['client', 'profile_name', 'username'])
+        self.assertEqual(report['created'], [])
+
+    def test_duplicates_reported(self):
+        """Tests that a unique index refused for duplicates is reported and
+        the other indexes still created."""
+        self._col.duplicates = ('__data__.username',)
+        report = self._indexes.ensure()['User']
+        self.assertEqual(report['failed'], ['username'])
+        self.assertEqual(report['created'], ['profile_name'])
+
+    def test_unique_compound(self):
+        """Tests that a unique compound index does not make its first field
+        unique."""
+        self._col.indexes['compound']['unique'] = True
+        self._indexes.declare('User', {'client': {'unique': True}})
+        report = self._indexes.ensure(create=False)['User']
+        self.assertIn('client', report['missing'])
+
+    def test_slow_query_report(self):
+        """Tests that filters on undeclared fields are counted."""
+        self._indexes.record_query('User', {'__data__.email': 'a'})
+        self._indexes.record_query('User', {'__data__.state': 1, '_id': 'x'})
+        self._indexes.record_query('User', {'__data__.state': 2})
+        self.assertEqual(self._indexes.slow_query_report(), [
+            {'collection': 'User', 'field': '__data__.state', 'count': 2}])
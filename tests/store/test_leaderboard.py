@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Unit tests for `store.user.leaderboard.Leaderboard` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import random
+from . import TestCase
+from store.user.leaderboard import Leaderboard
+
+
+class LeaderboardTest(TestCase):
+    """Rank, top-k and page query tests."""
+
+    def setUp(self):
+        super(LeaderboardTest, self).setUp()
+        rand = random.Random(200)
+        self._board = Leaderboard()
+        self._elos = {}
+        for i in xrange(500):
+            uid = 'user%d' % i
+            self._elos[uid] = round(rand.uniform(150, 3600), 1)
+            self._board.update(uid, self._elos[uid])
+
+    def _expected(self):
+        return sorted(self._elos, key=lambda u: (-self._elos[u], u))
+
+    def test_rank(self):
+        """Tests that ranks match a full sort."""
+        for pos, uid in enumerate(self._expected(), 1):
+            self.assertEqual(self._board.rank(uid), pos)
+        self.assertIsNone(self._board.rank('nobody'))
+
+    def test_update_and_remove(self):
+        """Tests that moved and removed players are re-ranked."""
+        self._elos['user7'] = 4000.0
+        self._board.update('user7', 4000.0)
+        del self._elos['user8']
+        self._board.remove('user8')
+        self.assertEqual(self._board.rank('user7'), 1)
+        self.assertEqual(self._board.size, 499)
+        self.assertEqual([uid for _, uid, _ in self._board.top(499)],
+                         self._expected())
+
+    def test_page(self):
+        """Tests position range queries."""
+        expected = self._expected()
+        page = self._board.page(100, 51)
+        self.assertEqual([p for p, _, _ in page], range(100, 151))
+        self.assertEqual([uid for _, uid, _ in page], expected[99:150])
+        self.assertEqual(len(self._board.page(490, 50)), 11)
+        self.assertEqual(self._board.page(501, 10), [])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Unit tests for `store.lease.LeaseManager` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import TestCase
+from store.lease import LeaseManager, MemoryLeaseBackend
+
+
+class _Unit(object):
+
+    def __init__(self, uid, *members):
+        self.uid = uid
+        self.members = list(members)
+
+    def cache_members(self):
+        return self.members
+
+
+class _DataStore(object):
+
+    def __init__(self):
+        self.fences = {}
+
+    def set_fence(self, doc_type, token_of):
+        self.fences[doc_type] = token_of
+
+    def fence_models(self, doc_type, tokens):
+        pass
+
+    def get_strict_controller(self, doc_type, uid):
+        return None
+
+    def reload(self, doc_type, uid):
+        pass
+
+
+class LeaseManagerTest(TestCase):
+    """Acquire, renew, expiry and fencing token tests."""
+
+    def setUp(self):
+        super(LeaseManagerTest, self).setUp()
+        self._now = [100.0]
+        self._lost = []
+        backend = MemoryLeaseBackend()
+        clock = lambda: self._now[0]
+        self._a = LeaseManager(backend, 'a', ttl=10.0, margin=1.0,
+                               on_lost=self._lost.extend, clock=clock)
+        self._b = LeaseManager(backend, 'b', ttl=10.0, margin=1.0,
+                               clock=clock)
+
+    def test_acquire(self):
+        """Tests that a held lease is not granted to another node."""
+        self.assertEqual(self._a.acquire('g1', 'g2'), {'g1': 1, 'g2': 1})
+        self.assertEqual(self._b.acquire('g2', 'g3'), {'g3': 1})
+        self.assertEqual(sorted(self._a.held), ['g1', 'g2'])
+        self.assertEqual(self._a.acquire('g1'), {'g1': 1})
+        self._a.release('g1')
+        self.assertFalse(self._a.owns('g1'))
+        self.assertEqual(self._b.acquire('g1'), {'g1': 2})
+
+    def test_expiry(self):
+        """Tests that an expired lease moves on with a higher token."""
+        self._a.acquire('g1')
+        self._now[0] += 9.5
+        self.assertIsNone(self._a.token('g1'))
+        self.assertEqual(self._b.acquire('g1'), {}, "Lease not yet expired.")
+        self._now[0] += 1.0
+        self.assertEqual(self._b.acquire('g1'), {'g1': 2})
+        self.assertEqual(self._a.renew(), ['g1'])
+        self.assertEqual(self._lost, ['g1'])
+        self.assertEqual(self._a.held, [])
+
+    def test_renew(self):
+        """Tests that renewal extends every held lease."""
+        self._a.acquire('g1', 'g2')
+        for _ in xrange(5):
+            self._now[0] += 5.0
+            self.assertEqual(self._a.renew(), [])
+        self.assertEqual(self._a.token('g2'), 1)
+        self.assertEqual(self._b.acquire('g1', 'g2'), {})
+
+    def test_member_fence(self):
+        """Tests that registered unit members are fenced by their root's
+        lease."""
+        ds = _DataStore()
+        self._a.install(ds, 'Game', members=['Table'])
+        self._a.acquire('g1')
+        self._b.acquire('g2')
+        g1 = _Unit('g1', _Unit('t1', _Unit('d1')))
+        self._a.register(g1)
+        self._a.register(_Unit('g2', _Unit('t2')))
+        self.assertEqual(ds.fences['Game']('g1'), 1)
+        self.assertEqual(ds.fences['Table']('t1'), 1)
+        self.assertEqual(ds.fences['Table']('d1'), 1)
+        self.assertIsNone(ds.fences['Table']('t2'))
+        g1.members.append(_Unit('t3'))
+        self.assertIsNone(ds.fences['Table']('t3'))
+        self._a.register(g1)
+        self.assertEqual(ds.fences['Table']('t3'), 1)
+        self._now[0] += 9.5
+        self.assertIsNone(ds.fences['Table']('t1'))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Unit tests for `DataStore` model queries.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+import types
+
+from . import TestCase
+from store import DataStore, PartialModelError
+from store.lazy import SubDocumentRef
+from store.user import User
+
+
+class ModelQueryTest(TestCase):
+    """Streaming and projected model query tests."""
+
+    def setUp(self):
+        super(ModelQueryTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._users = [
+            User.new(None, 'query' + str(x), 'query@user.us', 'pw', self._ds)
+            for x in xrange(5)]
+        for user in self._users:
+            self._ds.save(User, user.model)
+
+    def tearDown(self):
+        super(ModelQueryTest, self).tearDown()
+        for user in self._users:
+            user.force_delete(self._ds)
+
+    def test_iter_models_batches(self):
+        """Tests that streamed models span several cursor batches."""
+        models = self._ds.iter_models(User, batch_size=2,
+                                      email='query@user.us')
+        self.assertIsInstance(models, types.GeneratorType)
+        self.assertEqual(sorted(m.uid for m in models),
+                         sorted(u.uid for u in self._users))
+
+    def test_iter_models_projection(self):
+        """Tests that only the requested fields are loaded."""
+        models = list(self._ds.iter_models(User, fields=['username'],
+                                           email='query@user.us'))
+        self.assertEqual(len(models), 5)
+        for model in models:
+            self.assertEqual(sorted(dict(model)), ['uid', 'username'])
+            self.assertTrue(model['username'].startswith('query'))
+
+    def test_iter_models_unresolved(self):
+        """Tests that sub-documents are left as references by default."""
+        model = next(self._ds.iter_models(User, username='query0'))
+        self.assertIsInstance(model['statistics'], SubDocumentRef)
+        model = next(self._ds.iter_models(User, resolve=True,
+                                          username='query0'))
+        self.assertNotIsInstance(model['statistics'], SubDocumentRef)
+
+    def test_partial_model_refused(self):
+        """Tests that a partial model is only saved field by field."""
+        uid = self._users[0].uid
+        model = self._ds.get_models(User, fields=['profile_name'],
+                                    username='query0')[0]
+        model['profile_name'] = 'partial'
+        with self.assertRaises(PartialModelError):
+            self._ds.save(User, model)
+        with self.assertRaises(PartialModelError):
+            self._ds.update_model(User, model)
+        self._ds.update_model_fields(User, model)
+        self._ds._db.doc_cache.invalidate('User', uid)
+        stored = self._ds.get_strict_model(User, uid)
+        self.assertEqual(stored['profile_name'], 'partial')
+        self.assertEqual(stored['email'], 'query@user.us')
+
+    def test_merge_model(self):
+        """Tests that a merged partial model may be saved whole."""
+        uid = self._users[1].uid
+        model = self._ds.get_models(User, fields=['profile_name'],
+                                    username='query1')[0]
+        model['profile_name'] = 'merged'
+        merged = self._ds.merge_model(User, model)
+        self.assertEqual(merged['email'], 'query@user.us')
+        self._ds.save(User, merged)
+        self._ds._db.doc_cache.invalidate('User', uid)
+        self.assertEqual(
+            self._ds.get_strict_model(User, uid)['profile_name'], 'merged')
+
+    def test_raw_cached_model(self):
+        """Tests that a cached model is encoded as stored, unsaved changes
+        included, without being changed itself."""
+        user = self._users[2]
+        statistics = user.model['statistics']
+        user.profile_name = 'unsaved'
+        raw = self._ds.get_raw_model_data(User, user.uid)
+        self.assertEqual(raw['profile_name'], 'unsaved')
+        self.assertEqual(raw['statistics']['__uid__'], user.statistics.uid)
+        self.assertTrue(raw['statistics']['__sub_document__'])
+        self.assertIs(user.model['statistics'], statistics)
+        user.delete_cache(self._ds)
+        raw = self._ds.get_raw_model_data(User, user.uid)
+        self.assertEqual(raw['profile_name'], 'query')
+        self.assertEqual(raw['statistics']['__uid__'], user.statistics.uid)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Unit tests for `store.user.pairs.PairRatings` class.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import TestCase
+from store import DataStore
+from store.user.pairs import PairRatings
+
+
+class PairRatingsTest(TestCase):
+    """Pair rating update and top-k query tests."""
+
+    def setUp(self):
+        super(PairRatingsTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        PairRatings.ensure_indexes(self._ds)
+
+    def tearDown(self):
+        super(PairRatingsTest, self).tearDown()
+        self._ds._db.col(PairRatings.COLLECTION).delete_many({})
+
+    def test_record(self):
+        """Tests that both orders of a pair share one running rating."""
+        PairRatings.record(self._ds, 'a', 'b', 1000.0, True)
+        PairRatings.record(self._ds, 'b', 'a', 800.0, False)
+        pair = PairRatings.get(self._ds, 'b', 'a')
+        self.assertEqual(pair['count'], 2)
+        self.assertEqual(pair['rating'], 900.0)
+
+    def test_record_game_once(self):
+        """Tests that recording the same game again changes nothing."""
+        PairRatings.record(self._ds, 'a', 'b', 1000.0, True, 'g1')
+        PairRatings.record(self._ds, 'b', 'a', 1000.0, True, 'g1')
+        self.assertEqual(PairRatings.get(self._ds, 'a', 'b')['count'], 1)
+        PairRatings.record(self._ds, 'a', 'b', 800.0, False, 'g2')
+        self.assertEqual(PairRatings.get(self._ds, 'a', 'b')['count'], 2)
+
+    def test_best(self):
+        """Tests best partner and best pair queries."""
+        for partner, elo in (('b', 1000.0), ('c', 1200.0), ('d', 600.0)):
+            for _ in xrange(3):
+                PairRatings.record(self._ds, 'a', partner, elo, True)
+        PairRatings.record(self._ds, 'a', 'e', 3000.0, True)
+        self.assertEqual(
+            [p['partner'] for p in PairRatings.best_partners(self._ds, 'a')],
+            ['c', 'b', 'd'])
+        best = PairRatings.best_pairs(self._ds, k=1, min_games=1)
+        self.assertEqual(best[0]['users'], ['a', 'e'])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Unit tests for `DataStore` optimistic concurrency.
+
+.. moduleauthor:: Dave Zimmelman <zimmed@zimmed.io>
+
+"""
+
+from . import TestCase
+from store import DataStore, VersionConflictError
+from store.user import User
+from store.user.statistics import UserStatistics
+
+
+class ModelVersionTest(TestCase):
+    """Compare-and-set save and reload-and-retry tests."""
+
+    def setUp(self):
+        super(ModelVersionTest, self).setUp()
+        self._ds = DataStore(db_name='project200-unittest')
+        self._user = User.new(None, 'versions', 'versions@user.us', 'pw',
+                              self._ds)
+        self._ds.save(User, self._user.model)
+
+    def tearDown(self):
+        super(ModelVersionTest, self).tearDown()
+        self._user.force_delete(self._ds)
+
+    def _stored_copy(self):
+        self._ds._db.doc_cache.invalidate('User', self._user.uid)
+        return self._ds.get_strict_model(User, self._user.uid, resolve=False)
+
+    def test_conflict(self):
+        """Tests that saving over a newer version raises."""
+        first, second = self._stored_copy(), self._stored_copy()
+        version = self._ds.model_version(first)
+        first['profile_name'] = 'first'
+        self._ds.save(User, first)
+        self.assertEqual(self._ds.model_version(first), version + 1)
+        second['profile_name'] = 'second'
+        with self.assertRaises(VersionConflictError) as cm:
+            self._ds.save(User, second)
+        self.assertEqual(cm.exception.expected, version)
+        self.assertEqual(cm.exception.actual, version + 1)
+        self.assertEqual(self._stored_copy()['profile_name'], 'first')
+
+    def test_retry(self):
+        """Tests that a conflicting change is reloaded and applied again."""
+        other = self._stored_copy()
+        other['email'] = 'other@user.us'
+        self._ds.save(User, other)
+        calls = []
+
+        def change(user):
+            calls.append(user.email)
+            user.profile_name = 'retried'
+
+        self._ds.retry_on_conflict(User, self._user.uid, change)
+        self.assertEqual(calls, ['versions@user.us', 'other@user.us'])
+        stored = self._stored_copy()
+        self.assertEqual(stored['email'], 'other@user.us')
+        self.assertEqual(stored['profile_name'], 'retried')
+
+    def test_increment_over_newer(self):
+        """Tests that only increments are applied over a newer version."""
+        stats = self._user.statistics
+        self._ds._db.doc_cache.invalidate('UserStatistics', stats.uid)
+        other = self._ds.get_strict_model(UserStatistics, stats.uid,
+                                          resolve=False)
+        other['avg_win_bet'] = 80
+        self._ds.save(UserStatistics, other)
+        stats.model['games_won'] += 1
+        stats.model['avg_win_bet'] = 60
+        self._ds.increment_model_fields(UserStatistics, stats.model,
+                                        {'games_won': 1}, ['avg_win_bet'])
+        self._ds._db.doc_cache.invalidate('UserStatistics', stats.uid)
+        stored = self._ds.get_strict_model(UserStatistics, stats.uid,
+                                           resolve=False)
+        self.assertEqual(stored['games_won'], 1)
+        self.assertEqual(stored['avg_win_bet'], 80)